@@ -2,9 +2,11 @@
 Full Stack Nanodegree Capstone Project - Casting Agency API
 """
 import os
-from flask import Flask, request, abort, jsonify
+import tempfile
+
+import click
+from flask import Flask, g, request, abort, jsonify
 from flask_cors import CORS
-from flask_migrate import Migrate
 from models import (
     setup_db, db,
     Movie, Actor, MovieActor,
@@ -12,18 +14,144 @@ from models import (
     ActorCreate, ActorUpdate, ActorResponse
 )
 from pydantic import ValidationError
-from auth import AuthError, requires_auth
+from auth import AuthError, requires_auth, get_jwks_cache, get_token_cache, get_rejected_token_cache
+from listing import (
+    ListQueryError, parse_page_args, parse_list_query, check_cursor,
+    parse_projection, included_models,
+    fetch_page, fetch_one, stream_format, stream_list,
+    list_etag, item_etag, not_modified
+)
+from response_cache import ResponseCache
+from json_provider import FastJSONProvider
+from db_pool import pool_stats, warm_pool
+from replicas import ReplicaRouter
+from timing import ServerTiming, timed
+from metrics import Metrics, auth_samples, pool_samples
+from querywatch import QueryWatch
+from search import parse_search_args, search
+from bulk import (
+    parse_bulk_mode, bulk_payload, validate_items, bulk_insert,
+    bulk_selection, bulk_update, bulk_delete,
+    parse_ids, link_cast, unlink_cast
+)
+
+
+class _MigrateCommands(click.Group):
+    """
+    ``flask db``, importing Flask-Migrate (and with it Alembic) on first use.
+
+    Only the CLI needs migrations; serving processes skip the import.
+    """
+
+    def __init__(self, app):
+        super().__init__('db', help='Perform database migrations.')
+        self.app = app
+
+    def _group(self):
+        if 'migrate' not in self.app.extensions:
+            from flask_migrate import Migrate
+            Migrate(self.app, db)
+        return self.app.cli.commands['db']
+
+    def list_commands(self, ctx):
+        return self._group().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group().get_command(ctx, name)
 
 
 def create_app(test_config=None):
     """Create and configure the Flask application"""
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.config.from_mapping(
+        # Page size when a client pages without an explicit limit
+        LIST_DEFAULT_LIMIT=int(os.environ.get('LIST_DEFAULT_LIMIT', 50)),
+        # Hard cap on rows per list response, paged or not
+        LIST_MAX_LIMIT=int(os.environ.get('LIST_MAX_LIMIT', 1000)),
+        # Rows fetched per round trip when streaming a full list export
+        STREAM_BATCH_SIZE=int(os.environ.get('STREAM_BATCH_SIZE', 500)),
+        # Connection pool (per worker process)
+        DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 5)),
+        DB_MAX_OVERFLOW=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # Recycle connections before server/proxy idle timeouts cut them
+        DB_POOL_RECYCLE=int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        # Test connections on checkout so failovers don't surface as 500s
+        DB_POOL_PRE_PING=os.environ.get('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes'),
+        # PostgreSQL statement_timeout in ms (0 disables)
+        DB_STATEMENT_TIMEOUT_MS=int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0)),
+        # Set by the ASGI entry point (asgi.py): use the asyncio database driver
+        DB_ASYNC_DRIVER=False,
+        # Optional read replicas (comma-separated URLs) for GET requests
+        DATABASE_REPLICA_URLS=[
+            url.strip().replace('postgres://', 'postgresql://', 1)
+            for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+        ],
+        # Seconds a client's reads stay on the primary after it writes
+        REPLICA_LAG_WINDOW=int(os.environ.get('REPLICA_LAG_WINDOW', 5)),
+        # Seconds an unhealthy replica is skipped, and between health checks
+        REPLICA_RETRY_AFTER=float(os.environ.get('REPLICA_RETRY_AFTER', 30)),
+        REPLICA_HEALTH_INTERVAL=float(os.environ.get('REPLICA_HEALTH_INTERVAL', 5)),
+        # Per-request stage timings as a Server-Timing header and a log line
+        SERVER_TIMING=os.environ.get('SERVER_TIMING', '1').lower() in ('1', 'true', 'yes'),
+        SERVER_TIMING_LOG=os.environ.get('SERVER_TIMING_LOG', '1').lower() in ('1', 'true', 'yes'),
+        # Log statements slower than this (0 disables)
+        SLOW_QUERY_MS=float(os.environ.get('SLOW_QUERY_MS', 200)),
+        # Flag requests running one statement more than this many times (0 disables);
+        # a warning in production, an NPlusOneError under the test suite
+        N_PLUS_ONE_THRESHOLD=int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10)),
+        N_PLUS_ONE_RAISE=os.environ.get(
+            'N_PLUS_ONE_RAISE', os.environ.get('FLASK_TESTING', '0')
+        ).lower() in ('1', 'true', 'yes'),
+        # Prometheus /metrics, off unless enabled: it takes no token. METRICS_DIR
+        # (set by gunicorn.conf.py) shares the counts of every worker through files
+        METRICS=os.environ.get('METRICS', '0').lower() in ('1', 'true', 'yes'),
+        METRICS_DIR=os.environ.get('METRICS_DIR', ''),
+        METRICS_FLUSH_INTERVAL=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+        # Read path for whole rows: 'core' (row tuples) or 'orm' (entities)
+        LIST_READ_PATH=os.environ.get('LIST_READ_PATH', 'core'),
+        # Upper bound on items in one bulk request
+        BULK_MAX_ITEMS=int(os.environ.get('BULK_MAX_ITEMS', 1000)),
+        # GET response cache: 'none', 'memory' (per worker) or 'file' (shared)
+        RESPONSE_CACHE_BACKEND=os.environ.get('RESPONSE_CACHE_BACKEND', 'none'),
+        RESPONSE_CACHE_TTL=float(os.environ.get('RESPONSE_CACHE_TTL', 30)),
+        RESPONSE_CACHE_MAX_ENTRIES=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+        RESPONSE_CACHE_MAX_BYTES=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        RESPONSE_CACHE_DIR=os.environ.get(
+            'RESPONSE_CACHE_DIR',
+            os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                         'casting-agency-cache')
+        ),
+    )
+    if test_config:
+        app.config.update(test_config)
+
+    # First registered, so its after_request runs last and times the others
+    ServerTiming.from_config(app.config).init_app(app)
+    QueryWatch.from_config(app.config).init_app(app)
+    response_cache = ResponseCache.from_config(app.config)
+    app.extensions['response_cache'] = response_cache
+    replicas = ReplicaRouter.from_config(app.config)
+    replicas.init_app(app)
+
+    def named_engines():
+        engines = {}
+        if 'sqlalchemy' in app.extensions:
+            with app.app_context():
+                engines['primary'] = db.engine
+        engines.update(replicas.engines)
+        return engines
+
+    if app.config['METRICS']:
+        metrics = Metrics.from_config(app.config)
+        metrics.collectors.extend([auth_samples, lambda: pool_samples(named_engines())])
+        metrics.init_app(app)
 
     # Setup database (skip during unit tests; tests call setup_db themselves)
     if os.environ.get('FLASK_TESTING') != '1':
         setup_db(app)
-        # Setup migrations only when DB is configured
-        Migrate(app, db)
+        app.cli.add_command(_MigrateCommands(app))
 
     # Setup CORS
     CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -57,32 +185,181 @@ def create_app(test_config=None):
             }
         })
 
+    def _core_reads():
+        return app.config['LIST_READ_PATH'] == 'core'
+
+    def _page_request(model, query):
+        page = parse_page_args(
+            request.args,
+            app.config['LIST_DEFAULT_LIMIT'],
+            app.config['LIST_MAX_LIMIT']
+        )
+        check_cursor(model, query, page)
+        return page
+
+    def _stream(projection, query, key, total_key, fmt):
+        return stream_list(
+            projection, query, key, total_key, fmt == 'ndjson',
+            app.config['STREAM_BATCH_SIZE']
+        )
+
+    def _bulk_create(model, schema, key):
+        """
+        Validates the whole array in one pass, then inserts every valid item
+        with a single INSERT ... RETURNING in one transaction.
+
+        ``atomic`` (default) inserts nothing if any item is invalid;
+        ``best_effort`` inserts the valid items and reports the rest.
+        """
+        mode = parse_bulk_mode(request.args)
+        items = bulk_payload(request.get_json(silent=True), key, app.config['BULK_MAX_ITEMS'])
+        with timed('validate'):
+            valid, errors = validate_items(schema, items)
+        if not valid or (errors and mode == 'atomic'):
+            return jsonify({
+                'success': False,
+                'error': 'Validation error',
+                'errors': errors
+            }), 422
+        try:
+            # Serialized before commit expires them; RETURNING loaded every column
+            created = [obj.to_dict() for obj in bulk_insert(model, [item.model_dump() for _, item in valid])]
+            db.session.commit()
+            response_cache.invalidate(key)
+            return jsonify({
+                'success': True,
+                key: created,
+                'total_created': len(created),
+                'errors': errors
+            }), 201
+        except Exception as e:
+            db.session.rollback()
+            abort(500)
+
+    def _bulk_update(model, schema, key):
+        """Applies one validated change set to rows selected by ids or filter"""
+        data = request.get_json(silent=True)
+        condition = bulk_selection(data, model, app.config['BULK_MAX_ITEMS'])
+        try:
+            with timed('validate'):
+                changes = schema(**(data.get('set') or {})).model_dump(exclude_unset=True)
+        except (TypeError, ValidationError) as e:
+            return jsonify({
+                'success': False,
+                'error': 'Validation error',
+                'details': e.errors() if isinstance(e, ValidationError) else str(e)
+            }), 422
+        if not changes:
+            raise ListQueryError('set must change at least one field.')
+        try:
+            ids = bulk_update(model, condition, changes)
+            db.session.commit()
+            response_cache.invalidate(key, *(f'{key}:{i}' for i in ids))
+            return jsonify({
+                'success': True,
+                'updated': ids,
+                'total_updated': len(ids)
+            })
+        except Exception as e:
+            db.session.rollback()
+            abort(500)
+
+    def _bulk_delete(model, key):
+        """Deletes rows selected by ids or filter, with their cast links"""
+        condition = bulk_selection(request.get_json(silent=True), model, app.config['BULK_MAX_ITEMS'])
+        try:
+            ids = bulk_delete(model, condition)
+            db.session.commit()
+            response_cache.invalidate(key, *(f'{key}:{i}' for i in ids))
+            return jsonify({
+                'success': True,
+                'deleted': ids,
+                'total_deleted': len(ids)
+            })
+        except Exception as e:
+            db.session.rollback()
+            abort(500)
+
+    def _cast(model, owner_id, key, other_key, link):
+        """Links or unlinks one movie/actor and a list of the other side"""
+        other_ids = parse_ids(request.get_json(silent=True), f'{other_key[:-1]}_ids',
+                              app.config['BULK_MAX_ITEMS'])
+        try:
+            changed = (link_cast if link else unlink_cast)(model, owner_id, other_ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            abort(500)
+        if changed is None:
+            abort(404)
+
+        if changed:
+            response_cache.invalidate(
+                key, f'{key}:{owner_id}', other_key, *(f'{other_key}:{i}' for i in changed)
+            )
+        verb = 'linked' if link else 'unlinked'
+        return jsonify({
+            'success': True,
+            f'{key[:-1]}_id': owner_id,
+            verb: changed,
+            f'total_{verb}': len(changed)
+        })
+
     @app.route('/api/movies', methods=['GET'])
     @requires_auth('get:movies')
+    @response_cache.cached('movies', related='actors')
     def get_movies():
-        """Get all movies"""
+        """Get movies, filtered, sorted and keyset-paged by query params"""
+        projection = parse_projection(request.args, Movie, core=_core_reads())
+        query = parse_list_query(request.args, Movie)
+        fmt = stream_format(request)
+        if fmt:
+            return _stream(projection, query, 'movies', 'total_movies', fmt)
+        page = _page_request(Movie, query)
         try:
-            movies = Movie.query.order_by(Movie.id).all()
-            movies_data = [movie.to_dict() for movie in movies]
+            etag = list_etag(request, Movie, *included_models(projection))
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
 
-            return jsonify({
+            movies_data, next_cursor = fetch_page(projection, page, query)
+
+            body = {
                 'success': True,
                 'movies': movies_data,
                 'total_movies': len(movies_data)
-            })
+            }
+            if page.paged or next_cursor:
+                body['next_cursor'] = next_cursor
+            response = jsonify(body)
+            response.set_etag(etag)
+            return response
         except Exception as e:
             abort(500)
 
     @app.route('/api/movies/<int:movie_id>', methods=['GET'])
     @requires_auth('get:movies')
+    @response_cache.cached('movies', related='actors')
     def get_movie(movie_id):
-        """Get a specific movie by ID"""
-        movie = Movie.query.get_or_404(movie_id)
-
-        return jsonify({
+        """Get a specific movie by ID (optionally ?fields=, ?include=actors)"""
+        projection = parse_projection(request.args, Movie, core=_core_reads())
+        etag = item_etag(request, Movie, movie_id, *included_models(projection))
+        if etag is None:
+            abort(404)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        movie_data = fetch_one(projection, movie_id)
+        if movie_data is None:
+            abort(404)
+
+        response = jsonify({
             'success': True,
-            'movie': movie.to_dict()
+            'movie': movie_data
         })
+        response.set_etag(etag)
+        return response
 
     @app.route('/api/movies', methods=['POST'])
     @requires_auth('post:movies')
@@ -93,7 +370,8 @@ def create_app(test_config=None):
             data = request.get_json()
 
             # Validate with Pydantic
-            movie_data = MovieCreate(**data)
+            with timed('validate'):
+                movie_data = MovieCreate(**data)
 
             # Create movie
             movie = Movie(
@@ -103,6 +381,7 @@ def create_app(test_config=None):
 
             db.session.add(movie)
             db.session.commit()
+            response_cache.invalidate('movies')
 
             return jsonify({
                 'success': True,
@@ -120,6 +399,36 @@ def create_app(test_config=None):
             db.session.rollback()
             abort(500)
 
+    @app.route('/api/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies')
+    def create_movies_bulk():
+        """Create many movies in one request"""
+        return _bulk_create(Movie, MovieCreate, 'movies')
+
+    @app.route('/api/movies/<int:movie_id>/actors', methods=['POST'])
+    @requires_auth('patch:movies')
+    def link_movie_actors(movie_id):
+        """Link a movie to many actors in one statement"""
+        return _cast(Movie, movie_id, 'movies', 'actors', link=True)
+
+    @app.route('/api/movies/<int:movie_id>/actors', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    def unlink_movie_actors(movie_id):
+        """Unlink a movie from many actors in one statement"""
+        return _cast(Movie, movie_id, 'movies', 'actors', link=False)
+
+    @app.route('/api/movies/bulk', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    def update_movies_bulk():
+        """Update every movie matching the given ids or filter"""
+        return _bulk_update(Movie, MovieUpdate, 'movies')
+
+    @app.route('/api/movies/bulk', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies_bulk():
+        """Delete every movie matching the given ids or filter"""
+        return _bulk_delete(Movie, 'movies')
+
     @app.route('/api/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
     def update_movie(movie_id):
@@ -129,7 +438,8 @@ def create_app(test_config=None):
             data = request.get_json()
 
             # Validate with Pydantic
-            movie_update = MovieUpdate(**data)
+            with timed('validate'):
+                movie_update = MovieUpdate(**data)
 
             # Update only provided fields
             update_data = movie_update.model_dump(exclude_unset=True)
@@ -137,6 +447,7 @@ def create_app(test_config=None):
                 setattr(movie, key, value)
 
             db.session.commit()
+            response_cache.invalidate('movies', f'movies:{movie_id}')
 
             return jsonify({
                 'success': True,
@@ -163,6 +474,7 @@ def create_app(test_config=None):
 
             db.session.delete(movie)
             db.session.commit()
+            response_cache.invalidate('movies', f'movies:{movie_id}')
 
             return jsonify({
                 'success': True,
@@ -174,30 +486,59 @@ def create_app(test_config=None):
 
     @app.route('/api/actors', methods=['GET'])
     @requires_auth('get:actors')
+    @response_cache.cached('actors', related='movies')
     def get_actors():
-        """Get all actors"""
+        """Get actors, filtered, sorted and keyset-paged by query params"""
+        projection = parse_projection(request.args, Actor, core=_core_reads())
+        query = parse_list_query(request.args, Actor)
+        fmt = stream_format(request)
+        if fmt:
+            return _stream(projection, query, 'actors', 'total_actors', fmt)
+        page = _page_request(Actor, query)
         try:
-            actors = Actor.query.order_by(Actor.id).all()
-            actors_data = [actor.to_dict() for actor in actors]
+            etag = list_etag(request, Actor, *included_models(projection))
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
 
-            return jsonify({
+            actors_data, next_cursor = fetch_page(projection, page, query)
+
+            body = {
                 'success': True,
                 'actors': actors_data,
                 'total_actors': len(actors_data)
-            })
+            }
+            if page.paged or next_cursor:
+                body['next_cursor'] = next_cursor
+            response = jsonify(body)
+            response.set_etag(etag)
+            return response
         except Exception as e:
             abort(500)
 
     @app.route('/api/actors/<int:actor_id>', methods=['GET'])
     @requires_auth('get:actors')
+    @response_cache.cached('actors', related='movies')
     def get_actor(actor_id):
-        """Get a specific actor by ID"""
-        actor = Actor.query.get_or_404(actor_id)
-
-        return jsonify({
+        """Get a specific actor by ID (optionally ?fields=, ?include=movies)"""
+        projection = parse_projection(request.args, Actor, core=_core_reads())
+        etag = item_etag(request, Actor, actor_id, *included_models(projection))
+        if etag is None:
+            abort(404)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        actor_data = fetch_one(projection, actor_id)
+        if actor_data is None:
+            abort(404)
+
+        response = jsonify({
             'success': True,
-            'actor': actor.to_dict()
+            'actor': actor_data
         })
+        response.set_etag(etag)
+        return response
 
     @app.route('/api/actors', methods=['POST'])
     @requires_auth('post:actors')
@@ -208,7 +549,8 @@ def create_app(test_config=None):
             data = request.get_json()
 
             # Validate with Pydantic
-            actor_data = ActorCreate(**data)
+            with timed('validate'):
+                actor_data = ActorCreate(**data)
 
             # Create actor
             actor = Actor(
@@ -219,6 +561,7 @@ def create_app(test_config=None):
 
             db.session.add(actor)
             db.session.commit()
+            response_cache.invalidate('actors')
 
             return jsonify({
                 'success': True,
@@ -236,6 +579,36 @@ def create_app(test_config=None):
             db.session.rollback()
             abort(500)
 
+    @app.route('/api/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors')
+    def create_actors_bulk():
+        """Create many actors in one request"""
+        return _bulk_create(Actor, ActorCreate, 'actors')
+
+    @app.route('/api/actors/<int:actor_id>/movies', methods=['POST'])
+    @requires_auth('patch:actors')
+    def link_actor_movies(actor_id):
+        """Link an actor to many movies in one statement"""
+        return _cast(Actor, actor_id, 'actors', 'movies', link=True)
+
+    @app.route('/api/actors/<int:actor_id>/movies', methods=['DELETE'])
+    @requires_auth('patch:actors')
+    def unlink_actor_movies(actor_id):
+        """Unlink an actor from many movies in one statement"""
+        return _cast(Actor, actor_id, 'actors', 'movies', link=False)
+
+    @app.route('/api/actors/bulk', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actors_bulk():
+        """Update every actor matching the given ids or filter"""
+        return _bulk_update(Actor, ActorUpdate, 'actors')
+
+    @app.route('/api/actors/bulk', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors_bulk():
+        """Delete every actor matching the given ids or filter"""
+        return _bulk_delete(Actor, 'actors')
+
     @app.route('/api/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def update_actor(actor_id):
@@ -246,7 +619,8 @@ def create_app(test_config=None):
             data = request.get_json()
 
             # Validate with Pydantic
-            actor_update = ActorUpdate(**data)
+            with timed('validate'):
+                actor_update = ActorUpdate(**data)
 
             # Update only provided fields
             update_data = actor_update.model_dump(exclude_unset=True)
@@ -254,6 +628,7 @@ def create_app(test_config=None):
                 setattr(actor, key, value)
 
             db.session.commit()
+            response_cache.invalidate('actors', f'actors:{actor_id}')
 
             return jsonify({
                 'success': True,
@@ -280,6 +655,7 @@ def create_app(test_config=None):
         try:
             db.session.delete(actor)
             db.session.commit()
+            response_cache.invalidate('actors', f'actors:{actor_id}')
 
             return jsonify({
                 'success': True,
@@ -289,6 +665,35 @@ def create_app(test_config=None):
             db.session.rollback()
             abort(500)
 
+    @app.route('/api/search', methods=['GET'])
+    @requires_auth()
+    def search_all():
+        """Search movie titles and actor names the caller may read, best match first"""
+        query = parse_search_args(request.args, g.current_user.get('permissions', []))
+        try:
+            results = search(query)
+            return jsonify({
+                'success': True,
+                'results': results,
+                'total_results': len(results)
+            })
+        except Exception as e:
+            abort(500)
+
+    @app.route('/api/admin/stats', methods=['GET'])
+    @requires_auth('get:stats')
+    def get_stats():
+        """Cache and connection pool counters for this worker"""
+        return jsonify({
+            'success': True,
+            'db_pool': pool_stats(db.engine),
+            'replica_pools': {key: pool_stats(engine) for key, engine in replicas.engines.items()},
+            'replicas': replicas.stats(),
+            'response_cache': response_cache.stats(),
+            'token_cache': get_token_cache().stats(),
+            'rejected_token_cache': get_rejected_token_cache().stats()
+        })
+
     # ========================================================================
     # Error Handlers
     # ========================================================================
@@ -300,6 +705,15 @@ def create_app(test_config=None):
         response.status_code = ex.status_code
         return response
 
+    @app.errorhandler(ListQueryError)
+    def handle_list_query_error(ex):
+        """Handle malformed list query parameters"""
+        return jsonify({
+            'success': False,
+            'error': 400,
+            'message': str(ex)
+        }), 400
+
     @app.errorhandler(400)
     def bad_request(error):
         return jsonify({
@@ -343,6 +757,42 @@ def create_app(test_config=None):
     return app
 
 
+def app_engines(app):
+    """Every engine ``app`` has created: the primary's and the read replicas'."""
+    engines = []
+    if 'sqlalchemy' in app.extensions:
+        with app.app_context():
+            engines.extend(db.engines.values())
+    engines.extend(app.extensions['replicas'].engines.values())
+    return engines
+
+
+def warm_up(app, connections=None):
+    """
+    Opens pool connections and fetches the JWKS before traffic arrives.
+
+    ``connections`` per engine defaults to ``DB_POOL_SIZE``. Failures are
+    logged, not raised: a worker that boots while the database or the IdP
+    is briefly unreachable still serves once they are back.
+    """
+    if connections is None:
+        connections = app.config['DB_POOL_SIZE']
+    engines = []
+    if 'sqlalchemy' in app.extensions:
+        with app.app_context():
+            engines.append(db.engine)
+    engines.extend(app.extensions['replicas'].all_engines())
+    for engine in engines:
+        try:
+            warm_pool(engine, connections)
+        except Exception:
+            app.logger.warning('Could not open connections to %s', engine.url, exc_info=True)
+    try:
+        get_jwks_cache().refresh()
+    except Exception:
+        app.logger.warning('Could not fetch the JWKS; it will be fetched on first use', exc_info=True)
+
+
 # Create the app instance (skip during unit tests to avoid connecting to default DB)
 if os.environ.get('FLASK_SKIP_APP_INIT_FOR_TESTS') == '1':
     APP = None
@@ -0,0 +1,158 @@
+"""
+ASGI entry point: the same API as ``app:APP`` for asyncio servers.
+
+    uvicorn asgi:APP --workers 4
+
+Routes, auth and error handlers are the Flask app's own, so both entry
+points answer every request identically. What changes is the database I/O:
+the engine uses the asyncio driver (asyncpg, or aiosqlite for SQLite) and
+each request runs in a greenlet on the event loop through SQLAlchemy's
+asyncio bridge. A request waiting on the database yields the loop to the
+others instead of holding a worker thread.
+"""
+import io
+import sys
+
+from sqlalchemy.util import greenlet_spawn
+
+from app import app_engines, create_app as create_wsgi_app, warm_up
+
+# Marks the end of a response body iterator
+_END = object()
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI HTTP ``scope`` and its request ``body``."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries paths as latin-1 decoded bytes
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+def _write(data):
+    raise NotImplementedError('The WSGI write() callable is not supported; return an iterable')
+
+
+class ASGIApp:
+    """Serves a Flask app over ASGI, one greenlet per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    def startup(self):
+        """Warms the pools; async connections only work on the loop."""
+        warm_up(self.app)
+
+    def shutdown(self):
+        """Closes pooled connections while their event loop still runs."""
+        for engine in app_engines(self.app):
+            engine.dispose()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await greenlet_spawn(self.startup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await greenlet_spawn(self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            return _write
+
+        chunks = await greenlet_spawn(self.app, _environ(scope, b''.join(body)), start_response)
+        try:
+            iterator = iter(chunks)
+            # Streamed bodies query the database as they go, so every chunk
+            # is produced inside a greenlet as well
+            chunk = await greenlet_spawn(next, iterator, _END)
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers
+                ],
+            })
+            if chunk is _END:
+                await send({'type': 'http.response.body', 'body': b''})
+            while chunk is not _END:
+                following = await greenlet_spawn(next, iterator, _END)
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': following is not _END,
+                })
+                chunk = following
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                await greenlet_spawn(close)
+
+
+def create_app(test_config=None):
+    """The API from ``app.create_app`` on the asyncio driver, as an ASGI app."""
+    return ASGIApp(create_wsgi_app({**(test_config or {}), 'DB_ASYNC_DRIVER': True}))
+
+
+def __getattr__(name):
+    # ``asgi:APP`` is built on first access rather than at import, so
+    # importing this module needs neither asyncpg nor a reachable database
+    global APP
+    if name == 'APP':
+        APP = create_app()
+        return APP
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
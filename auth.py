@@ -1,14 +1,21 @@
 """
 Auth0 authentication utilities and @requires_auth decorator
 """
+import hashlib
 import json
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from urllib.request import urlopen
 
-from jose import jwt
+from jose import jwk, jwt
 from flask import request, abort, g
 
+from timing import timed
+
 
 class AuthError(Exception):
     """Standard Auth error wrapper to be JSON-serialized by error handlers."""
@@ -24,6 +31,215 @@ AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "")
 # Accept both names; prefer API_AUDIENCE per rubric/sample
 API_AUDIENCE = os.getenv("API_AUDIENCE", os.getenv("AUTH0_AUDIENCE", ""))
 ALGORITHMS = os.getenv("ALGORITHMS", "RS256").split(",")
+# JWKS location; defaults to the tenant's well-known URL. Accepts file:// and
+# http://localhost URLs so the API can be run and tested offline.
+JWKS_URL = os.getenv("AUTH0_JWKS_URL", "")
+JWKS_CACHE_TTL = float(os.getenv("JWKS_CACHE_TTL", "600"))
+JWKS_STALE_TTL = float(os.getenv("JWKS_STALE_TTL", "3600"))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", "3"))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+# Verified-token cache; entries live until the token's exp, capped by max age.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_MAX_AGE = float(os.getenv("TOKEN_CACHE_MAX_AGE", "300"))
+# Rejected tokens are remembered briefly so replays fail without any crypto.
+REJECTED_TOKEN_CACHE_SIZE = int(os.getenv("REJECTED_TOKEN_CACHE_SIZE", "4096"))
+REJECTED_TOKEN_CACHE_TTL = float(os.getenv("REJECTED_TOKEN_CACHE_TTL", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache:
+    """In-process store of the signing keys published at a JWKS URL.
+
+    Keys are parsed into ``jose`` key objects once per ``kid``. The set is
+    served from memory for ``ttl`` seconds; for the following ``stale_ttl``
+    seconds it is still served while a background thread refreshes it. A
+    ``kid`` that is not in the set forces one synchronous refresh, at most
+    once per ``min_refresh_interval``, so key rotation is picked up without
+    letting unknown kids turn into a fetch per request.
+    """
+
+    def __init__(self, url, ttl=JWKS_CACHE_TTL, stale_ttl=JWKS_STALE_TTL,
+                 timeout=JWKS_FETCH_TIMEOUT,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.min_refresh_interval = min_refresh_interval
+        self.fetches = 0
+        self.lookups = 0
+        # Bumped whenever the published key set changes (rotation/revocation).
+        self.version = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = float("-inf")
+        self._last_forced = float("-inf")
+        self._lock = threading.Lock()
+        self._background = None
+
+    def get_key(self, kid):
+        """Returns the parsed key for ``kid``, or None if the IdP has none."""
+        self.lookups += 1
+        now = time.monotonic()
+        if self._fetched_at is None or now - self._fetched_at >= self.ttl + self.stale_ttl:
+            self._refresh_or_serve_stale(now)
+        elif now - self._fetched_at >= self.ttl:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and now - self._last_forced >= self.min_refresh_interval:
+            self._last_forced = now
+            self._refresh_or_serve_stale(now, force=True)
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self):
+        """Fetches the key set now. Concurrent callers share a single fetch."""
+        requested_at = time.monotonic()
+        with self._lock:
+            if self._last_attempt >= requested_at:
+                return
+            self._last_attempt = time.monotonic()
+            self.fetches += 1
+            with urlopen(self.url, timeout=self.timeout) as response:
+                document = json.loads(response.read())
+            keys = self._parse(document)
+            if self._keys and keys.keys() != self._keys.keys():
+                self.version += 1
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh_or_serve_stale(self, now, force=False):
+        if not force and self._keys and now - self._last_attempt < self.min_refresh_interval:
+            return
+        try:
+            self.refresh()
+        except Exception:
+            if not self._keys:
+                raise
+            logger.warning("JWKS refresh from %s failed; serving cached keys", self.url, exc_info=True)
+
+    def _refresh_in_background(self):
+        if self._background is not None and self._background.is_alive():
+            return
+        self._background = threading.Thread(target=self._refresh_or_serve_stale, args=(time.monotonic(),), daemon=True)
+        self._background.start()
+
+    def stats(self):
+        return {
+            "keys": len(self._keys),
+            "version": self.version,
+            "lookups": self.lookups,
+            "fetches": self.fetches,
+        }
+
+    @staticmethod
+    def _parse(document):
+        keys = {}
+        for key in document.get("keys", []):
+            if key.get("kty") != "RSA" or "kid" not in key:
+                continue
+            try:
+                keys[key["kid"]] = jwk.construct(
+                    {k: key[k] for k in ("kty", "kid", "use", "n", "e") if k in key},
+                    key.get("alg", ALGORITHMS[0]),
+                )
+            except Exception:
+                logger.warning("Skipping unusable JWKS key %s", key.get("kid"))
+        return keys
+
+
+class TokenCache:
+    """Bounded LRU of per-token verification results keyed by SHA-256.
+
+    Holds verified payloads (and, in a second instance, rejections). An
+    entry lives until the given ``exp``, capped at ``max_age`` seconds.
+    Every lookup carries the key-set generation it was verified against;
+    when the generation changes the whole cache is dropped, so a rotated or
+    revoked key never keeps vouching for old tokens.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, max_age=TOKEN_CACHE_MAX_AGE):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token, generation):
+        """Returns the cached value for ``token``, or None on a miss."""
+        digest = self.digest(token)
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, token, value, generation, exp=None):
+        expires_at = time.time() + self.max_age
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        digest = self.digest(token)
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[digest] = (value, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+
+_jwks_cache = None
+_token_cache = TokenCache()
+_rejected_token_cache = TokenCache(REJECTED_TOKEN_CACHE_SIZE, REJECTED_TOKEN_CACHE_TTL)
+
+
+def get_token_cache():
+    """Returns the process-wide verified-token cache."""
+    return _token_cache
+
+
+def get_rejected_token_cache():
+    """Returns the process-wide cache of recently rejected tokens."""
+    return _rejected_token_cache
+
+
+def get_jwks_cache():
+    """Returns the process-wide JWKS cache for the configured tenant."""
+    global _jwks_cache
+    url = JWKS_URL or f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+    if _jwks_cache is None or _jwks_cache.url != url:
+        _jwks_cache = JWKSCache(url)
+    return _jwks_cache
 
 
 def get_token_auth_header():
@@ -59,15 +275,44 @@ def check_permissions(permission, payload):
     return True
 
 
+def _cache_generation(jwks):
+    # Anything that changes what "valid" means invalidates cached payloads.
+    return (jwks.url, jwks.version, AUTH0_DOMAIN, API_AUDIENCE, tuple(ALGORITHMS))
+
+
 def verify_decode_jwt(token):
     """Verifies a JWT using Auth0 JWKS and returns the decoded payload."""
     if not AUTH0_DOMAIN or not API_AUDIENCE:
         raise AuthError({"code": "misconfigured", "description": "AUTH0_DOMAIN and API_AUDIENCE must be configured."}, 500)
 
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+    jwks = get_jwks_cache()
+    generation = _cache_generation(jwks)
+    token_cache = get_token_cache()
+    payload = token_cache.get(token, generation)
+    if payload is not None:
+        return payload
+
+    rejected_cache = get_rejected_token_cache()
+    rejection = rejected_cache.get(token, generation)
+    if rejection is not None:
+        raise AuthError(*rejection)
+
+    try:
+        payload = _verify_token(token, jwks)
+    except AuthError as ex:
+        # Expired tokens are rejected before any crypto runs; caching them buys nothing.
+        if ex.error["code"] != "token_expired":
+            rejected_cache.put(token, (ex.error, ex.status_code), _cache_generation(jwks))
+        raise
+
+    token_cache.put(token, payload, _cache_generation(jwks), payload.get("exp"))
+    return payload
+
+
+def _verify_token(token, jwks):
     try:
         unverified_header = jwt.get_unverified_header(token)
+        unverified_claims = jwt.get_unverified_claims(token)
     except Exception:
         # Token malformado ou ilegível
         raise AuthError({"code": "invalid_header", "description": "Unable to parse authentication token."}, 400)
@@ -76,33 +321,26 @@ def verify_decode_jwt(token):
         # We expect RS256 tokens only
         raise AuthError({"code": "invalid_header", "description": "Invalid header. Use an RS256 signed JWT Access Token."}, 401)
 
-    rsa_key = {}
     if "kid" not in unverified_header:
         raise AuthError({"code": "invalid_header", "description": "Authorization malformed."}, 401)
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
-            break
-
-    if not rsa_key:
+    # Cheap pre-check: an expired token can never verify, so skip the key lookup and RS256.
+    exp = unverified_claims.get("exp")
+    if isinstance(exp, (int, float)) and exp <= time.time():
+        raise AuthError({"code": "token_expired", "description": "Token expired."}, 401)
+
+    rsa_key = jwks.get_key(unverified_header["kid"])
+    if rsa_key is None:
         raise AuthError({"code": "invalid_header", "description": "Unable to find the appropriate key."}, 401)
 
     try:
-        payload = jwt.decode(
+        return jwt.decode(
             token,
             rsa_key,
             algorithms=ALGORITHMS,
             audience=API_AUDIENCE,
             issuer=f"https://{AUTH0_DOMAIN}/",
         )
-        return payload
     except jwt.ExpiredSignatureError:
         raise AuthError({"code": "token_expired", "description": "Token expired."}, 401)
     except jwt.JWTClaimsError:
@@ -117,9 +355,10 @@ def requires_auth(permission=""):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with timed("auth"):
+                token = get_token_auth_header()
+                payload = verify_decode_jwt(token)
+                check_permissions(permission, payload)
             # Attach payload to request context if needed downstream (Flask 3)
             g.current_user = payload
             return f(*args, **kwargs)
@@ -0,0 +1,95 @@
+"""
+Serialization benchmark for a 10k-row list response.
+
+Compares the stock Flask provider (rows pre-formatted with isoformat(), as
+to_dict used to do) with FastJSONProvider on both of its paths, and checks
+that all three produce identical bytes. The rows are run three times:
+ASCII only, which orjson encodes alone; with non-ASCII names, which are
+escaped in orjson's output; and with exponent-notation floats, which the
+stdlib re-encodes.
+
+    python benchmarks/bench_json.py [--rows 10000] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_provider import FastJSONProvider  # noqa: E402
+
+
+def make_rows(count, first_name='Actor'):
+    start = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    return [
+        {
+            'id': i,
+            'name': f'{first_name} {i}',
+            'age': 20 + i % 60,
+            'gender': 'Female' if i % 2 else 'Male',
+            'created_at': start + timedelta(seconds=i),
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def best_of(repeat, cases):
+    """Best time per case, taking the cases in turn so drift hits them alike."""
+    best = {name: float('inf') for name, _ in cases}
+    for _ in range(repeat):
+        for name, fn in cases:
+            started = time.perf_counter()
+            fn()
+            best[name] = min(best[name], time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    stock = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    stdlib = FastJSONProvider(app)
+    stdlib.use_orjson = False
+    if not fast.use_orjson:
+        print('orjson is not installed; the orjson rows measure the stdlib fallback')
+
+    datasets = (
+        ('ASCII', make_rows(args.rows)),
+        ('non-ASCII', make_rows(args.rows, 'Zoë')),
+        ('exponent floats', [{**row, 'score': row['id'] * 1e-7} for row in make_rows(args.rows)]),
+    )
+    for label, rows in datasets:
+        def run_stock():
+            formatted = [{**row, 'created_at': row['created_at'].isoformat()} for row in rows]
+            return stock.response({'success': True, 'actors': formatted}).get_data()
+
+        cases = [
+            ('flask default + isoformat()', run_stock),
+            ('FastJSONProvider (stdlib)', lambda: stdlib.response({'success': True, 'actors': rows}).get_data()),
+            ('FastJSONProvider (orjson)', lambda: fast.response({'success': True, 'actors': rows}).get_data()),
+        ]
+
+        with app.app_context():
+            outputs = {name: fn() for name, fn in cases}
+            if len(set(outputs.values())) != 1:
+                sys.exit(f'Providers disagree on the encoded bytes ({label})')
+
+            best = best_of(args.repeat, cases)
+            baseline = best[cases[0][0]]
+            print(f'{label}: {args.rows} rows, {len(outputs[cases[0][0]])} bytes, best of {args.repeat}')
+            for name, elapsed in best.items():
+                print(f'  {name:<30} {elapsed * 1000:8.2f} ms  {baseline / elapsed:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,526 @@
+"""
+Offline load benchmark: every route of app.py under concurrent clients.
+
+Seeds a reproducible dataset, starts the API under gunicorn (or uvicorn for
+asgi:APP) with tokens verified against a local JWKS stub, then drives each
+endpoint with ``--clients`` keep-alive connections for ``--duration``
+seconds. Reports throughput and p50/p95/p99 latency per endpoint as JSON;
+``--compare`` prints the change against an earlier run.
+
+    python benchmarks/bench_load.py --actors 100000 --movies 20000 --links 1000000 \\
+        --output before.json
+    python benchmarks/bench_load.py --output after.json --compare before.json
+
+The database (``--database-url``, default a SQLite file under /tmp) is
+seeded once and reused while its row counts match the requested dataset;
+pass ``--reseed`` to rebuild it. Write endpoints change the data, so runs
+compare best on a freshly seeded database.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth_stub import jwks_document, make_key_pair, mint_token  # noqa: E402
+
+DOMAIN = 'bench.casting-agency.local'
+AUDIENCE = 'casting-agency'
+PERMISSIONS = [
+    'get:actors', 'post:actors', 'patch:actors', 'delete:actors',
+    'get:movies', 'post:movies', 'patch:movies', 'delete:movies',
+    'get:stats',
+]
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Alice', 'Ana', 'Ben', 'Bruno', 'Carla', 'Chen', 'Dana', 'David',
+    'Elena', 'Emil', 'Farah', 'Felix', 'Grace', 'Hugo', 'Ines', 'Ivan', 'Jana', 'Jonas',
+    'Kara', 'Kenji', 'Lena', 'Luis', 'Maya', 'Milo', 'Nadia', 'Noah', 'Olga', 'Omar',
+    'Paula', 'Pedro', 'Quinn', 'Rosa', 'Rui', 'Sara', 'Sven', 'Tara', 'Theo', 'Uma',
+]
+LAST_NAMES = [
+    'Almeida', 'Berg', 'Costa', 'Duarte', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ito',
+    'Jensen', 'Kowalski', 'Lopez', 'Moreau', 'Nakamura', 'Novak', 'Okafor', 'Petrov',
+    'Quintero', 'Rossi', 'Silva', 'Tanaka', 'Urban', 'Varga', 'Weber', 'Yilmaz', 'Zhang',
+]
+TITLE_WORDS = [
+    'Silent', 'Crimson', 'Midnight', 'Golden', 'Broken', 'Hidden', 'Last', 'Frozen',
+    'Electric', 'Distant', 'River', 'Empire', 'Garden', 'Harbor', 'Signal', 'Orchard',
+    'Shadow', 'Summer', 'Winter', 'Voyage', 'Machine', 'Letter', 'Island', 'Station',
+]
+GENDERS = ['Female', 'Male', 'Non-binary']
+
+
+# ----------------------------------------------------------------------------
+# Dataset
+# ----------------------------------------------------------------------------
+
+def actor_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def movie_title(rng):
+    return f'{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {rng.randint(1, 999)}'
+
+
+def seed_database(url, actors, movies, links, seed, reseed=False, batch=10000):
+    """Creates the schema and the dataset unless it is already in place."""
+    from sqlalchemy import create_engine, func, select
+    from models import db, Actor, Movie, MovieActor
+
+    engine = create_engine(url)
+    try:
+        if reseed:
+            db.metadata.drop_all(engine)
+        db.metadata.create_all(engine)
+        with engine.connect() as conn:
+            counts = tuple(conn.scalar(select(func.count()).select_from(model))
+                           for model in (Actor, Movie, MovieActor))
+        links = min(links, actors * movies)
+        if counts == (actors, movies, links):
+            log(f'Reusing seeded database ({actors} actors, {movies} movies, {links} links)')
+            return
+        if any(counts):
+            db.metadata.drop_all(engine)
+            db.metadata.create_all(engine)
+
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        epoch = datetime(2020, 1, 1)
+        with engine.begin() as conn:
+            for offset in range(0, actors, batch):
+                conn.execute(Actor.__table__.insert(), [
+                    {'name': actor_name(rng), 'age': rng.randint(18, 90), 'gender': rng.choice(GENDERS)}
+                    for _ in range(offset, min(offset + batch, actors))
+                ])
+            for offset in range(0, movies, batch):
+                conn.execute(Movie.__table__.insert(), [
+                    {'title': movie_title(rng),
+                     'release_date': epoch - timedelta(days=rng.randint(0, 365 * 80))}
+                    for _ in range(offset, min(offset + batch, movies))
+                ])
+            # Distinct actors per movie, spread as evenly as the counts allow
+            rows = []
+            per_movie, extra = divmod(links, movies)
+            for movie_id in range(1, movies + 1):
+                count = min(per_movie + (movie_id <= extra), actors)
+                rows.extend({'movie_id': movie_id, 'actor_id': actor_id}
+                            for actor_id in rng.sample(range(1, actors + 1), count))
+                if len(rows) >= batch:
+                    conn.execute(MovieActor.__table__.insert(), rows)
+                    rows = []
+            if rows:
+                conn.execute(MovieActor.__table__.insert(), rows)
+        log(f'Seeded {actors} actors, {movies} movies, {links} links '
+            f'in {time.perf_counter() - started:.1f}s')
+    finally:
+        engine.dispose()
+
+
+# ----------------------------------------------------------------------------
+# Auth stub and server
+# ----------------------------------------------------------------------------
+
+def start_jwks_stub(key, port=0):
+    """Serves the key's JWKS document over HTTP; returns (server, jwks_url)."""
+    body = json.dumps(jwks_document(key)).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/.well-known/jwks.json'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, database_url, jwks_url, workers, port):
+    """Starts the API under gunicorn as a child process."""
+    env = {
+        **os.environ,
+        'DATABASE_URL': database_url,
+        'AUTH0_DOMAIN': DOMAIN,
+        'API_AUDIENCE': AUDIENCE,
+        'AUTH0_JWKS_URL': jwks_url,
+        'PORT': str(port),
+        'WEB_CONCURRENCY': str(workers),
+        # Worker recycling would drop keep-alive connections mid-run
+        'GUNICORN_MAX_REQUESTS': os.environ.get('GUNICORN_MAX_REQUESTS', '0'),
+        # Off by default; on here so the /metrics scenario has an endpoint
+        'METRICS': os.environ.get('METRICS', '1'),
+    }
+    for name in ('FLASK_TESTING', 'FLASK_SKIP_APP_INIT_FOR_TESTS'):
+        env.pop(name, None)
+    target = 'app:APP'
+    if kind == 'asgi':
+        env['GUNICORN_WORKER_CLASS'] = 'uvicorn.workers.UvicornWorker'
+        target = 'asgi:APP'
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', target],
+        cwd=ROOT, env=env,
+        # The access log goes to stdout; errors still reach stderr
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f'Server exited with status {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    sys.exit('Server did not become ready within 30s')
+
+
+# ----------------------------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------------------------
+
+class Scenario:
+    """One endpoint under load: builds requests and says which statuses are OK."""
+
+    def __init__(self, name, build, ok=(200,)):
+        self.name = name
+        # build(rng) -> (method, path, body[, headers]), or None when out of work
+        self.build = build
+        self.ok = set(ok)
+
+
+def scenarios(dataset):
+    """
+    Every route of app.py; write endpoints feed the ids their deletes use.
+
+    Builders take the calling client's ``random.Random``, so each client's
+    request sequence is reproducible on its own.
+    """
+    actors, movies = dataset['actors'], dataset['movies']
+    created = {'actors': [], 'movies': [], 'actors_bulk': [], 'movies_bulk': []}
+    lock = threading.Lock()
+
+    def actor_id(rng):
+        return rng.randint(1, actors)
+
+    def movie_id(rng):
+        return rng.randint(1, movies)
+
+    def actor_body(rng):
+        return {'name': actor_name(rng), 'age': rng.randint(18, 90), 'gender': rng.choice(GENDERS)}
+
+    def movie_body(rng):
+        day = datetime(2000, 1, 1) + timedelta(days=rng.randint(0, 9000))
+        return {'title': movie_title(rng), 'release_date': day.isoformat()}
+
+    def take(key, count=1):
+        with lock:
+            if len(created[key]) < count:
+                return None
+            ids, created[key][:] = created[key][:count], created[key][count:]
+            return ids
+
+    def remember(key, field):
+        def record(data):
+            items = data[field] if isinstance(data[field], list) else [data[field]]
+            with lock:
+                created[key].extend(item['id'] for item in items)
+        return record
+
+    def delete_one(key, path):
+        def build(rng):
+            ids = take(key)
+            return ids and ('DELETE', f'{path}/{ids[0]}', None)
+        return build
+
+    def bulk_delete(key, path):
+        def build(rng):
+            ids = take(key, 50)
+            return ids and ('DELETE', f'{path}/bulk', {'ids': ids})
+        return build
+
+    def sample(rng, count, size=5):
+        # A small --actors/--movies dataset may hold fewer rows than size
+        return rng.sample(range(1, count + 1), min(size, count))
+
+    return [
+        Scenario('GET /', lambda rng: ('GET', '/', None)),
+        Scenario('GET /api/actors', lambda rng: ('GET', '/api/actors?limit=50', None)),
+        Scenario('GET /api/actors filtered', lambda rng: (
+            'GET', f'/api/actors?gender={rng.choice(GENDERS)}&age_min={rng.randint(18, 60)}'
+                   f'&sort=-age&limit=50', None)),
+        Scenario('GET /api/actors fields', lambda rng: ('GET', '/api/actors?fields=id,name&limit=200', None)),
+        Scenario('GET /api/actors ndjson', lambda rng: (
+            'GET', f'/api/actors?stream=1&name_prefix={rng.choice(FIRST_NAMES)}', None,
+            {'Accept': 'application/x-ndjson'})),
+        Scenario('GET /api/actors/<id>', lambda rng: ('GET', f'/api/actors/{actor_id(rng)}', None)),
+        Scenario('GET /api/actors/<id> include', lambda rng: (
+            'GET', f'/api/actors/{actor_id(rng)}?include=movies', None)),
+        Scenario('GET /api/movies', lambda rng: ('GET', '/api/movies?limit=50', None)),
+        Scenario('GET /api/movies filtered', lambda rng: (
+            'GET', f'/api/movies?release_from={1950 + rng.randint(0, 60)}-01-01&sort=-release_date'
+                   f'&limit=50', None)),
+        Scenario('GET /api/movies/<id>', lambda rng: ('GET', f'/api/movies/{movie_id(rng)}', None)),
+        Scenario('GET /api/movies/<id> include', lambda rng: (
+            'GET', f'/api/movies/{movie_id(rng)}?include=actors', None)),
+        Scenario('GET /api/search', lambda rng: (
+            'GET', f'/api/search?q={rng.choice(LAST_NAMES)[:5].lower()}', None)),
+        Scenario('GET /api/admin/stats', lambda rng: ('GET', '/api/admin/stats', None)),
+        Scenario('GET /metrics', lambda rng: ('GET', '/metrics', None)),
+        Scenario('POST /api/actors', lambda rng: ('POST', '/api/actors', actor_body(rng)), ok=(201,)),
+        Scenario('PATCH /api/actors/<id>', lambda rng: (
+            'PATCH', f'/api/actors/{actor_id(rng)}', {'age': rng.randint(18, 90)})),
+        Scenario('DELETE /api/actors/<id>', delete_one('actors', '/api/actors')),
+        Scenario('POST /api/movies', lambda rng: ('POST', '/api/movies', movie_body(rng)), ok=(201,)),
+        Scenario('PATCH /api/movies/<id>', lambda rng: (
+            'PATCH', f'/api/movies/{movie_id(rng)}', {'title': movie_title(rng)})),
+        Scenario('DELETE /api/movies/<id>', delete_one('movies', '/api/movies')),
+        Scenario('POST /api/actors/bulk', lambda rng: (
+            'POST', '/api/actors/bulk', [actor_body(rng) for _ in range(100)]), ok=(201,)),
+        Scenario('PATCH /api/actors/bulk', lambda rng: (
+            'PATCH', '/api/actors/bulk',
+            {'ids': sample(rng, actors, 50), 'set': {'age': rng.randint(18, 90)}})),
+        Scenario('DELETE /api/actors/bulk', bulk_delete('actors_bulk', '/api/actors')),
+        Scenario('POST /api/movies/bulk', lambda rng: (
+            'POST', '/api/movies/bulk', [movie_body(rng) for _ in range(100)]), ok=(201,)),
+        Scenario('PATCH /api/movies/bulk', lambda rng: (
+            'PATCH', '/api/movies/bulk',
+            {'ids': sample(rng, movies, 50), 'set': {'title': movie_title(rng)}})),
+        Scenario('DELETE /api/movies/bulk', bulk_delete('movies_bulk', '/api/movies')),
+        Scenario('POST /api/movies/<id>/actors', lambda rng: (
+            'POST', f'/api/movies/{movie_id(rng)}/actors', {'actor_ids': sample(rng, actors)})),
+        Scenario('DELETE /api/movies/<id>/actors', lambda rng: (
+            'DELETE', f'/api/movies/{movie_id(rng)}/actors', {'actor_ids': sample(rng, actors)})),
+        Scenario('POST /api/actors/<id>/movies', lambda rng: (
+            'POST', f'/api/actors/{actor_id(rng)}/movies',
+            {'movie_ids': sample(rng, movies)})),
+        Scenario('DELETE /api/actors/<id>/movies', lambda rng: (
+            'DELETE', f'/api/actors/{actor_id(rng)}/movies',
+            {'movie_ids': sample(rng, movies)})),
+    ], {
+        'POST /api/actors': remember('actors', 'actor'),
+        'POST /api/movies': remember('movies', 'movie'),
+        'POST /api/actors/bulk': remember('actors_bulk', 'actors'),
+        'POST /api/movies/bulk': remember('movies_bulk', 'movies'),
+    }
+
+
+# ----------------------------------------------------------------------------
+# Load driver
+# ----------------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, on_success, host, port, token, clients, duration, seed):
+    """
+    Drives one scenario with ``clients`` threads for ``duration`` seconds.
+
+    Each client draws from its own ``random.Random`` seeded from ``seed``,
+    the scenario and its index, so thread scheduling can't reorder draws.
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(f'{seed}:{scenario.name}:{index}')
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        mine, failed = [], []
+        while time.monotonic() < deadline:
+            built = scenario.build(rng)
+            if not built:
+                break
+            method, path, body, *extra = built
+            headers = {'Authorization': f'Bearer {token}', **(extra[0] if extra else {})}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (OSError, http.client.HTTPException) as e:
+                failed.append(type(e).__name__)
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=60)
+                continue
+            elapsed = time.perf_counter() - started
+            if res.status in scenario.ok:
+                mine.append(elapsed)
+                if on_success is not None:
+                    on_success(json.loads(data))
+            else:
+                failed.append(res.status)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            errors.extend(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    error_counts = {}
+    for error in errors:
+        error_counts[str(error)] = error_counts.get(str(error), 0) + 1
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': len(latencies),
+        'errors': error_counts,
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+# ----------------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------------
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(endpoints, baseline=None):
+    header = f"{'endpoint':<34} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    log(header)
+    log('-' * len(header))
+    for name, result in endpoints.items():
+        line = (f"{name:<34} {result['throughput_rps']:>9} {result['p50_ms'] or '-':>9} "
+                f"{result['p95_ms'] or '-':>9} {result['p99_ms'] or '-':>9} "
+                f"{sum(result['errors'].values()):>7}")
+        before = (baseline or {}).get(name)
+        if before and before['throughput_rps'] and result['p95_ms'] and before['p95_ms']:
+            line += (f"   rps {result['throughput_rps'] / before['throughput_rps'] - 1:+.0%}"
+                     f"  p95 {result['p95_ms'] / before['p95_ms'] - 1:+.0%}")
+        log(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url',
+                        default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'casting-agency-bench.db')}")
+    parser.add_argument('--actors', type=int, default=100000)
+    parser.add_argument('--movies', type=int, default=20000)
+    parser.add_argument('--links', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed for data and requests')
+    parser.add_argument('--reseed', action='store_true', help='rebuild the database first')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi',
+                        help='app:APP on gthread workers or asgi:APP on uvicorn workers')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per endpoint')
+    parser.add_argument('--only', help='run only endpoints whose name contains this text')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to print deltas against')
+    args = parser.parse_args()
+    if args.actors < 1 or args.movies < 1 or args.links < 0:
+        parser.error('--actors and --movies must be at least 1, --links at least 0')
+
+    dataset = {'actors': args.actors, 'movies': args.movies, 'links': args.links}
+    seed_database(args.database_url, args.actors, args.movies, args.links, args.seed, args.reseed)
+
+    key = make_key_pair('bench-key', 2048)
+    token = mint_token(key, DOMAIN, AUDIENCE, PERMISSIONS, expires_in=24 * 3600)
+    jwks_server, jwks_url = start_jwks_stub(key)
+    port = free_port()
+    server = start_server(args.server, args.database_url, jwks_url, args.workers, port)
+
+    endpoints = {}
+    try:
+        all_scenarios, callbacks = scenarios(dataset)
+        for scenario in all_scenarios:
+            if args.only and args.only not in scenario.name:
+                continue
+            log(f'{scenario.name} ...')
+            endpoints[scenario.name] = run_scenario(
+                scenario, callbacks.get(scenario.name), '127.0.0.1', port,
+                token, args.clients, args.duration, args.seed
+            )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        jwks_server.shutdown()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'database': args.database_url.split(':', 1)[0],
+            'dataset': dataset,
+            'server': args.server,
+            'workers': args.workers,
+            'clients': args.clients,
+            'duration_s': args.duration,
+            'seed': args.seed,
+        },
+        'endpoints': endpoints,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['endpoints']
+    print_table(endpoints, baseline)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
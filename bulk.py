@@ -0,0 +1,225 @@
+"""
+Set-based write helpers for the bulk endpoints: one validation pass over the
+whole payload and one multi-row statement per request.
+"""
+from functools import lru_cache
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import and_, delete, exists, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from listing import FILTERS, ListQueryError, parse_filters
+from models import db, utcnow, Movie, Actor, MovieActor
+
+BULK_MODES = ('atomic', 'best_effort')
+
+# Association column pointing at each model, cleared before a bulk delete
+_LINKS = {
+    Movie: MovieActor.movie_id,
+    Actor: MovieActor.actor_id,
+}
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(schema):
+    return TypeAdapter(list[schema])
+
+
+def parse_bulk_mode(args):
+    """Reads ``?mode=atomic|best_effort`` (default ``atomic``)."""
+    mode = args.get('mode', 'atomic')
+    if mode not in BULK_MODES:
+        raise ListQueryError(f"Unknown mode: {mode}. Use one of {', '.join(BULK_MODES)}.")
+    return mode
+
+
+def bulk_payload(data, key, max_items):
+    """
+    Returns the item list from ``[...]`` or ``{key: [...]}`` bodies.
+
+    Only the envelope is checked here; the items are validated by
+    ``validate_items`` so their errors can be reported per index.
+    """
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ListQueryError(f'Expected a non-empty JSON array (or {{"{key}": [...]}}).')
+    if len(items) > max_items:
+        raise ListQueryError(f'At most {max_items} items per request.')
+    return items
+
+
+def validate_items(schema, items):
+    """
+    Validates every item against ``schema`` in a single pass.
+
+    Returns ``(valid, errors)``: ``valid`` is a list of ``(index, model)``
+    in input order, ``errors`` a list of ``{'index', 'errors'}`` with each
+    error's location relative to its item.
+    """
+    adapter = _list_adapter(schema)
+    try:
+        return list(enumerate(adapter.validate_python(items))), []
+    except ValidationError as e:
+        by_index = {}
+        for error in e.errors():
+            index, *loc = error['loc']
+            by_index.setdefault(index, []).append({**error, 'loc': tuple(loc)})
+
+    errors = [{'index': i, 'errors': by_index[i]} for i in sorted(by_index)]
+    remaining = [i for i in range(len(items)) if i not in by_index]
+    # Only reached when something failed: re-check the rest as one batch
+    valid = adapter.validate_python([items[i] for i in remaining])
+    return list(zip(remaining, valid)), errors
+
+
+def bulk_insert(model, rows):
+    """
+    Inserts ``rows`` with one multi-row ``INSERT ... RETURNING``.
+
+    Returns the new ORM objects in the order of ``rows``. The caller owns
+    the transaction.
+    """
+    # Asking SQLAlchemy to keep parameter order costs one statement per row
+    # on SQLite, which has no ordering sentinel; there a single VALUES list
+    # is assigned rowids in order, so sorting by id is enough.
+    ordered = db.session.get_bind().dialect.name != 'sqlite'
+    stmt = insert(model).returning(model, sort_by_parameter_order=ordered)
+    created = db.session.scalars(stmt, rows).all()
+    return created if ordered else sorted(created, key=lambda obj: obj.id)
+
+
+def parse_ids(data, key, max_items):
+    """Returns the distinct integer ids in ``data[key]``, in request order."""
+    ids = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids \
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ListQueryError(f'{key} must be a non-empty array of integers.')
+    if len(ids) > max_items:
+        raise ListQueryError(f'At most {max_items} {key} per request.')
+    return list(dict.fromkeys(ids))
+
+
+def bulk_selection(data, model, max_items):
+    """
+    Turns ``{"ids": [...]}`` or ``{"filter": {...}}`` into a WHERE clause.
+
+    Exactly one of the two is required, and a filter must contain at least
+    one known key: a typo must never widen a bulk write to the whole table.
+    """
+    data = data if isinstance(data, dict) else {}
+    ids, filters = data.get('ids'), data.get('filter')
+    if (ids is None) == (filters is None):
+        raise ListQueryError('Provide exactly one of "ids" or "filter".')
+
+    if ids is not None:
+        return model.id.in_(parse_ids(data, 'ids', max_items))
+
+    if not isinstance(filters, dict) or not filters:
+        raise ListQueryError('filter must be a non-empty object.')
+    unknown = sorted(set(filters) - set(FILTERS[model]))
+    if unknown:
+        raise ListQueryError(f"Unknown filter(s): {', '.join(unknown)}.")
+    conditions = parse_filters(filters, model)
+    if not conditions:
+        raise ListQueryError('filter must set at least one value.')
+    return and_(*conditions)
+
+
+def bulk_update(model, condition, changes):
+    """Applies ``changes`` to every matching row in one UPDATE; returns the ids."""
+    stmt = update(model).where(condition).values(**changes).returning(model.id)
+    ids = db.session.scalars(stmt, execution_options={'synchronize_session': False}).all()
+    return sorted(ids)
+
+
+def bulk_delete(model, condition):
+    """
+    Deletes every matching row in one DELETE; returns the ids.
+
+    Cast links are removed first by a single set-based DELETE, since the
+    ORM's per-object cascade does not apply to bulk statements.
+    """
+    link = _LINKS[model]
+    db.session.execute(
+        delete(MovieActor).where(link.in_(select(model.id).where(condition))),
+        execution_options={'synchronize_session': False}
+    )
+    stmt = delete(model).where(condition).returning(model.id)
+    ids = db.session.scalars(stmt, execution_options={'synchronize_session': False}).all()
+    return sorted(ids)
+
+
+# Cast links seen from either side: (owner column, other column, other model)
+_CAST_SIDES = {
+    Movie: (MovieActor.movie_id, MovieActor.actor_id, Actor),
+    Actor: (MovieActor.actor_id, MovieActor.movie_id, Movie),
+}
+
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING
+_UPSERT_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def _exists(model, owner_id):
+    return db.session.scalar(select(model.id).where(model.id == owner_id)) is not None
+
+
+def _touch(model, ids):
+    # Cast changes must move both sides' updated_at, which feed ETags
+    stmt = update(model).where(model.id.in_(ids)).values(updated_at=utcnow())
+    db.session.execute(stmt, execution_options={'synchronize_session': False})
+
+
+def link_cast(model, owner_id, other_ids):
+    """
+    Links ``owner_id`` to every existing row among ``other_ids``.
+
+    The links are one ``INSERT ... SELECT``: ids that don't exist, or an
+    owner that doesn't, are filtered by the SELECT, and pairs that are
+    already linked by ``ON CONFLICT DO NOTHING`` (or ``NOT EXISTS`` on
+    dialects without it). When links were added, one UPDATE per side moves
+    ``updated_at``; SQLite has no data-modifying CTEs to fold them into the
+    INSERT. When none were, one SELECT tells a missing owner from a repeat.
+    Returns the newly linked ids, or None if the owner does not exist.
+    """
+    owner_col, other_col, other = _CAST_SIDES[model]
+    rows = select(literal(owner_id), other.id).where(
+        other.id.in_(other_ids), select(model.id).where(model.id == owner_id).exists()
+    )
+    insert_ = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if insert_ is not None:
+        stmt = insert_(MovieActor).from_select([owner_col.key, other_col.key], rows).on_conflict_do_nothing()
+    else:
+        rows = rows.where(~exists().where(owner_col == owner_id, other_col == other.id))
+        stmt = insert(MovieActor).from_select([owner_col.key, other_col.key], rows)
+    linked = sorted(db.session.scalars(stmt.returning(other_col)).all())
+    if linked:
+        _touch(model, [owner_id])
+        _touch(other, linked)
+    elif not _exists(model, owner_id):
+        return None
+    return linked
+
+
+def unlink_cast(model, owner_id, other_ids):
+    """
+    Removes the links between ``owner_id`` and ``other_ids`` in one DELETE.
+
+    As in ``link_cast``, one UPDATE per side follows when links were
+    removed, and one SELECT when none were. Returns the unlinked ids, or
+    None if the owner does not exist.
+    """
+    owner_col, other_col, other = _CAST_SIDES[model]
+    stmt = delete(MovieActor).where(
+        owner_col == owner_id, other_col.in_(other_ids)
+    ).returning(other_col)
+    unlinked = sorted(db.session.scalars(stmt, execution_options={'synchronize_session': False}).all())
+    if unlinked:
+        _touch(model, [owner_id])
+        _touch(other, unlinked)
+    elif not _exists(model, owner_id):
+        return None
+    return unlinked
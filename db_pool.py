@@ -0,0 +1,155 @@
+"""
+Connection pool configuration and metrics.
+
+``engine_options`` turns the ``DB_*`` settings into SQLAlchemy engine
+options; ``InstrumentedQueuePool`` times every checkout so pool exhaustion
+shows up as wait time in ``/api/admin/stats`` instead of as mystery latency.
+``async_url`` maps a database URL onto the asyncio driver the ASGI entry
+point uses.
+"""
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import queue as sqla_queue
+
+# asyncio drivers for the ASGI entry point, by backend
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+
+class PoolStats:
+    """Checkout counters shared by a pool and the pools it is recreated as."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            # Anything past a millisecond was queued behind other checkouts
+            if wait > 0.001:
+                self.waited += 1
+            if timed_out:
+                self.timeouts += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each connection checkout waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return conn
+
+    def recreate(self):
+        # dispose() swaps in a fresh pool; keep counting across it
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool):
+    """
+    InstrumentedQueuePool for asyncio drivers.
+
+    Waiting for a free connection awaits on the event loop instead of
+    blocking the thread every request shares.
+    """
+
+    _is_asyncio = True
+    _queue_class = sqla_queue.AsyncAdaptedQueue
+
+
+def async_url(database_uri):
+    """``database_uri`` with its asyncio driver, e.g. ``postgresql+asyncpg://``."""
+    url = make_url(database_uri)
+    if url.get_dialect().is_async:
+        return database_uri
+    driver = ASYNC_DRIVERS[url.get_backend_name()]
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}').render_as_string(hide_password=False)
+
+
+def engine_options(config, database_uri):
+    """
+    SQLAlchemy engine options for ``database_uri`` from the ``DB_*`` config.
+
+    In-memory SQLite has a single static connection, so only pre-ping
+    applies there. ``DB_STATEMENT_TIMEOUT_MS`` is passed to PostgreSQL as a
+    session setting; 0 disables it. URLs with an asyncio driver get the
+    asyncio-aware pool.
+    """
+    url = make_url(database_uri)
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+
+    is_async = url.get_dialect().is_async
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+    )
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        if is_async:
+            options['connect_args'] = {'server_settings': {'statement_timeout': str(int(timeout))}}
+        else:
+            options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def warm_pool(engine, connections):
+    """Opens ``connections`` pooled connections now instead of on first use."""
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for conn in opened:
+            conn.close()
+    return len(opened)
+
+
+def pool_stats(engine):
+    """Current occupancy and cumulative checkout waits of ``engine``'s pool."""
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {'pool': type(pool).__name__}
+    stats = pool.stats
+    return {
+        'pool': type(pool).__name__,
+        'size': pool.size(),
+        'in_use': pool.checkedout(),
+        'idle': pool.checkedin(),
+        # Negative while the pool is still filling up to pool_size
+        'overflow': pool.overflow(),
+        'max_overflow': pool._max_overflow,
+        'checkouts': stats.checkouts,
+        'waited': stats.waited,
+        'timeouts': stats.timeouts,
+        'wait_ms_total': round(stats.wait_total * 1000, 3),
+        'wait_ms_max': round(stats.wait_max * 1000, 3),
+    }
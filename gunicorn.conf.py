@@ -0,0 +1,115 @@
+"""
+Gunicorn configuration for production.
+
+gunicorn loads this file from the working directory, so the Procfile
+command needs no flags. Every setting can be overridden by environment:
+
+    GUNICORN_WORKER_CLASS   gthread (default), sync, or
+                            uvicorn.workers.UvicornWorker with asgi:APP
+    WEB_CONCURRENCY         worker processes; default one per core, or
+                            2 x cores + 1 for single-threaded sync workers
+    GUNICORN_THREADS        threads per gthread worker (default 4)
+    GUNICORN_PRELOAD        import the app once in the master (default 1)
+    GUNICORN_MAX_REQUESTS   recycle a worker after this many requests,
+    GUNICORN_MAX_REQUESTS_JITTER  plus up to this many, so workers don't
+                            all restart at once
+    GUNICORN_TIMEOUT, GUNICORN_KEEPALIVE
+    METRICS_DIR             where workers share /metrics counts (default
+                            under /dev/shm) when METRICS=1; emptied when
+                            the server starts
+
+Workers open their pool connections and fetch the JWKS before accepting
+traffic, so the first requests after a deploy or a recycle don't pay for
+connection setup and key fetches: min(threads, DB_POOL_SIZE) connections
+per worker and engine.
+
+Each worker has its own pool per engine (the primary and every replica),
+so at worst the server holds
+
+    workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+connections to each database, 4 x (5 + 10) = 60 on a 4-core machine with
+the defaults. Keep that under the database's connection limit.
+"""
+import os
+import tempfile
+
+
+def _cores():
+    # The cores this process may run on, which a container can limit
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - not on Linux
+        return os.cpu_count() or 1
+
+
+def _flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+cores = _cores()
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+is_async = 'uvicorn' in worker_class.lower()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+threads = int(os.environ.get('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+# Threads, or an asyncio loop, already overlap requests waiting on I/O; one
+# process per core is enough and keeps the connection total above down.
+# Only single-threaded sync workers need 2 x cores + 1 to cover that wait.
+workers = int(os.environ.get('WEB_CONCURRENCY', cores if is_async or threads > 1 else 2 * cores + 1))
+preload_app = _flag('GUNICORN_PRELOAD', '1')
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+accesslog = '-'
+
+metrics_dir = os.environ.get('METRICS_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'casting-agency-metrics'
+))
+# Set in the master before the app is imported, so every worker shares it
+raw_env = [f'METRICS_DIR={metrics_dir}']
+
+
+def _flask_app(wsgi):
+    # asgi:APP wraps the Flask app; app:APP is it
+    return getattr(wsgi, 'app', wsgi)
+
+
+def on_starting(server):
+    """Starts /metrics from zero: files left by a previous run would be counted."""
+    from metrics import clear_directory
+    clear_directory(metrics_dir)
+
+
+def worker_exit(server, worker):
+    """Writes this worker's final /metrics counts before it goes."""
+    # wsgi stays None when the worker failed to load the app
+    metrics = worker.wsgi and _flask_app(worker.wsgi).extensions.get('metrics')
+    if metrics:
+        metrics.flush()
+
+
+def child_exit(server, worker):
+    """An exited worker's counters stay in the totals; its gauges don't."""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid, metrics_dir)
+
+
+def post_fork(server, worker):
+    """Drops connections inherited from the master; they can't be shared."""
+    if server.cfg.preload_app:
+        from app import app_engines
+        for engine in app_engines(_flask_app(server.app.wsgi())):
+            engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    """Warms this worker's pools and JWKS before it accepts requests."""
+    app = _flask_app(worker.wsgi)
+    # Asyncio workers warm up from the ASGI lifespan startup instead
+    if app.config['DB_ASYNC_DRIVER']:
+        return
+    from app import warm_up
+    warm_up(app, connections=min(worker.cfg.threads, app.config['DB_POOL_SIZE']))
@@ -0,0 +1,126 @@
+"""
+Flask JSON provider that encodes with orjson when it is installed.
+
+Output is byte-for-byte what the stdlib provider produces for compact
+responses (sorted keys, ASCII-only, ``,``/``:`` separators, trailing
+newline). Anything orjson would render differently is re-encoded with the
+stdlib: non-ASCII text, exponent-notation floats, integers beyond 64 bits
+and pretty-printed debug output. Non-ASCII text is escaped in place in
+orjson's output, and exponent floats are re-encoded from that output
+loaded back, whose dates are strings already, so neither calls
+``default`` per date. NaN and infinities are written as ``null`` on
+every path, as orjson does; the stdlib's bare ``NaN`` is not valid JSON.
+"""
+import math
+import re
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+from timing import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson writes 1e-06 as 1e-6 and 1e+16 as 1e16. A false positive inside a
+# string only costs a stdlib re-encode, never a wrong byte. Matching from the
+# 'e' (rather than the digit before it) keeps the scan cheap.
+_EXPONENT = re.compile(rb'e[-\d]')
+_DIGITS = frozenset(b'0123456789')
+# The backslashreplace codec writes characters beyond the BMP as \UXXXXXXXX
+_ASTRAL = re.compile(rb'\\U([0-9a-f]{8})')
+
+
+def _has_exponent(data):
+    return any(data[m.start() - 1] in _DIGITS for m in _EXPONENT.finditer(data, 1))
+
+
+def _surrogates(match):
+    code = int(match.group(1), 16) - 0x10000
+    return b'\\u%04x\\u%04x' % (0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+
+
+def _ensure_ascii(data):
+    """orjson's UTF-8 output escaped as the stdlib's ``ensure_ascii`` escapes it."""
+    # orjson never writes a raw NUL, so it can stand in for escaped backslashes
+    # while the codec runs. orjson never writes \x or \U, so those are the codec's
+    data = data.replace(b'\\\\', b'\0').decode('utf-8').encode('ascii', 'backslashreplace')
+    data = data.replace(b'\\x', b'\\u00')
+    if b'\\U' in data:
+        data = _ASTRAL.sub(_surrogates, data)
+    # The stdlib escapes DEL as well; orjson leaves it raw
+    return data.replace(b'\0', b'\\\\').replace(b'\x7f', b'\\u007f')
+
+
+_COMPACT = (',', ':')
+
+
+def _default(obj):
+    # Native dates: serializers hand over datetime objects, no per-row isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+def _finite(obj):
+    """``obj`` with NaN and infinities replaced by None, as orjson writes them."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with an orjson fast path for compact output."""
+
+    default = staticmethod(_default)
+
+    def __init__(self, app):
+        super().__init__(app)
+        # Flip off to A/B against the stdlib encoder
+        self.use_orjson = orjson is not None
+
+    def _fast_dumps(self, obj):
+        """Returns ``obj`` as compact JSON bytes plus newline, or None."""
+        if not (self.use_orjson and self.sort_keys and self.ensure_ascii):
+            return None
+        try:
+            data = orjson.dumps(
+                obj, default=_default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+            )
+        except TypeError:
+            return None
+        if _has_exponent(data):
+            # Loading orjson's output back gives the same values with dates as strings
+            return (self._stdlib_dumps(orjson.loads(data), separators=_COMPACT) + '\n').encode('ascii')
+        if not data.isascii() or b'\x7f' in data:
+            return _ensure_ascii(data)
+        return data
+
+    def _stdlib_dumps(self, obj, **kwargs):
+        try:
+            return super().dumps(obj, allow_nan=False, **kwargs)
+        except ValueError:
+            # NaN or an infinity somewhere: rare, so only then walk the object
+            return super().dumps(_finite(obj), allow_nan=False, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs == {'separators': _COMPACT}:
+            data = self._fast_dumps(obj)
+            if data is not None:
+                return data[:-1].decode('ascii')
+        return self._stdlib_dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        with timed('serialize'):
+            if self.compact or (self.compact is None and not self._app.debug):
+                data = self._fast_dumps(self._prepare_response_obj(args, kwargs))
+                if data is not None:
+                    return self._app.response_class(data, mimetype=self.mimetype)
+            return super().response(*args, **kwargs)
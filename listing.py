@@ -0,0 +1,475 @@
+"""
+Query helpers for the list endpoints: filtering, sorting and keyset (cursor)
+pagination, sparse fieldsets, related-entity includes, streamed full exports
+and ETag fingerprints.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import operator
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import DateTime, Integer, String, func, select, tuple_
+from sqlalchemy.orm import selectinload
+
+from models import db, Movie, Actor, MovieActor
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+logger = logging.getLogger(__name__)
+
+
+class ListQueryError(ValueError):
+    """Raised for malformed list query parameters; rendered as a 400."""
+
+
+class PageRequest(NamedTuple):
+    """Validated paging parameters for one list request"""
+    limit: int
+    after: Optional[list]
+    paged: bool
+
+
+def encode_cursor(values):
+    """Encodes the keyset position of the last row as an opaque token."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ListQueryError on tampered input."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise ListQueryError('Invalid cursor.')
+    if not isinstance(values, list) or not values:
+        raise ListQueryError('Invalid cursor.')
+    return values
+
+
+def parse_page_args(args, default_limit, max_limit):
+    """
+    Reads ``limit`` and ``after`` from the query string.
+
+    Requests without either parameter keep the historical unpaged shape,
+    but are still capped at ``max_limit`` rows.
+    """
+    paged = 'limit' in args or 'after' in args
+    if not paged:
+        return PageRequest(limit=max_limit, after=None, paged=False)
+
+    limit = args.get('limit', default_limit)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ListQueryError('limit must be an integer.')
+    if limit < 1:
+        raise ListQueryError('limit must be positive.')
+
+    after = decode_cursor(args['after']) if args.get('after') else None
+    return PageRequest(limit=min(limit, max_limit), after=after, paged=True)
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value)
+
+
+def _parse_int(value):
+    # JSON ``true`` is an int to Python; never let it mean 1
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return int(value)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def startswith_pattern(column, value):
+    """``column LIKE 'value%'`` with ``%`` and ``_`` in ``value`` escaped."""
+    return column.startswith(value, autoescape=True)
+
+
+# Filter parameter -> (column, comparison, value parser). Every column here
+# leads a B-tree index declared on the model, so each filter is a range scan.
+# Table (not ORM) columns, so list statements stay plain Core selects.
+FILTERS = {
+    Movie: {
+        'release_from': (Movie.__table__.c.release_date, operator.ge, _parse_datetime),
+        'release_to': (Movie.__table__.c.release_date, operator.le, _parse_datetime),
+        'title_prefix': (Movie.__table__.c.title, startswith_pattern, str),
+    },
+    Actor: {
+        'age_min': (Actor.__table__.c.age, operator.ge, _parse_int),
+        'age_max': (Actor.__table__.c.age, operator.le, _parse_int),
+        'gender': (Actor.__table__.c.gender, operator.eq, str),
+        'name_prefix': (Actor.__table__.c.name, startswith_pattern, str),
+    },
+}
+
+# Whitelisted ?sort= keys; each has an (key, id) index for keyset paging.
+SORT_KEYS = {
+    Movie: ('id', 'title', 'release_date', 'created_at'),
+    Actor: ('id', 'name', 'age', 'created_at'),
+}
+
+
+class ListQuery(NamedTuple):
+    """Row selection and order for one list request"""
+    filters: tuple
+    sort: str
+    descending: bool
+
+
+def parse_filters(params, model):
+    """
+    Turns filter parameters into SQL conditions on ``model``.
+
+    ``params`` is any mapping: the query string, or a JSON filter object.
+    Unrelated keys are ignored; malformed values raise ListQueryError.
+    """
+    conditions = []
+    for name, (column, compare, parse) in FILTERS[model].items():
+        value = params.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            value = parse(value)
+        except (TypeError, ValueError):
+            raise ListQueryError(f'Invalid value for {name}.')
+        conditions.append(compare(column, value))
+    return tuple(conditions)
+
+
+def parse_list_query(args, model):
+    """Reads the filter parameters and ``?sort=[-]key`` for ``model``."""
+    sort = args.get('sort', 'id')
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in SORT_KEYS[model]:
+        raise ListQueryError(
+            f"Unknown sort key: {sort}. Use one of {', '.join(SORT_KEYS[model])}."
+        )
+    return ListQuery(parse_filters(args, model), sort, descending)
+
+
+def _order_by(model, query):
+    columns = model.__table__.c
+    order = [columns[query.sort]] if query.sort != 'id' else []
+    order.append(columns.id)
+    return [c.desc() if query.descending else c for c in order]
+
+
+def _cursor_for(row, query):
+    if query.sort == 'id' and not query.descending:
+        return encode_cursor([row.id])
+    value = getattr(row, query.sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return encode_cursor([('-' if query.descending else '') + query.sort, value, row.id])
+
+
+def _after(model, query, cursor):
+    """
+    Keyset condition for the rows following ``cursor`` in ``query`` order.
+
+    ``(sort_col, id) > (:value, :id)`` is a row-value comparison that the
+    ``(sort_col, id)`` index answers with a single range scan.
+    """
+    if query.sort == 'id' and not query.descending:
+        if len(cursor) != 1 or not _is_int(cursor[0]):
+            raise ListQueryError('Invalid cursor.')
+        return model.__table__.c.id > cursor[0]
+
+    spec = ('-' if query.descending else '') + query.sort
+    if len(cursor) != 3 or cursor[0] != spec or not _is_int(cursor[2]):
+        raise ListQueryError('Cursor does not match the requested sort.')
+    value = cursor[1]
+    columns = model.__table__.c
+    column = columns[query.sort]
+    if isinstance(column.type, DateTime):
+        try:
+            value = _parse_datetime(value)
+        except (TypeError, ValueError):
+            raise ListQueryError('Invalid cursor.')
+    elif isinstance(column.type, Integer) and not _is_int(value):
+        raise ListQueryError('Invalid cursor.')
+    elif isinstance(column.type, String) and not isinstance(value, str):
+        raise ListQueryError('Invalid cursor.')
+    if query.sort == 'id':
+        key, bound = columns.id, cursor[2]
+    else:
+        key, bound = tuple_(column, columns.id), tuple_(value, cursor[2])
+    return key < bound if query.descending else key > bound
+
+
+def check_cursor(model, query, page):
+    """Raises ListQueryError early if ``page.after`` can't continue ``query``."""
+    if page.after is not None:
+        _after(model, query, page.after)
+
+
+class Projection(NamedTuple):
+    """What to load and serialize for each item of ``model``"""
+    model: type
+    fields: Optional[tuple]
+    include: tuple
+
+
+# ?include= name -> (relationship to the association, association -> target)
+INCLUDES = {
+    Movie: {'actors': (Movie.actors, MovieActor.actor)},
+    Actor: {'movies': (Actor.movies, MovieActor.movie)},
+}
+
+
+def parse_fields(args, model):
+    """
+    Reads ``?fields=a,b`` into a tuple of public field names of ``model``.
+
+    Returns None when the parameter is absent (serialize everything).
+    """
+    raw = args.get('fields')
+    if raw is None:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in model.public_fields]
+    if unknown:
+        raise ListQueryError(f"Unknown field(s): {', '.join(unknown)}.")
+    if not fields:
+        raise ListQueryError('fields must name at least one field.')
+    return fields
+
+
+def parse_include(args, model):
+    """Reads ``?include=`` into a tuple of relationship names of ``model``."""
+    raw = args.get('include')
+    if not raw:
+        return ()
+    include = tuple(dict.fromkeys(i.strip() for i in raw.split(',') if i.strip()))
+    unknown = [i for i in include if i not in INCLUDES[model]]
+    if unknown:
+        raise ListQueryError(f"Unknown include(s): {', '.join(unknown)}.")
+    return include
+
+
+def parse_projection(args, model, core=True):
+    """
+    Builds the Projection requested by ``?fields=`` and ``?include=``.
+
+    With ``core`` (the default), whole rows are read like an explicit
+    ``?fields=`` of every public field: a Core column select serialized
+    straight from row tuples, with no ORM instances or identity map.
+    ``core=False`` keeps the ORM entity path for A/B comparison. Includes
+    always need entities.
+    """
+    fields, include = parse_fields(args, model), parse_include(args, model)
+    if core and fields is None and not include:
+        fields = model.public_fields
+    return Projection(model, fields, include)
+
+
+def included_models(projection):
+    """Models whose rows appear in the response through ``?include=``."""
+    return tuple(
+        INCLUDES[projection.model][name][1].property.mapper.class_
+        for name in projection.include
+    )
+
+
+def _select(projection, sort='id'):
+    """
+    SELECT for a projection: whole entities, or only the requested columns.
+
+    Column selects are Core selects over table columns returning plain
+    rows, so no ORM instances are built. ``id`` and the sort column are
+    always selected (after the requested fields) for cursors and lookups.
+
+    Includes need entities; their relationships are loaded with one
+    ``selectinload`` query per hop for the whole batch, never per row.
+    """
+    model, fields, include = projection
+    if include:
+        stmt = select(model)
+        for name in include:
+            association, target = INCLUDES[model][name]
+            stmt = stmt.options(selectinload(association).selectinload(target))
+        return stmt
+    if fields is None:
+        return select(model)
+    names = fields + tuple(name for name in ('id', sort) if name not in fields)
+    return select(*(model.__table__.c[name] for name in dict.fromkeys(names)))
+
+
+def _serializer(projection):
+    """Returns a function turning a result of ``_select`` into a dict."""
+    model, fields, include = projection
+    if not include:
+        if fields is None:
+            return lambda obj: obj.to_dict()
+
+        # Datetimes are left to the JSON provider, which encodes them natively
+        def row_to_dict(row):
+            return dict(zip(fields, row))
+        return row_to_dict
+
+    def entity_to_dict(obj):
+        data = obj.to_dict()
+        if fields is not None:
+            data = {name: data[name] for name in fields}
+        for name in include:
+            association, target = INCLUDES[model][name]
+            related = [getattr(link, target.key) for link in getattr(obj, association.key)]
+            data[name] = [item.to_dict() for item in sorted(related, key=lambda item: item.id)]
+        return data
+    return entity_to_dict
+
+
+def _execute(stmt, projection):
+    if projection.fields is None or projection.include:
+        return db.session.scalars(stmt)
+    return db.session.execute(stmt)
+
+
+def _list_select(projection, query):
+    model = projection.model
+    return (
+        _select(projection, query.sort)
+        .where(*query.filters)
+        .order_by(*_order_by(model, query))
+    )
+
+
+def fetch_page(projection, page, query):
+    """
+    Returns ``(items, next_cursor)`` for one keyset page of a projection.
+
+    The page is a ``WHERE (sort, id) > :cursor ORDER BY sort, id LIMIT
+    :limit + 1`` range scan on the ``(sort, id)`` index, so deep pages cost
+    the same as the first one. Items are JSON-ready dicts.
+    """
+    stmt = _list_select(projection, query).limit(page.limit + 1)
+    if page.after is not None:
+        stmt = stmt.where(_after(projection.model, query, page.after))
+
+    rows = _execute(stmt, projection).all()
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = _cursor_for(rows[-1], query)
+    serialize = _serializer(projection)
+    return [serialize(row) for row in rows], next_cursor
+
+
+def fetch_one(projection, item_id):
+    """Returns one JSON-ready item by id, or None if it does not exist."""
+    stmt = _select(projection).where(projection.model.__table__.c.id == item_id)
+    row = _execute(stmt, projection).first()
+    return None if row is None else _serializer(projection)(row)
+
+
+def stream_format(request):
+    """
+    Returns ``'ndjson'`` or ``'json'`` when the client asked for a streamed
+    export of the whole list (``Accept: application/x-ndjson`` or
+    ``?stream=1``), or None for a regular response.
+    """
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    if best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def stream_list(projection, query, key, total_key, ndjson, batch_size):
+    """
+    Streams every matching row of a projection without materialising it.
+
+    Rows are read ``batch_size`` at a time through a server-side cursor
+    (``yield_per``) and written out as they arrive, either as NDJSON (one
+    object per line) or as the regular list envelope sent in chunks.
+    """
+    stmt = _list_select(projection, query).execution_options(yield_per=batch_size)
+    serialize = _serializer(projection)
+
+    def dumps(obj):
+        return current_app.json.dumps(obj, separators=(',', ':'))
+
+    def generate():
+        if not ndjson:
+            yield f'{{"{key}":['
+        rows = _execute(stmt, projection)
+        count = 0
+        try:
+            for row in rows:
+                item = dumps(serialize(row))
+                if ndjson:
+                    yield item + '\n'
+                else:
+                    yield item if count == 0 else ',' + item
+                count += 1
+            if not ndjson:
+                yield f'],"success":true,"{total_key}":{count}}}\n'
+        except Exception:
+            # Headers are already sent. Re-raising makes the server drop the
+            # connection instead of ending the body cleanly, so the client
+            # can tell a truncated export from a complete one.
+            logger.exception('Streaming %s failed after %d rows', key, count)
+            raise
+        finally:
+            rows.close()
+
+    mimetype = NDJSON_MIMETYPE if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def list_etag(request, *models):
+    """
+    Strong ETag for a list response, computed without loading any rows.
+
+    The fingerprint of each table is ``(count(*), max(updated_at))``: an
+    insert or delete changes the count and every update moves the max, so
+    an unchanged fingerprint means the same body for the same query string.
+    """
+    columns = []
+    for model in models:
+        columns.append(select(func.count()).select_from(model).scalar_subquery())
+        columns.append(select(func.max(model.updated_at)).scalar_subquery())
+    fingerprint = tuple(db.session.execute(select(*columns)).one())
+    return _etag(request.path, request.query_string, fingerprint)
+
+
+def item_etag(request, model, item_id, *related):
+    """
+    Strong ETag for one item, or None if it does not exist.
+
+    ``related`` tables (for ``?include=``) add their table fingerprint,
+    since edits to an included row do not touch the item itself.
+    """
+    columns = [select(model.updated_at).where(model.id == item_id).scalar_subquery()]
+    for other in related:
+        columns.append(select(func.count()).select_from(other).scalar_subquery())
+        columns.append(select(func.max(other.updated_at)).scalar_subquery())
+    fingerprint = tuple(db.session.execute(select(*columns)).one())
+    if fingerprint[0] is None:
+        return None
+    return _etag(request.path, request.query_string, fingerprint)
+
+
+def not_modified(request, etag):
+    """Returns a 304 response when the client already holds ``etag``."""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
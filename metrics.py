@@ -0,0 +1,408 @@
+"""
+Prometheus metrics, aggregated across worker processes.
+
+Request hooks update a per-thread shard: a thread only ever writes its own
+dicts, so the hot path takes no lock. A background thread per worker
+writes the process totals to ``counters_<pid>.json`` and
+``gauges_<pid>.json`` under ``METRICS_DIR``, and so does every scrape and
+the worker's exit. ``/metrics`` then merges every file in the directory,
+its own worker's included, in the text exposition format. When a worker
+exits, gunicorn's ``child_exit`` hook folds its counters into
+``retained.json`` and removes its files, so totals never go backwards and
+gauges count only live workers. Without ``METRICS_DIR`` (a single
+process) nothing is written and ``/metrics`` reports this process alone.
+
+Pool, token-cache and JWKS figures are read from their own counters when
+the totals are written, not on each request.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Unix, so no gunicorn either
+    fcntl = None
+
+from flask import Response, g, request
+
+from auth import get_jwks_cache, get_rejected_token_cache, get_token_cache
+from db_pool import pool_stats
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Counters of exited workers
+RETAINED = 'retained.json'
+
+# name: (type, help)
+METRICS = {
+    'http_requests_in_flight': ('gauge', 'Requests being handled'),
+    'http_request_duration_seconds': (
+        'histogram', 'Time from the first before_request hook to the response being ready'),
+    'db_queries_total': ('counter', 'SQL statements executed by requests'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements by requests'),
+    'db_pool_size': ('gauge', 'Configured connections per pool'),
+    'db_pool_connections': ('gauge', 'Pooled connections by state'),
+    'db_pool_overflow': ('gauge', 'Connections beyond pool_size (negative while filling)'),
+    'db_pool_checkouts_total': ('counter', 'Connection checkouts'),
+    'db_pool_checkouts_waited_total': ('counter', 'Checkouts that queued for a free connection'),
+    'db_pool_checkout_timeouts_total': ('counter', 'Checkouts that timed out'),
+    'db_pool_checkout_wait_seconds_total': ('counter', 'Time spent waiting for connections'),
+    'token_cache_hits_total': ('counter', 'Token cache lookups answered from memory'),
+    'token_cache_misses_total': ('counter', 'Token cache lookups that were not cached'),
+    'token_cache_entries': ('gauge', 'Tokens held in the cache'),
+    'jwks_lookups_total': ('counter', 'Signing key lookups'),
+    'jwks_fetches_total': ('counter', 'JWKS documents fetched from the IdP'),
+}
+
+
+class _Shard:
+    """One thread's counters, gauges and histograms."""
+
+    __slots__ = ('counters', 'gauges', 'histograms')
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+def _merge(into, samples):
+    for key, value in samples:
+        into[key] = into.get(key, 0) + value
+
+
+def _merge_histograms(into, samples):
+    for key, values in samples:
+        current = into.get(key)
+        into[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+
+
+def pool_samples(engines):
+    """Pool occupancy gauges and checkout counters, labelled by engine name."""
+    counters, gauges = [], []
+    for name, engine in engines.items():
+        stats = pool_stats(engine)
+        if 'size' not in stats:
+            continue
+        labels = (('engine', name),)
+        gauges.extend([
+            (('db_pool_size', labels), stats['size']),
+            (('db_pool_connections', labels + (('state', 'in_use'),)), stats['in_use']),
+            (('db_pool_connections', labels + (('state', 'idle'),)), stats['idle']),
+            (('db_pool_overflow', labels), stats['overflow']),
+        ])
+        counters.extend([
+            (('db_pool_checkouts_total', labels), stats['checkouts']),
+            (('db_pool_checkouts_waited_total', labels), stats['waited']),
+            (('db_pool_checkout_timeouts_total', labels), stats['timeouts']),
+            (('db_pool_checkout_wait_seconds_total', labels), stats['wait_ms_total'] / 1000),
+        ])
+    return counters, gauges
+
+
+def auth_samples():
+    """Token cache hit/miss counters and the JWKS lookup/fetch counters."""
+    counters, gauges = [], []
+    for name, cache in (('verified', get_token_cache()), ('rejected', get_rejected_token_cache())):
+        stats = cache.stats()
+        labels = (('cache', name),)
+        counters.extend([
+            (('token_cache_hits_total', labels), stats['hits']),
+            (('token_cache_misses_total', labels), stats['misses']),
+        ])
+        gauges.append((('token_cache_entries', labels), stats['size']))
+    jwks = get_jwks_cache().stats()
+    counters.extend([
+        (('jwks_lookups_total', ()), jwks['lookups']),
+        (('jwks_fetches_total', ()), jwks['fetches']),
+    ])
+    return counters, gauges
+
+
+class Metrics:
+    """
+    Request metrics for one app, plus collectors read at flush time.
+
+    ``collectors`` are callables returning ``(counters, gauges)`` lists of
+    ``((name, labels), value)`` with this process's absolute values.
+    """
+
+    def __init__(self, directory=None, buckets=DEFAULT_BUCKETS, flush_interval=5.0):
+        self.directory = directory
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self.collectors = []
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['METRICS_DIR'] or None, flush_interval=config['METRICS_FLUSH_INTERVAL'])
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        app.before_request(self._start)
+        app.after_request(self._record)
+        app.teardown_request(self._done)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    # Hot path ------------------------------------------------------------
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels=(), value=1):
+        gauges = self._shard().gauges
+        key = (name, labels)
+        gauges[key] = gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        counts = histograms.get(key)
+        if counts is None:
+            # One count per bucket and +Inf, then sum and count
+            counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def _start(self):
+        if self._pid != os.getpid():
+            self._start_process()
+        self.add_gauge('http_requests_in_flight')
+        g.metrics_in_flight = True
+
+    def _record(self, response):
+        timings = g.get('timings')
+        if timings is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.observe('http_request_duration_seconds', (
+            ('method', request.method), ('route', route), ('status', str(response.status_code))
+        ), timings.elapsed())
+        if timings.queries:
+            labels = (('route', route),)
+            self.inc('db_queries_total', labels, timings.queries)
+            self.inc('db_query_duration_seconds_total', labels, timings.stages.get('db', 0.0))
+        return response
+
+    def _done(self, exc):
+        if g.pop('metrics_in_flight', False):
+            self.add_gauge('http_requests_in_flight', value=-1)
+
+    # Aggregation ---------------------------------------------------------
+
+    def _start_process(self):
+        """Drops shards inherited through fork and starts this worker's flusher."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._shards = []
+            self._local = threading.local()
+        if self.directory:
+            threading.Thread(target=self._flush_forever, args=(self._pid,), daemon=True).start()
+
+    def _flush_forever(self, pid):
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def snapshot(self):
+        """This process's totals: (counters, gauges, histograms) keyed by (name, labels)."""
+        counters, gauges, histograms = {}, {}, {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict.copy() is atomic, so the owning thread can keep writing
+            _merge(counters, shard.counters.copy().items())
+            _merge(gauges, shard.gauges.copy().items())
+            _merge_histograms(histograms, shard.histograms.copy().items())
+        for collect in self.collectors:
+            extra_counters, extra_gauges = collect()
+            _merge(counters, extra_counters)
+            _merge(gauges, extra_gauges)
+        return counters, gauges, histograms
+
+    def flush(self):
+        """Writes this process's totals to its files in ``directory``."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        # Snapshot under the lock too, so an older snapshot never overwrites a newer one
+        with self._flush_lock:
+            counters, gauges, histograms = self.snapshot()
+            _write_json(os.path.join(self.directory, f'counters_{pid}.json'), {
+                'counters': _items(counters),
+                'histograms': _items(histograms),
+            })
+            _write_json(os.path.join(self.directory, f'gauges_{pid}.json'), {'gauges': _items(gauges)})
+
+    def collect(self):
+        """Totals over every worker, each read from its latest file."""
+        if not self.directory:
+            return self.snapshot()
+        # Every scrape reads this worker from its file like any other, so a
+        # later scrape served by another worker never reports less
+        self.flush()
+        counters, gauges, histograms = {}, {}, {}
+        with _locked(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                data = _read_json(os.path.join(self.directory, name))
+                if data is None:
+                    continue
+                _merge(counters, _keys(data.get('counters', [])))
+                _merge(gauges, _keys(data.get('gauges', [])))
+                _merge_histograms(histograms, _keys(data.get('histograms', [])))
+        return counters, gauges, histograms
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        counters, gauges, histograms = self.collect()
+        # name -> [(labels, [(sample name, labels, value), ...])]
+        families = {}
+        for samples in (counters, gauges):
+            for (name, labels), value in samples.items():
+                families.setdefault(name, []).append((labels, [(name, labels, value)]))
+        for (name, labels), counts in histograms.items():
+            rows, cumulative = [], 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                rows.append((f'{name}_bucket', labels + (('le', _number(bound)),), cumulative))
+            rows.append((f'{name}_sum', labels, counts[-2]))
+            rows.append((f'{name}_count', labels, counts[-1]))
+            families.setdefault(name, []).append((labels, rows))
+
+        lines = []
+        for name in sorted(families):
+            kind, help_text = METRICS.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for _, rows in sorted(families[name], key=lambda entry: entry[0]):
+                lines.extend(f'{sample}{_labels(labels)} {_number(value)}' for sample, labels, value in rows)
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+
+def _items(samples):
+    return [[name, [list(pair) for pair in labels], value] for (name, labels), value in samples.items()]
+
+
+def _keys(items):
+    return (((name, tuple(tuple(pair) for pair in labels)), value) for name, labels, value in items)
+
+
+def _write_json(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _read_json(path):
+    # A restart may empty the directory between listdir and open
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def clear_directory(directory):
+    """Removes every worker's files; gunicorn calls this once at startup."""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def _locked(directory, exclusive=False):
+    """
+    Serializes folding an exited worker's counters with scrapes reading them,
+    so a scrape sees them either in the worker's file or in ``RETAINED``.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def mark_process_dead(pid, directory):
+    """Folds an exited worker's counters into ``RETAINED`` and removes its files."""
+    if not os.path.isdir(directory):
+        return
+    path = os.path.join(directory, f'counters_{pid}.json')
+    with _locked(directory, exclusive=True):
+        data = _read_json(path)
+        if data is not None:
+            retained_path = os.path.join(directory, RETAINED)
+            retained = _read_json(retained_path) or {}
+            counters = dict(_keys(retained.get('counters', [])))
+            histograms = dict(_keys(retained.get('histograms', [])))
+            _merge(counters, _keys(data.get('counters', [])))
+            _merge_histograms(histograms, _keys(data.get('histograms', [])))
+            _write_json(retained_path, {'counters': _items(counters), 'histograms': _items(histograms)})
+        for name in (f'counters_{pid}.json', f'gauges_{pid}.json'):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,67 @@
+"""updated_at columns and the list filter/sort indexes
+
+``updated_at`` drives ETags and list fingerprints; existing rows start out
+at their ``created_at``. The (column, id) indexes serve both filtering and
+keyset-paged sorting.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'movies': [
+        ('ix_movies_release_date_id', ['release_date', 'id']),
+        ('ix_movies_title_id', ['title', 'id']),
+        ('ix_movies_created_at_id', ['created_at', 'id']),
+        ('ix_movies_updated_at', ['updated_at']),
+    ],
+    'actors': [
+        ('ix_actors_age_id', ['age', 'id']),
+        ('ix_actors_name_id', ['name', 'id']),
+        ('ix_actors_gender_age_id', ['gender', 'age', 'id']),
+        ('ix_actors_created_at_id', ['created_at', 'id']),
+        ('ix_actors_updated_at', ['updated_at']),
+    ],
+}
+# LIKE 'prefix%' can only use a B-tree under C collation ordering
+PATTERN_INDEXES = {
+    'movies': ('ix_movies_title_pattern', 'title'),
+    'actors': ('ix_actors_name_pattern', 'name'),
+}
+
+
+def upgrade():
+    is_postgresql = op.get_context().dialect.name == 'postgresql'
+    for table, indexes in INDEXES.items():
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = created_at')
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+        for name, columns in indexes:
+            op.create_index(name, table, columns)
+        if is_postgresql:
+            name, column = PATTERN_INDEXES[table]
+            op.create_index(name, table, [column], postgresql_ops={column: 'text_pattern_ops'})
+
+
+def downgrade():
+    is_postgresql = op.get_context().dialect.name == 'postgresql'
+    for table, indexes in INDEXES.items():
+        if is_postgresql:
+            op.drop_index(PATTERN_INDEXES[table][0], table_name=table)
+        for name, _ in indexes:
+            op.drop_index(name, table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
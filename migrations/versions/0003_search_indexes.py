@@ -0,0 +1,74 @@
+"""Full-text indexes backing /api/search
+
+PostgreSQL: pg_trgm GIN indexes for typo-tolerant matching and
+``to_tsvector('simple', ...)`` GIN indexes for whole words. SQLite: an
+external-content FTS5 table per searchable column with the trigram
+tokenizer, kept in sync by triggers and built from the existing rows.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE = {
+    'movies': 'title',
+    'actors': 'name',
+}
+
+
+def _sqlite_fts(table, column):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5("
+        f"{column}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in SEARCHABLE.items():
+            op.create_index(
+                f'ix_{table}_{column}_trgm', table, [column],
+                postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+            )
+            op.create_index(
+                f'ix_{table}_{column}_tsv', table, [sa.text(f"to_tsvector('simple', {column})")],
+                postgresql_using='gin'
+            )
+    elif dialect == 'sqlite':
+        for table, column in SEARCHABLE.items():
+            for statement in _sqlite_fts(table, column):
+                op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        for table, column in SEARCHABLE.items():
+            op.drop_index(f'ix_{table}_{column}_tsv', table_name=table)
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
+    elif dialect == 'sqlite':
+        for table in SEARCHABLE:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {table}_fts')
@@ -0,0 +1,35 @@
+"""One movie_actors row per (movie, actor) pair, plus the reverse index
+
+Duplicate links are collapsed onto their oldest row before the unique
+constraint is added. Its index serves movie -> cast lookups; the new
+(actor_id, movie_id) index serves actor -> filmography lookups.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        'DELETE FROM movie_actors WHERE id NOT IN '
+        '(SELECT MIN(id) FROM movie_actors GROUP BY movie_id, actor_id)'
+    )
+    with op.batch_alter_table('movie_actors') as batch_op:
+        batch_op.create_unique_constraint('uq_movie_actors_movie_id_actor_id', ['movie_id', 'actor_id'])
+    op.create_index('ix_movie_actors_actor_id_movie_id', 'movie_actors', ['actor_id', 'movie_id'])
+
+
+def downgrade():
+    op.drop_index('ix_movie_actors_actor_id_movie_id', table_name='movie_actors')
+    with op.batch_alter_table('movie_actors') as batch_op:
+        batch_op.drop_constraint('uq_movie_actors_movie_id_actor_id', type_='unique')
@@ -0,0 +1,49 @@
+"""Stamp updated_at from the database clock
+
+``updated_at`` feeds ETags and list fingerprints, so it now defaults to the
+database server's UTC time instead of each app host's clock. SQLite gets
+millisecond ``strftime`` because its ``CURRENT_TIMESTAMP`` is whole seconds.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+TABLES = ('movies', 'actors')
+UTCNOW = {
+    'postgresql': "TIMEZONE('utc', STATEMENT_TIMESTAMP())",
+    'sqlite': "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now'))",
+}
+
+
+def upgrade():
+    default = UTCNOW.get(op.get_context().dialect.name, 'CURRENT_TIMESTAMP')
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                'updated_at',
+                existing_type=sa.DateTime(),
+                existing_nullable=False,
+                server_default=sa.text(default)
+            )
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column(
+                'updated_at',
+                existing_type=sa.DateTime(),
+                existing_nullable=False,
+                server_default=None
+            )
@@ -4,13 +4,19 @@ Database models and schemas using SQLAlchemy and Pydantic
 import os
 from datetime import datetime
 from typing import Optional, List
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, field_validator
+from pydantic_core import PydanticCustomError
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Integer, DateTime
+from sqlalchemy import String, Integer, DateTime, Index, UniqueConstraint, DDL, event, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql.expression import FunctionElement
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+from db_pool import async_url, engine_options
+from replicas import RoutingSession
+
+# Initialize SQLAlchemy (reads may be routed to replicas, see replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Database URI configuration
 database_path = os.environ.get('DATABASE_URL', 'postgresql://localhost:5432/capstone')
@@ -20,16 +26,50 @@ if database_path.startswith("postgres://"):
     database_path = database_path.replace("postgres://", "postgresql://", 1)
 
 
+class utcnow(FunctionElement):
+    """
+    The database server's current UTC time as a naive timestamp
+
+    ``updated_at`` is stamped with this rather than the app host's clock, so
+    every worker writes from one clock and ``max(updated_at)`` moves on each
+    write regardless of skew between hosts. SQLite's ``CURRENT_TIMESTAMP``
+    only has whole seconds, so it gets ``strftime`` with milliseconds instead.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', STATEMENT_TIMESTAMP())"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f', 'now')"
+
+
 def setup_db(app, database_path=database_path):
     """
     Binds a flask application and a SQLAlchemy service
+
+    No connection is made here: engines connect on first use, and the
+    schema is managed by the migrations (``flask db upgrade``). With
+    ``DB_ASYNC_DRIVER`` set (the ASGI entry point) the engine uses the
+    asyncio driver.
     """
+    if app.config.get("DB_ASYNC_DRIVER"):
+        database_path = async_url(database_path)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
     db.app = app
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
 
 
 # ============================================================================
@@ -40,6 +80,31 @@ class Movie(db.Model):
     """Movie SQLAlchemy Model"""
     __tablename__ = 'movies'
 
+    # Fields exposed by to_dict, selectable with ?fields=
+    public_fields = ('id', 'title', 'release_date', 'created_at')
+
+    # (column, id) indexes serve both the filters and keyset-paged sorts
+    __table_args__ = (
+        Index('ix_movies_release_date_id', 'release_date', 'id'),
+        Index('ix_movies_title_id', 'title', 'id'),
+        Index('ix_movies_created_at_id', 'created_at', 'id'),
+        Index('ix_movies_updated_at', 'updated_at'),
+        # LIKE 'prefix%' can only use a B-tree under C collation ordering
+        Index(
+            'ix_movies_title_pattern', 'title',
+            postgresql_ops={'title': 'text_pattern_ops'}
+        ).ddl_if(dialect='postgresql'),
+        # /api/search: typo-tolerant trigram matching and whole-word matching
+        Index(
+            'ix_movies_title_trgm', 'title',
+            postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+        Index(
+            'ix_movies_title_tsv', text("to_tsvector('simple', title)"),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(120), nullable=False)
     release_date: Mapped[datetime] = mapped_column(DateTime, nullable=False)
@@ -48,6 +113,13 @@ class Movie(db.Model):
         default=datetime.utcnow,
         nullable=False
     )
+    # Bumped by the database on every write; drives ETags and list fingerprints
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        server_default=utcnow(),
+        onupdate=utcnow(),
+        nullable=False
+    )
 
     # Relationships
     actors: Mapped[List["MovieActor"]] = relationship(
@@ -60,12 +132,12 @@ class Movie(db.Model):
         return f'<Movie {self.id}: {self.title}>'
 
     def to_dict(self):
-        """Convert model to dictionary"""
+        """Convert model to dictionary (datetimes are encoded by the JSON provider)"""
         return {
             'id': self.id,
             'title': self.title,
-            'release_date': self.release_date.isoformat(),
-            'created_at': self.created_at.isoformat()
+            'release_date': self.release_date,
+            'created_at': self.created_at
         }
 
 
@@ -73,6 +145,32 @@ class Actor(db.Model):
     """Actor SQLAlchemy Model"""
     __tablename__ = 'actors'
 
+    # Fields exposed by to_dict, selectable with ?fields=
+    public_fields = ('id', 'name', 'age', 'gender', 'created_at')
+
+    # (column, id) indexes serve both the filters and keyset-paged sorts
+    __table_args__ = (
+        Index('ix_actors_age_id', 'age', 'id'),
+        Index('ix_actors_name_id', 'name', 'id'),
+        Index('ix_actors_gender_age_id', 'gender', 'age', 'id'),
+        Index('ix_actors_created_at_id', 'created_at', 'id'),
+        Index('ix_actors_updated_at', 'updated_at'),
+        # LIKE 'prefix%' can only use a B-tree under C collation ordering
+        Index(
+            'ix_actors_name_pattern', 'name',
+            postgresql_ops={'name': 'text_pattern_ops'}
+        ).ddl_if(dialect='postgresql'),
+        # /api/search: typo-tolerant trigram matching and whole-word matching
+        Index(
+            'ix_actors_name_trgm', 'name',
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+        Index(
+            'ix_actors_name_tsv', text("to_tsvector('simple', name)"),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(120), nullable=False)
     age: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -82,6 +180,13 @@ class Actor(db.Model):
         default=datetime.utcnow,
         nullable=False
     )
+    # Bumped by the database on every write; drives ETags and list fingerprints
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        server_default=utcnow(),
+        onupdate=utcnow(),
+        nullable=False
+    )
 
     # Relationships
     movies: Mapped[List["MovieActor"]] = relationship(
@@ -94,13 +199,13 @@ class Actor(db.Model):
         return f'<Actor {self.id}: {self.name}>'
 
     def to_dict(self):
-        """Convert model to dictionary"""
+        """Convert model to dictionary (datetimes are encoded by the JSON provider)"""
         return {
             'id': self.id,
             'name': self.name,
             'age': self.age,
             'gender': self.gender,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at
         }
 
 
@@ -108,6 +213,13 @@ class MovieActor(db.Model):
     """Association table for Movies and Actors"""
     __tablename__ = 'movie_actors'
 
+    # One link per pair; the unique index serves movie -> cast lookups and
+    # the reverse index actor -> filmography lookups.
+    __table_args__ = (
+        UniqueConstraint('movie_id', 'actor_id', name='uq_movie_actors_movie_id_actor_id'),
+        Index('ix_movie_actors_actor_id_movie_id', 'actor_id', 'movie_id'),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     movie_id: Mapped[int] = mapped_column(
         Integer,
@@ -128,10 +240,66 @@ class MovieActor(db.Model):
         return f'<MovieActor movie_id={self.movie_id} actor_id={self.actor_id}>'
 
 
+# ============================================================================
+# Search indexes
+# ============================================================================
+
+def _search_ddl(table, column):
+    """
+    Registers the full-text index DDL backing /api/search for ``table``.
+
+    PostgreSQL indexes the column itself (see ``__table_args__``) and only
+    needs the pg_trgm extension. SQLite gets an external-content FTS5 table
+    with the trigram tokenizer, kept in sync by triggers.
+    """
+    fts = f'{table.name}_fts'
+    event.listen(table, 'before_create', DDL(
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+    ).execute_if(dialect='postgresql'))
+
+    for statement in (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{column}, content='{table.name}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table.name} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        # Index rows that predate the FTS table
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ):
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL(
+        f'DROP TABLE IF EXISTS {fts}'
+    ).execute_if(dialect='sqlite'))
+
+
+_search_ddl(Movie.__table__, 'title')
+_search_ddl(Actor.__table__, 'name')
+
+
 # ============================================================================
 # Pydantic Schemas for Validation and Serialization
 # ============================================================================
 
+class PartialUpdate(BaseModel):
+    """
+    Base for update schemas: fields may be omitted, but never set to null
+
+    Every column is NOT NULL, so an explicit null would only fail later as
+    an IntegrityError. A custom error type keeps ``errors()`` JSON-safe.
+    """
+
+    @field_validator('*')
+    @classmethod
+    def _not_null(cls, value):
+        if value is None:
+            raise PydanticCustomError('not_null', 'Field may be omitted but not null')
+        return value
+
+
 class ActorBase(BaseModel):
     """Base Actor Schema"""
     name: str = Field(..., min_length=1, max_length=120)
@@ -146,7 +314,7 @@ class ActorCreate(ActorBase):
     pass
 
 
-class ActorUpdate(BaseModel):
+class ActorUpdate(PartialUpdate):
     """Schema for updating an Actor (all fields optional)"""
     name: Optional[str] = Field(None, min_length=1, max_length=120)
     age: Optional[int] = Field(None, gt=0, lt=150)
@@ -176,7 +344,7 @@ class MovieCreate(MovieBase):
     pass
 
 
-class MovieUpdate(BaseModel):
+class MovieUpdate(PartialUpdate):
     """Schema for updating a Movie (all fields optional)"""
     title: Optional[str] = Field(None, min_length=1, max_length=120)
     release_date: Optional[datetime] = None
@@ -0,0 +1,119 @@
+"""
+Slow-query log and N+1 detector.
+
+Every statement a request runs is reported by the request's
+``RequestTimings`` (see ``timing``), so ``ServerTiming`` must be installed
+first:
+
+- a statement slower than ``SLOW_QUERY_MS`` is logged with its route and
+  the shape of its parameters (types and lengths, never values);
+- a request that runs the same statement more than
+  ``N_PLUS_ONE_THRESHOLD`` times (typically a lazy load per row) is
+  logged as a possible N+1, or fails with ``NPlusOneError`` when
+  ``N_PLUS_ONE_RAISE`` is set, as it is under the test suite.
+
+The error is raised when the request is torn down, so a route's own
+error handling cannot turn it into an ordinary 500.
+"""
+import logging
+
+from flask import g, has_app_context, request
+
+from timing import current_timings
+
+logger = logging.getLogger(__name__)
+
+
+class NPlusOneError(Exception):
+    """A request ran one statement more often than the configured threshold."""
+
+
+def param_shape(parameters, executemany=False):
+    """Types (and lengths of strings and sequences) of statement parameters."""
+    if executemany:
+        return f'{len(parameters)} x {param_shape(parameters[0]) if parameters else "[]"}'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {_value_shape(value)}' for key, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(_value_shape(value) for value in parameters) + ')'
+    return _value_shape(parameters)
+
+
+def _value_shape(value):
+    if value is None:
+        return 'None'
+    name = type(value).__name__
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f'{name}[{len(value)}]'
+    return name
+
+
+def _route():
+    rule = request.url_rule
+    return f'{request.method} {rule.rule if rule else request.path}'
+
+
+class RequestQueries:
+    """Statement counts for one request, and the statements over the threshold."""
+
+    __slots__ = ('watch', 'counts', 'repeated')
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.counts = {}
+        self.repeated = []
+
+    def record(self, statement, parameters, executemany, seconds):
+        watch = self.watch
+        if watch.slow_ms and seconds * 1000 >= watch.slow_ms:
+            logger.warning('Slow query (%.1f ms) in %s: %s params=%s', seconds * 1000, _route(),
+                           statement, param_shape(parameters, executemany))
+        count = self.counts[statement] = self.counts.get(statement, 0) + 1
+        if watch.repeat_threshold and count == watch.repeat_threshold + 1:
+            self.repeated.append(statement)
+            if not watch.raise_on_repeat:
+                logger.warning('Possible N+1 in %s: statement ran more than %d times: %s',
+                               _route(), watch.repeat_threshold, statement)
+
+
+def current_queries():
+    """This request's RequestQueries, or None outside a watched request."""
+    return g.get('query_watch') if has_app_context() else None
+
+
+class QueryWatch:
+    """Installs the per-request statement watch on an app."""
+
+    def __init__(self, slow_ms=200, repeat_threshold=10, raise_on_repeat=False):
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self.raise_on_repeat = raise_on_repeat
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            slow_ms=config['SLOW_QUERY_MS'],
+            repeat_threshold=config['N_PLUS_ONE_THRESHOLD'],
+            raise_on_repeat=config['N_PLUS_ONE_RAISE'],
+        )
+
+    def init_app(self, app):
+        app.extensions['query_watch'] = self
+        if not (self.slow_ms or self.repeat_threshold):
+            return
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        timings = current_timings()
+        if timings is not None:
+            queries = g.query_watch = RequestQueries(self)
+            timings.on_statement.append(queries.record)
+
+    def _finish(self, exc):
+        queries = g.pop('query_watch', None)
+        if queries is None or not queries.repeated or not self.raise_on_repeat:
+            return
+        raise NPlusOneError('; '.join(
+            f'{queries.counts[statement]} executions of: {statement}' for statement in queries.repeated
+        ) + f' (threshold {self.repeat_threshold}, in {_route()})')
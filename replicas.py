@@ -0,0 +1,197 @@
+"""
+Read-replica routing.
+
+GET/HEAD requests read from the replicas in ``DATABASE_REPLICA_URLS``
+round-robin; everything else, and reads that must see the caller's own
+recent writes, go to the primary. A replica that fails a health check or
+raises a connection error is skipped until ``REPLICA_RETRY_AFTER`` passes,
+so reads fall back to the primary instead of failing; the request that hit
+the error is retried once on the primary.
+"""
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.sql.dml import UpdateBase
+
+from db_pool import async_url, engine_options
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+# Sent back after writes; reads carrying it stay on the primary until it lapses
+PRIMARY_COOKIE = 'read_primary_until'
+# Clients can also ask for primary reads explicitly
+PRIMARY_HEADER = 'X-Read-Your-Writes'
+
+
+class ReplicaRouter:
+    """
+    Picks the engine for reads within one app.
+
+    Replica engines are owned here rather than registered as
+    Flask-SQLAlchemy binds, so ``create_all``/``drop_all`` never touch them.
+    They are created on first use, i.e. after the server forks.
+    """
+
+    def __init__(self, urls, options=None, lag_window=5, retry_after=30, health_interval=5):
+        self.urls = {f'replica_{i}': url for i, url in enumerate(urls)}
+        self.names = list(self.urls)
+        self.options = options or (lambda url: {})
+        self.engines = {}
+        self.lag_window = lag_window
+        self.retry_after = retry_after
+        self.health_interval = health_interval
+        self._next = itertools.count()
+        self._down_until = {key: 0.0 for key in self.names}
+        self._checked_at = {key: 0.0 for key in self.names}
+        self._reads = {key: 0 for key in self.names}
+        self._primary_reads = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        urls = config['DATABASE_REPLICA_URLS']
+        if config.get('DB_ASYNC_DRIVER'):
+            urls = [async_url(url) for url in urls]
+        return cls(
+            urls,
+            options=lambda url: engine_options(config, url),
+            lag_window=config['REPLICA_LAG_WINDOW'],
+            retry_after=config['REPLICA_RETRY_AFTER'],
+            health_interval=config['REPLICA_HEALTH_INTERVAL'],
+        )
+
+    def init_app(self, app):
+        app.extensions['replicas'] = self
+        if self.names:
+            app.after_request(self._mark_write)
+            # Wraps the view call itself: views turn database errors into a 500
+            app.dispatch_request = self._retrying(app.dispatch_request)
+
+    def _mark_write(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            until = int(time.time() + self.lag_window) + 1
+            response.set_cookie(PRIMARY_COOKIE, str(until), max_age=self.lag_window + 1, httponly=True)
+        return response
+
+    def _wants_primary(self):
+        if request.method not in READ_METHODS:
+            return True
+        if request.headers.get(PRIMARY_HEADER, '').lower() in ('1', 'true'):
+            return True
+        try:
+            return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _engine(self, key):
+        engine = self.engines.get(key)
+        if engine is None:
+            with self._lock:
+                engine = self.engines.get(key)
+                if engine is None:
+                    url = self.urls[key]
+                    engine = create_engine(url, **self.options(url))
+                    event.listen(engine, 'handle_error', lambda ctx: self._on_error(key, ctx))
+                    self.engines[key] = engine
+        return engine
+
+    def all_engines(self):
+        """Every replica's engine, creating those not used yet."""
+        return [self._engine(key) for key in self.names]
+
+    def _on_error(self, key, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(key)
+            if has_request_context():
+                g._replica_failed = True
+
+    def _retrying(self, dispatch):
+        """Runs a read that failed on a replica again, once, on the primary."""
+        @wraps(dispatch)
+        def dispatch_request():
+            try:
+                response = dispatch()
+            except Exception:
+                if not g.pop('_replica_failed', False):
+                    raise
+            else:
+                if not g.pop('_replica_failed', False):
+                    return response
+            logger.warning('Retrying %s %s on the primary', request.method, request.path)
+            g._read_engine = None
+            current_app.extensions['sqlalchemy'].session.rollback()
+            return dispatch()
+        return dispatch_request
+
+    def mark_down(self, key):
+        logger.warning('Read replica %s is unhealthy; reading from the primary for %ss', key, self.retry_after)
+        with self._lock:
+            self._down_until[key] = time.monotonic() + self.retry_after
+
+    def _healthy(self, key):
+        now = time.monotonic()
+        if now < self._down_until[key]:
+            return False
+        if now - self._checked_at[key] < self.health_interval:
+            return True
+        try:
+            with self._engine(key).connect() as conn:
+                conn.execute(text('SELECT 1'))
+        except Exception:
+            self.mark_down(key)
+            return False
+        self._checked_at[key] = now
+        return True
+
+    def pick(self):
+        """Next healthy replica's engine round-robin, or None for the primary."""
+        for _ in range(len(self.names)):
+            key = self.names[next(self._next) % len(self.names)]
+            if self._healthy(key):
+                self._reads[key] += 1
+                return self._engine(key)
+        self._primary_reads += 1
+        return None
+
+    def read_engine(self):
+        """The engine this request reads from, chosen once per request."""
+        if not self.names or self._wants_primary():
+            return None
+        if '_read_engine' not in g:
+            g._read_engine = self.pick()
+        return g._read_engine
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'primary_reads': self._primary_reads,
+            'replicas': {
+                key: {'healthy': now >= self._down_until[key], 'reads': self._reads[key]}
+                for key in self.names
+            },
+        }
+
+
+def served_by_replica():
+    """Whether this request has read from a replica."""
+    return has_request_context() and g.get('_read_engine') is not None
+
+
+class RoutingSession(Session):
+    """Session that sends reads made while serving GET/HEAD to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) \
+                and has_request_context():
+            router = current_app.extensions.get('replicas')
+            engine = router.read_engine() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
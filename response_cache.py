@@ -0,0 +1,291 @@
+"""
+Server-side cache for GET responses with tag-based write-through invalidation.
+
+Each cached response is stored with the generation of every tag it depends
+on (e.g. ``movies`` for the list, ``movies:3`` for one movie). Writes bump
+those generations, which atomically invalidates every dependent entry no
+matter which worker stored it or which query string produced it.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, request
+
+from replicas import served_by_replica
+
+_STORED_HEADERS = ('Content-Type', 'ETag')
+
+
+class MemoryBackend:
+    """Per-process LRU bounded by entry count and total body bytes."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generations = {}
+        self._bumped_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        size = len(entry['body'])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old['body'])
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['body'])
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old['body'])
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            self._bumped_at[tag] = time.time()
+
+    def bumped_at(self, tags):
+        """When any of ``tags`` was last bumped, 0 if never."""
+        with self._lock:
+            return max((self._bumped_at.get(tag, 0) for tag in tags), default=0)
+
+    def size(self):
+        return len(self._entries)
+
+
+class FileBackend:
+    """
+    Entries as files in a directory shared by all workers on the host.
+
+    Point it at a tmpfs such as ``/dev/shm`` to keep it in shared memory.
+    Writes go through a temp file and ``os.replace`` so readers never see a
+    partial entry; tag generations are random tokens so concurrent bumps
+    from different workers can never cancel each other out.
+    """
+
+    def __init__(self, directory, max_entries):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.evictions = 0
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as fh:
+                meta, body = fh.read().split(b'\n', 1)
+        except (OSError, ValueError):
+            return None
+        entry = json.loads(meta)
+        entry['body'] = body
+        return entry
+
+    def set(self, key, entry):
+        meta = {k: v for k, v in entry.items() if k != 'body'}
+        self._write(self._path(key), json.dumps(meta).encode('utf-8') + b'\n' + entry['body'])
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def generations(self, tags):
+        generations = []
+        for tag in tags:
+            try:
+                with open(os.path.join(self.directory, 'tags', tag), 'r') as fh:
+                    generations.append(fh.read())
+            except OSError:
+                generations.append('')
+        return generations
+
+    def bump(self, tag):
+        self._write(os.path.join(self.directory, 'tags', tag), uuid.uuid4().hex.encode('ascii'))
+
+    def bumped_at(self, tags):
+        """When any of ``tags`` was last bumped, 0 if never."""
+        times = [0]
+        for tag in tags:
+            try:
+                times.append(os.stat(os.path.join(self.directory, 'tags', tag)).st_mtime)
+            except OSError:
+                pass
+        return max(times)
+
+    def size(self):
+        return sum(1 for e in os.scandir(self.directory) if e.is_file() and not e.name.startswith('.'))
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.directory) if e.is_file() and not e.name.startswith('.')]
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        # Drop the oldest entries plus some headroom so we don't rescan on every set
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:excess + self.max_entries // 10]:
+            self.delete(entry.name)
+            self.evictions += 1
+
+
+class ResponseCache:
+    """
+    Caches successful GET responses per URL and caller permission set.
+
+    A replica may not have seen a write yet, so a response read from one
+    within ``replica_lag`` seconds of a write to its tags is only cached
+    until that window closes.
+    """
+
+    def __init__(self, backend=None, ttl=30, replica_lag=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        kind = config['RESPONSE_CACHE_BACKEND']
+        if kind == 'memory':
+            backend = MemoryBackend(config['RESPONSE_CACHE_MAX_ENTRIES'], config['RESPONSE_CACHE_MAX_BYTES'])
+        elif kind == 'file':
+            backend = FileBackend(config['RESPONSE_CACHE_DIR'], config['RESPONSE_CACHE_MAX_ENTRIES'])
+        elif kind in ('none', '', None):
+            backend = None
+        else:
+            raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {kind}')
+        replica_lag = config['REPLICA_LAG_WINDOW'] if config['DATABASE_REPLICA_URLS'] else 0
+        return cls(backend, config['RESPONSE_CACHE_TTL'], replica_lag)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @staticmethod
+    def _key():
+        # Permissions are part of the key: two callers only ever share an
+        # entry if they would have been authorized identically.
+        permissions = sorted(g.get('current_user', {}).get('permissions', []))
+        parts = (request.path, request.query_string.decode('latin-1'),
+                 str(request.accept_mimetypes), permissions)
+        return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    def cached(self, resource, related=None):
+        """
+        Decorator for GET views, applied inside ``requires_auth``.
+
+        List views depend on the ``resource`` tag, item views on
+        ``resource:<id>`` (built from the URL arguments). Requests with
+        ``?include=`` also depend on the ``related`` resource's list tag,
+        which every write to that resource bumps.
+        """
+        def decorator(f):
+            if not self.enabled:
+                return f
+
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                tags = [f'{resource}:{v}' for v in kwargs.values()] or [resource]
+                if related and request.args.get('include'):
+                    tags.append(related)
+                return self._serve(tags, f, args, kwargs)
+            return wrapper
+        return decorator
+
+    def _serve(self, tags, view, args, kwargs):
+        key = self._key()
+        generations = self.backend.generations(tags)
+        if 'no-cache' not in request.headers.get('Cache-Control', ''):
+            entry = self.backend.get(key)
+            if entry is not None and entry['expires_at'] > time.time() \
+                    and entry['generations'] == generations:
+                self.hits += 1
+                return self._response(entry)
+        self.misses += 1
+
+        response = view(*args, **kwargs)
+        if isinstance(response, Response) and response.status_code == 200 \
+                and not response.is_streamed:
+            now = time.time()
+            expires_at = now + self.ttl
+            bumped_at = self.backend.bumped_at(tags) if self.replica_lag and served_by_replica() else 0
+            if bumped_at:
+                expires_at = min(expires_at, bumped_at + self.replica_lag)
+                if expires_at <= now:
+                    return response
+            self.backend.set(key, {
+                # Generations were read before the view ran, so a write that
+                # lands mid-request leaves this entry already stale.
+                'generations': generations,
+                'expires_at': expires_at,
+                'headers': [[h, response.headers[h]] for h in _STORED_HEADERS if h in response.headers],
+                'body': response.get_data(),
+            })
+        return response
+
+    @staticmethod
+    def _response(entry):
+        headers = dict(entry['headers'])
+        etag = headers.get('ETag', '').strip('"')
+        if etag and request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        return Response(entry['body'], status=200, headers=headers)
+
+    def invalidate(self, *tags):
+        """Drops every entry that depends on any of ``tags``."""
+        if self.enabled:
+            for tag in tags:
+                self.backend.bump(tag)
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'backend': type(self.backend).__name__,
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+        }
@@ -0,0 +1,135 @@
+"""
+Ranked, typo-tolerant search across movie titles and actor names.
+
+PostgreSQL matches with pg_trgm word similarity plus a ``simple`` tsvector,
+both answered by GIN indexes. SQLite (local and test runs) uses the FTS5
+trigram tables created alongside the models, ranked by bm25.
+"""
+from typing import NamedTuple
+
+from sqlalchemy import column as sql_column, func, literal, literal_column, or_, select, table, union_all
+
+from auth import AuthError
+from listing import ListQueryError, startswith_pattern
+from models import db, Movie, Actor
+
+# Search type -> (model, searched column, read permission)
+SEARCHABLE = {
+    'movies': (Movie, 'title', 'get:movies'),
+    'actors': (Actor, 'name', 'get:actors'),
+}
+
+# Below this length there are no trigrams to match; fall back to a prefix scan
+MIN_FUZZY_LENGTH = 3
+
+
+class SearchQuery(NamedTuple):
+    """Validated parameters for one search request"""
+    text: str
+    types: tuple
+    limit: int
+
+
+def parse_search_args(args, permissions, default_limit=20, max_limit=100):
+    """
+    Reads ``q``, ``type`` and ``limit``.
+
+    ``type`` (comma-separated) defaults to every entity the caller may read;
+    asking for one they can't read is rejected rather than silently dropped.
+    """
+    text = ' '.join(args.get('q', '').split())
+    if not text:
+        raise ListQueryError('q is required.')
+    if len(text) > 120:
+        raise ListQueryError('q must be at most 120 characters.')
+
+    requested = [t for t in args.get('type', '').split(',') if t]
+    unknown = [t for t in requested if t not in SEARCHABLE]
+    if unknown:
+        raise ListQueryError(f"Unknown type(s): {', '.join(unknown)}.")
+    allowed = [t for t in SEARCHABLE if SEARCHABLE[t][2] in permissions]
+    types = tuple(requested or allowed)
+    if not types or any(t not in allowed for t in types):
+        raise AuthError({"code": "unauthorized", "description": "Permission not found."}, 403)
+
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ListQueryError('limit must be an integer.')
+    if limit < 1:
+        raise ListQueryError('limit must be positive.')
+    return SearchQuery(text, types, min(limit, max_limit))
+
+
+def _prefix_select(kind, model, column, text):
+    return select(
+        literal(kind).label('type'), model.id, column.label('text'), literal(1.0).label('score')
+    ).where(startswith_pattern(column, text))
+
+
+def _postgresql_select(kind, model, column, text):
+    # Both predicates must be spelled exactly like the index definitions
+    # (``column gin_trgm_ops`` and ``to_tsvector('simple', column)``).
+    document = func.to_tsvector(literal_column("'simple'"), column)
+    tsquery = func.plainto_tsquery(literal_column("'simple'"), text)
+    score = func.greatest(func.word_similarity(text, column), func.ts_rank(document, tsquery))
+    return select(
+        literal(kind).label('type'), model.id, column.label('text'), score.label('score')
+    ).where(or_(literal(text).op('<%')(column), document.op('@@')(tsquery)))
+
+
+def _fts_match(text):
+    # OR of the query's trigrams: rows sharing more (and rarer) trigrams
+    # rank higher, so a typo only costs the few trigrams it touches.
+    lowered = text.lower()
+    grams = dict.fromkeys(lowered[i:i + 3] for i in range(len(lowered) - 2))
+    return ' OR '.join('"{}"'.format(gram.replace('"', '""')) for gram in grams)
+
+
+def _sqlite_select(kind, model, column, text):
+    fts = table(f'{model.__tablename__}_fts', sql_column('rowid'))
+    # FTS5 exposes the table itself as a hidden column for MATCH and bm25()
+    hidden = literal_column(fts.name)
+    return select(
+        literal(kind).label('type'), model.id, column.label('text'),
+        (-func.bm25(hidden)).label('score')
+    ).select_from(
+        fts.join(model, model.id == fts.c.rowid)
+    ).where(hidden.op('MATCH')(_fts_match(text)))
+
+
+def search(query):
+    """
+    Returns the top ``query.limit`` matches across ``query.types``, best first.
+
+    One ``UNION ALL`` statement: each branch is an index lookup, and the
+    database merges and ranks them so only the final rows cross the wire.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if len(query.text) < MIN_FUZZY_LENGTH:
+        build = _prefix_select
+    elif dialect == 'postgresql':
+        build = _postgresql_select
+    elif dialect == 'sqlite':
+        build = _sqlite_select
+    else:
+        build = _prefix_select
+
+    branches = []
+    for kind in query.types:
+        model, name, _ = SEARCHABLE[kind]
+        branches.append(build(kind, model, getattr(model, name), query.text))
+    stmt = union_all(*branches) if len(branches) > 1 else branches[0]
+    ranked = select(stmt.subquery()).order_by(
+        literal_column('score').desc(), literal_column('type'), literal_column('id')
+    ).limit(query.limit)
+
+    results = []
+    for kind, item_id, text, score in db.session.execute(ranked):
+        results.append({
+            'type': kind[:-1],
+            'id': item_id,
+            SEARCHABLE[kind][1]: text,
+            'score': float(score),
+        })
+    return results
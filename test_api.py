@@ -0,0 +1,1235 @@
+"""
+Offline API tests for the list/query features, using locally minted tokens
+"""
+import os
+import json
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy import event
+
+import auth
+import bulk
+import listing
+import timing
+from app import create_app, warm_up
+from metrics import Metrics, mark_process_dead
+from querywatch import NPlusOneError, param_shape
+from auth_stub import make_key_pair, mint_token, write_jwks
+from models import setup_db, db, Movie, Actor, MovieActor
+
+DOMAIN = "casting-agency.test"
+AUDIENCE = "casting-agency"
+ASSISTANT = ["get:actors", "get:movies"]
+DIRECTOR = ASSISTANT + ["post:actors", "patch:actors", "delete:actors", "patch:movies"]
+PRODUCER = DIRECTOR + ["post:movies", "delete:movies"]
+
+
+class OfflineAPITestCase(unittest.TestCase):
+    """Base test case: a seeded database and tokens signed by a local JWKS"""
+
+    test_config = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = make_key_pair("api-test-key", 1024)
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.jwks_url = write_jwks(os.path.join(cls.tmpdir, "jwks.json"), cls.key)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        """Setup test fixtures before each test"""
+        for name, value in (("AUTH0_DOMAIN", DOMAIN), ("API_AUDIENCE", AUDIENCE), ("JWKS_URL", self.jwks_url)):
+            patch = mock.patch.object(auth, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.app = self._create_app()
+        self.client = self.app.test_client
+        self.database_path = os.environ.get(
+            'DATABASE_URL_TEST',
+            'postgresql://localhost:5432/capstone_test'
+        )
+        if self.database_path.startswith("postgres://"):
+            self.database_path = self.database_path.replace(
+                "postgres://", "postgresql://", 1
+            )
+        setup_db(self.app, self.database_path)
+
+        with self.app.app_context():
+            db.create_all()
+            self._seed_data()
+
+    def _create_app(self):
+        return create_app(self.test_config)
+
+    def tearDown(self):
+        """Executed after each test"""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _seed_data(self):
+        """Five actors and three movies with predictable ids"""
+        db.session.add_all([
+            Actor(name="Alice", age=30, gender="Female"),
+            Actor(name="Bob", age=45, gender="Male"),
+            Actor(name="Carol", age=52, gender="Female"),
+            Actor(name="Dave", age=23, gender="Male"),
+            Actor(name="Eve", age=38, gender="Female"),
+        ])
+        db.session.add_all([
+            Movie(title="Alpha", release_date=datetime(2001, 1, 1)),
+            Movie(title="Beta", release_date=datetime(2010, 6, 1)),
+            Movie(title="Gamma", release_date=datetime(2020, 3, 15)),
+        ])
+        db.session.commit()
+
+    def _headers(self, permissions=ASSISTANT, **extra):
+        token = mint_token(self.key, DOMAIN, AUDIENCE, permissions)
+        return {'Authorization': f'Bearer {token}', **extra}
+
+    def _get(self, url, permissions=ASSISTANT, **headers):
+        res = self.client().get(url, headers=self._headers(permissions, **headers))
+        return res, (json.loads(res.data) if res.is_json else None)
+
+    def _capture_sql(self):
+        """Records every SQL statement the app issues during the test"""
+        statements = []
+        with self.app.app_context():
+            engine = db.engine
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute', record)
+        return statements
+
+
+class PaginationTestCase(OfflineAPITestCase):
+    """Keyset pagination on GET /api/movies and GET /api/actors"""
+
+    def test_001_unpaged_list_keeps_shape(self):
+        """Test a request without paging params gets the historical body"""
+        res, data = self._get('/api/actors')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data), {'success', 'actors', 'total_actors'})
+        self.assertEqual(data['total_actors'], 5)
+
+    def test_002_walk_pages_with_cursor(self):
+        """Test following next_cursor visits every row exactly once"""
+        seen, url = [], '/api/actors?limit=2'
+        while url:
+            res, data = self._get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(data['actors']), 2)
+            seen.extend(actor['id'] for actor in data['actors'])
+            url = data['next_cursor'] and f"/api/actors?limit=2&after={data['next_cursor']}"
+
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+
+    def test_003_last_page_has_null_cursor(self):
+        """Test the final page reports no further cursor"""
+        res, data = self._get('/api/movies?limit=3')
+
+        self.assertEqual(len(data['movies']), 3)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_004_invalid_paging_params(self):
+        """Test malformed limit and cursor values are rejected with 400"""
+        for url in ('/api/movies?limit=abc', '/api/movies?limit=0', '/api/movies?after=%%%'):
+            res, data = self._get(url)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+
+class HardCapTestCase(OfflineAPITestCase):
+    """The configured hard cap bounds unpaged responses"""
+
+    test_config = {'LIST_MAX_LIMIT': 3}
+
+    def test_001_unpaged_list_is_capped(self):
+        """Test an unpaged request stops at the cap and offers a cursor"""
+        res, data = self._get('/api/actors')
+
+        self.assertEqual(len(data['actors']), 3)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_002_limit_is_clamped_to_cap(self):
+        """Test an oversized limit is clamped rather than honoured"""
+        res, data = self._get('/api/actors?limit=100')
+
+        self.assertEqual(len(data['actors']), 3)
+
+
+class StreamingTestCase(OfflineAPITestCase):
+    """Streamed NDJSON and chunked JSON exports of the list endpoints"""
+
+    test_config = {'LIST_MAX_LIMIT': 2, 'STREAM_BATCH_SIZE': 2}
+
+    def test_001_ndjson_export(self):
+        """Test Accept: application/x-ndjson streams one actor per line"""
+        res = self.client().get(
+            '/api/actors',
+            headers=self._headers(Accept='application/x-ndjson')
+        )
+        self.assertTrue(res.is_streamed)
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 2, 3, 4, 5])
+
+    def test_002_chunked_json_export_matches_list_shape(self):
+        """Test ?stream=1 sends the regular envelope, uncapped"""
+        res = self.client().get('/api/movies?stream=1', headers=self._headers())
+        self.assertTrue(res.is_streamed)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_movies'], 3)
+        self.assertEqual([m['title'] for m in data['movies']], ['Alpha', 'Beta', 'Gamma'])
+
+    def test_003_stream_requires_permission(self):
+        """Test streaming goes through the same permission check"""
+        res, data = self._get('/api/movies?stream=1', permissions=['get:actors'])
+
+        self.assertEqual(res.status_code, 403)
+
+    def test_004_failure_midway_is_not_a_complete_export(self):
+        """Test a row failing mid-stream aborts the response instead of ending it cleanly"""
+        make_serializer = listing._serializer
+
+        def failing_serializer(projection):
+            serialize, rows = make_serializer(projection), []
+
+            def serialize_or_fail(row):
+                rows.append(row)
+                if len(rows) == 3:
+                    raise RuntimeError('row 3 failed')
+                return serialize(row)
+            return serialize_or_fail
+
+        for url, headers in (('/api/actors', {'Accept': 'application/x-ndjson'}),
+                             ('/api/movies?stream=1', {})):
+            with self.subTest(url=url), \
+                    mock.patch.object(listing, '_serializer', failing_serializer), \
+                    self.assertLogs('listing', 'ERROR'), \
+                    self.assertRaisesRegex(RuntimeError, 'row 3 failed'):
+                res = self.client().get(url, headers=self._headers(**headers))
+                res.get_data()
+
+
+class FilterSortTestCase(OfflineAPITestCase):
+    """Server-side filters and whitelisted sort keys on list endpoints"""
+
+    def _names(self, url):
+        res, data = self._get(url)
+        self.assertEqual(res.status_code, 200)
+        return [actor['name'] for actor in data['actors']]
+
+    def test_001_actor_filters(self):
+        """Test age range, gender and name prefix filters combine"""
+        self.assertEqual(self._names('/api/actors?age_min=30&age_max=50'), ['Alice', 'Bob', 'Eve'])
+        self.assertEqual(self._names('/api/actors?gender=Female&age_min=35'), ['Carol', 'Eve'])
+        self.assertEqual(self._names('/api/actors?name_prefix=Da'), ['Dave'])
+
+    def test_002_movie_release_range_and_prefix(self):
+        """Test release date range and title prefix filters"""
+        res, data = self._get('/api/movies?release_from=2005-01-01&release_to=2020-12-31')
+        self.assertEqual([m['title'] for m in data['movies']], ['Beta', 'Gamma'])
+
+        res, data = self._get('/api/movies?title_prefix=Gam')
+        self.assertEqual([m['title'] for m in data['movies']], ['Gamma'])
+
+    def test_003_prefix_is_escaped(self):
+        """Test LIKE wildcards in a prefix are matched literally"""
+        self.assertEqual(self._names('/api/actors?name_prefix=%25'), [])
+
+    def test_004_sort_descending_with_pagination(self):
+        """Test cursors walk a non-id sort order without gaps or repeats"""
+        names, url = [], '/api/actors?sort=-age&limit=2'
+        while url:
+            res, data = self._get(url)
+            names.extend(a['name'] for a in data['actors'])
+            url = data['next_cursor'] and f"/api/actors?sort=-age&limit=2&after={data['next_cursor']}"
+
+        self.assertEqual(names, ['Carol', 'Bob', 'Eve', 'Alice', 'Dave'])
+
+    def test_005_sort_by_date_with_projection(self):
+        """Test a date sort pages correctly even when the column is not projected"""
+        res, data = self._get('/api/movies?sort=-release_date&fields=title&limit=1')
+        res, page2 = self._get(f"/api/movies?sort=-release_date&fields=title&limit=1&after={data['next_cursor']}")
+
+        self.assertEqual(data['movies'], [{'title': 'Gamma'}])
+        self.assertEqual(page2['movies'], [{'title': 'Beta'}])
+
+    def test_006_invalid_filter_and_sort(self):
+        """Test unknown sort keys, bad values and mismatched cursors are 400s"""
+        _, data = self._get('/api/actors?sort=age&limit=1')
+        for url in ('/api/actors?sort=salary', '/api/actors?age_min=old',
+                    '/api/movies?release_from=yesterday',
+                    f"/api/actors?sort=name&after={data['next_cursor']}",
+                    f"/api/actors?sort=age&after={listing.encode_cursor(['age', 'old', 1])}",
+                    f"/api/actors?sort=age&after={listing.encode_cursor(['age', True, 1])}",
+                    f"/api/actors?sort=name&after={listing.encode_cursor(['name', 7, 1])}",
+                    f"/api/actors?sort=-id&after={listing.encode_cursor(['-id', '5', 5])}",
+                    f"/api/actors?after={listing.encode_cursor([True])}"):
+            res, _ = self._get(url)
+            self.assertEqual(res.status_code, 400, url)
+
+
+class ReadPathTestCase(OfflineAPITestCase):
+    """Core row-tuple read path versus the ORM entity path"""
+
+    URLS = (
+        '/api/actors', '/api/actors?sort=-age&limit=2', '/api/actors/3',
+        '/api/movies', '/api/movies?release_from=2005-01-01', '/api/movies/2',
+    )
+
+    def _bodies(self, read_path):
+        self.app.config['LIST_READ_PATH'] = read_path
+        bodies = [self.client().get(url, headers=self._headers()).data for url in self.URLS]
+        res = self.client().get('/api/movies', headers=self._headers(Accept='application/x-ndjson'))
+        return bodies + [res.get_data()]
+
+    def test_001_core_output_matches_orm(self):
+        """Test both read paths produce byte-identical responses"""
+        self.assertEqual(self._bodies('core'), self._bodies('orm'))
+
+    def test_002_core_path_builds_no_instances(self):
+        """Test whole-row reads never load ORM instances"""
+        loaded = []
+
+        def record(target, context):
+            loaded.append(target)
+        for model in (Actor, Movie):
+            event.listen(model, 'load', record)
+            self.addCleanup(event.remove, model, 'load', record)
+
+        self._bodies('core')
+        self.assertEqual(loaded, [])
+        self._bodies('orm')
+        self.assertNotEqual(loaded, [])
+
+
+class FieldsTestCase(OfflineAPITestCase):
+    """Sparse fieldsets (?fields=) on list and detail endpoints"""
+
+    def test_001_list_projection(self):
+        """Test ?fields= limits both the response and the SELECT"""
+        statements = self._capture_sql()
+        res, data = self._get('/api/actors?fields=id,name')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors'][0], {'id': 1, 'name': 'Alice'})
+        row_sql = [sql for sql in statements if 'actors.name' in sql]
+        self.assertEqual(len(row_sql), 1)
+        self.assertNotIn('age', row_sql[0])
+
+    def test_002_projection_without_id_still_pages(self):
+        """Test a projection that omits id still yields cursors"""
+        res, data = self._get('/api/movies?fields=title&limit=2')
+
+        self.assertEqual(data['movies'], [{'title': 'Alpha'}, {'title': 'Beta'}])
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_003_detail_projection_formats_dates(self):
+        """Test a projected datetime is serialized like to_dict does"""
+        res, data = self._get('/api/movies/2?fields=release_date')
+
+        self.assertEqual(data['movie'], {'release_date': '2010-06-01T00:00:00'})
+
+    def test_004_unknown_field_rejected(self):
+        """Test an unknown field name is a 400, not a silent drop"""
+        res, data = self._get('/api/actors?fields=id,salary')
+
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('salary', data['message'])
+
+    def test_005_detail_projection_missing_row(self):
+        """Test a projected lookup of a missing id is still a 404"""
+        res, data = self._get('/api/actors/999?fields=name')
+
+        self.assertEqual(res.status_code, 404)
+
+
+class ConditionalGetTestCase(OfflineAPITestCase):
+    """ETag / If-None-Match handling on the read endpoints"""
+
+    def test_001_unchanged_list_is_not_modified(self):
+        """Test a repeated list poll with the ETag gets an empty 304"""
+        res, data = self._get('/api/movies')
+        etag = res.headers['ETag']
+
+        statements = self._capture_sql()
+        again, _ = self._get('/api/movies', **{'If-None-Match': etag})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+        self.assertEqual(again.headers['ETag'], etag)
+        self.assertEqual(len(statements), 1)
+
+    def test_002_write_changes_list_etag(self):
+        """Test an update invalidates the list and item ETags"""
+        list_res, _ = self._get('/api/actors')
+        item_res, _ = self._get('/api/actors/2')
+
+        self.client().patch('/api/actors/2', json={'age': 46}, headers=self._headers(DIRECTOR))
+
+        for url, old in (('/api/actors', list_res), ('/api/actors/2', item_res)):
+            res, data = self._get(url, **{'If-None-Match': old.headers['ETag']})
+            self.assertEqual(res.status_code, 200)
+            self.assertNotEqual(res.headers['ETag'], old.headers['ETag'])
+
+    def test_003_etag_depends_on_query(self):
+        """Test different projections of the same data get different ETags"""
+        full, _ = self._get('/api/movies/1')
+        projected, _ = self._get('/api/movies/1?fields=title')
+
+        self.assertNotEqual(full.headers['ETag'], projected.headers['ETag'])
+
+    def test_004_delete_changes_list_etag(self):
+        """Test a delete is visible through the row count"""
+        res, _ = self._get('/api/movies')
+        self.client().delete('/api/movies/3', headers=self._headers(PRODUCER))
+
+        again, data = self._get('/api/movies', **{'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(data['total_movies'], 2)
+
+    def test_005_back_to_back_writes_change_list_etag(self):
+        """Test the database stamps updated_at finely enough for rapid writes"""
+        etags = []
+        for age in (46, 47, 48):
+            self.client().patch('/api/actors/2', json={'age': age}, headers=self._headers(DIRECTOR))
+            res, _ = self._get('/api/actors')
+            etags.append(res.headers['ETag'])
+
+        self.assertEqual(len(set(etags)), 3)
+
+        with self.app.app_context():
+            db.session.execute(Actor.__table__.insert().values(
+                name='Raw', age=30, gender='Female', created_at=datetime(2024, 1, 1)
+            ))
+            db.session.commit()
+            stamped = db.session.scalar(db.select(Actor.updated_at).where(Actor.name == 'Raw'))
+        self.assertIsInstance(stamped, datetime)
+
+
+class ResponseCacheTestCase(OfflineAPITestCase):
+    """In-process response cache with write-through invalidation"""
+
+    test_config = {'RESPONSE_CACHE_BACKEND': 'memory'}
+
+    def test_001_repeat_read_served_from_cache(self):
+        """Test a repeated GET issues no SQL at all"""
+        first, data = self._get('/api/actors')
+        statements = self._capture_sql()
+        second, cached = self._get('/api/actors')
+
+        self.assertEqual(statements, [])
+        self.assertEqual(cached, data)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+
+    def test_002_writes_invalidate_list_and_item(self):
+        """Test PATCH drops both the list and the item entries"""
+        self._get('/api/actors')
+        self._get('/api/actors/2')
+
+        self.client().patch('/api/actors/2', json={'name': 'Robert'}, headers=self._headers(DIRECTOR))
+
+        _, listed = self._get('/api/actors')
+        _, item = self._get('/api/actors/2')
+        self.assertEqual(listed['actors'][1]['name'], 'Robert')
+        self.assertEqual(item['actor']['name'], 'Robert')
+
+    def test_003_create_invalidates_list(self):
+        """Test POST makes the new row visible immediately"""
+        self._get('/api/movies')
+        self.client().post(
+            '/api/movies',
+            json={'title': 'Delta', 'release_date': '2024-01-01T00:00:00'},
+            headers=self._headers(PRODUCER)
+        )
+
+        _, data = self._get('/api/movies')
+        self.assertEqual(data['total_movies'], 4)
+
+    def test_004_permissions_still_enforced(self):
+        """Test a cached entry is never served to an unauthorized caller"""
+        self._get('/api/movies')
+        res, data = self._get('/api/movies', permissions=['get:actors'])
+
+        self.assertEqual(res.status_code, 403)
+
+    def test_005_cached_etag_answers_304(self):
+        """Test conditional requests are answered from the cache"""
+        res, _ = self._get('/api/movies/1')
+        statements = self._capture_sql()
+        again, _ = self._get('/api/movies/1', **{'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(statements, [])
+
+    def test_006_stats_endpoint(self):
+        """Test cache and pool counters are exposed to admins"""
+        self._get('/api/actors')
+        self._get('/api/actors')
+        res, data = self._get('/api/admin/stats', permissions=['get:stats'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['response_cache']['hits'], 1)
+        self.assertEqual(data['response_cache']['misses'], 1)
+        self.assertIn('hits', data['token_cache'])
+        self.assertEqual(data['db_pool']['in_use'], 0)
+        self.assertGreater(data['db_pool']['checkouts'], 0)
+
+
+class FileResponseCacheTestCase(OfflineAPITestCase):
+    """Shared file backend: invalidation crosses worker boundaries"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.test_config = {'RESPONSE_CACHE_BACKEND': 'file', 'RESPONSE_CACHE_DIR': self.cache_dir}
+        super().setUp()
+
+    def test_001_write_in_one_worker_invalidates_another(self):
+        """Test two apps sharing a cache dir see each other's invalidations"""
+        other_worker = create_app(self.test_config)
+        setup_db(other_worker, self.database_path)
+        self._get('/api/actors')
+
+        other_worker.test_client().delete('/api/actors/5', headers=self._headers(DIRECTOR))
+
+        _, data = self._get('/api/actors')
+        self.assertEqual(data['total_actors'], 4)
+
+    def test_002_entries_are_bounded(self):
+        """Test the file backend evicts beyond its entry limit"""
+        cache = self.app.extensions['response_cache']
+        cache.backend.max_entries = 2
+        for actor_id in range(1, 6):
+            self._get(f'/api/actors/{actor_id}')
+
+        self.assertLessEqual(cache.backend.size(), 2)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+
+class IncludeTestCase(OfflineAPITestCase):
+    """?include= on list and detail endpoints without N+1 queries"""
+
+    def _seed_data(self):
+        super()._seed_data()
+        # Alpha: Alice, Bob, Carol; Beta: Dave; Gamma: Alice, Eve
+        db.session.add_all(
+            MovieActor(movie_id=movie_id, actor_id=actor_id)
+            for movie_id, actor_id in ((1, 1), (1, 2), (1, 3), (2, 4), (3, 1), (3, 5))
+        )
+        db.session.commit()
+
+    def test_001_movies_with_cast(self):
+        """Test ?include=actors nests each movie's cast"""
+        res, data = self._get('/api/movies?include=actors')
+
+        casts = {m['title']: [a['name'] for a in m['actors']] for m in data['movies']}
+        self.assertEqual(casts, {
+            'Alpha': ['Alice', 'Bob', 'Carol'],
+            'Beta': ['Dave'],
+            'Gamma': ['Alice', 'Eve'],
+        })
+
+    def test_002_query_count_is_constant(self):
+        """Test a page costs the same number of queries for 1 or 3 movies"""
+        counts = []
+        for limit in (1, 3):
+            statements = self._capture_sql()
+            res, data = self._get(f'/api/movies?include=actors&limit={limit}')
+            self.assertEqual(len(data['movies']), limit)
+            counts.append(len(statements))
+
+        # fingerprint + movies + movie_actors + actors
+        self.assertEqual(counts, [4, 4])
+
+    def test_003_actor_filmography(self):
+        """Test ?include=movies on the actor detail endpoint"""
+        res, data = self._get('/api/actors/1?include=movies&fields=name')
+
+        self.assertEqual(data['actor']['name'], 'Alice')
+        self.assertNotIn('age', data['actor'])
+        self.assertEqual([m['title'] for m in data['actor']['movies']], ['Alpha', 'Gamma'])
+
+    def test_004_unknown_include_rejected(self):
+        """Test an unknown relationship name is a 400"""
+        res, data = self._get('/api/movies?include=directors')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_005_related_edit_changes_etag(self):
+        """Test renaming a cast member invalidates the movie's ETag"""
+        res, _ = self._get('/api/movies/1?include=actors')
+        self.client().patch('/api/actors/2', json={'name': 'Robert'}, headers=self._headers(DIRECTOR))
+
+        again, data = self._get('/api/movies/1?include=actors', **{'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(data['movie']['actors'][1]['name'], 'Robert')
+
+
+class SearchTestCase(OfflineAPITestCase):
+    """Ranked fuzzy search across movies and actors"""
+
+    def _search(self, query, permissions=ASSISTANT):
+        res, data = self._get(f'/api/search?{query}', permissions)
+        self.assertEqual(res.status_code, 200, data)
+        return [(r['type'], r.get('name') or r.get('title')) for r in data['results']]
+
+    def test_001_typo_tolerant_match_ranks_first(self):
+        """Test a misspelt name still finds the actor, best match first"""
+        results = self._search('q=Alise')
+
+        self.assertEqual(results[0], ('actor', 'Alice'))
+
+    def test_002_results_span_both_entities(self):
+        """Test one query ranks movies and actors together"""
+        with self.app.app_context():
+            db.session.add(Movie(title="Alice in Wonderland", release_date=datetime(2010, 3, 5)))
+            db.session.commit()
+
+        results = self._search('q=alice')
+
+        self.assertEqual(set(results[:2]), {('actor', 'Alice'), ('movie', 'Alice in Wonderland')})
+
+    def test_003_search_follows_index_updates(self):
+        """Test renamed and deleted rows are reflected immediately"""
+        with self.app.app_context():
+            db.session.get(Actor, 2).name = "Roberto"
+            db.session.delete(db.session.get(Actor, 3))
+            db.session.commit()
+
+        self.assertEqual(self._search('q=robert&type=actors'), [('actor', 'Roberto')])
+        self.assertEqual(self._search('q=carol&type=actors'), [])
+
+    def test_004_short_query_matches_prefix(self):
+        """Test queries too short for trigrams fall back to a prefix match"""
+        self.assertEqual(self._search('q=Ga'), [('movie', 'Gamma')])
+
+    def test_005_types_limited_by_permissions(self):
+        """Test callers only search the entities they may read"""
+        self.assertEqual({t for t, _ in self._search('q=alpha', ['get:actors'])} - {'actor'}, set())
+
+        res, _ = self._get('/api/search?q=alpha&type=movies', ['get:actors'])
+        self.assertEqual(res.status_code, 403)
+        res, _ = self._get('/api/search?q=alpha', [])
+        self.assertEqual(res.status_code, 403)
+
+    def test_006_invalid_params(self):
+        """Test missing q and unknown types are 400s"""
+        for url in ('/api/search', '/api/search?q=%20', '/api/search?q=x&type=studios'):
+            res, _ = self._get(url)
+            self.assertEqual(res.status_code, 400, url)
+
+
+class BulkCreateTestCase(OfflineAPITestCase):
+    """POST /api/{actors,movies}/bulk: one validation pass, one INSERT"""
+
+    def _post(self, url, body, permissions=PRODUCER):
+        res = self.client().post(url, json=body, headers=self._headers(permissions))
+        return res, json.loads(res.data)
+
+    def test_001_single_insert_statement(self):
+        """Test the whole array is inserted by one INSERT in one transaction"""
+        statements = self._capture_sql()
+        actors = [{'name': f'Extra {i}', 'age': 20 + i, 'gender': 'Female'} for i in range(50)]
+
+        res, data = self._post('/api/actors/bulk', actors)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['total_created'], 50)
+        self.assertEqual([a['name'] for a in data['actors']], [a['name'] for a in actors])
+        self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith('INSERT INTO ACTORS')]), 1)
+        res, data = self._get('/api/actors?limit=1000')
+        self.assertEqual(len(data['actors']), 55)
+
+    def test_002_atomic_rejects_whole_batch(self):
+        """Test one invalid item fails an atomic batch with per-index errors"""
+        movies = [
+            {'title': 'Delta', 'release_date': '2022-01-01T00:00:00'},
+            {'title': '', 'release_date': '2022-01-01T00:00:00'},
+            {'title': 'Zeta'},
+        ]
+
+        res, data = self._post('/api/movies/bulk', {'movies': movies})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2])
+        self.assertEqual(data['errors'][1]['errors'][0]['loc'], ['release_date'])
+        _, listing = self._get('/api/movies')
+        self.assertEqual(listing['total_movies'], 3)
+
+    def test_003_best_effort_inserts_valid_items(self):
+        """Test best_effort inserts the valid items and reports the rest"""
+        actors = [
+            {'name': 'Frank', 'age': 41, 'gender': 'Male'},
+            {'name': 'Grace', 'age': -1, 'gender': 'Female'},
+            {'name': 'Heidi', 'age': 29, 'gender': 'Female'},
+        ]
+
+        res, data = self._post('/api/actors/bulk?mode=best_effort', actors)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual([a['name'] for a in data['actors']], ['Frank', 'Heidi'])
+        self.assertEqual([e['index'] for e in data['errors']], [1])
+
+    def test_004_invalid_envelope_and_permissions(self):
+        """Test bad bodies, modes and missing permissions are rejected"""
+        self.assertEqual(self._post('/api/actors/bulk', [])[0].status_code, 400)
+        self.assertEqual(self._post('/api/actors/bulk', {'name': 'x'})[0].status_code, 400)
+        self.assertEqual(self._post('/api/actors/bulk?mode=yolo', [{}])[0].status_code, 400)
+        self.assertEqual(self._post('/api/movies/bulk', [{}], DIRECTOR)[0].status_code, 403)
+
+    def test_005_item_limit(self):
+        """Test requests over BULK_MAX_ITEMS are rejected before validation"""
+        self.app.config['BULK_MAX_ITEMS'] = 2
+        actors = [{'name': 'X', 'age': 30, 'gender': 'Male'}] * 3
+
+        res, data = self._post('/api/actors/bulk', actors)
+
+        self.assertEqual(res.status_code, 400)
+
+
+class BulkUpdateDeleteTestCase(OfflineAPITestCase):
+    """PATCH/DELETE /api/{actors,movies}/bulk as single set-based statements"""
+
+    def _send(self, method, url, body, permissions=PRODUCER):
+        res = self.client().open(url, method=method, json=body, headers=self._headers(permissions))
+        return res, json.loads(res.data)
+
+    def _writes(self, statements, verb):
+        return [s for s in statements if s.lstrip().upper().startswith(verb)]
+
+    def test_001_update_by_filter(self):
+        """Test a filter selects rows for one UPDATE returning their ids"""
+        statements = self._capture_sql()
+
+        res, data = self._send('PATCH', '/api/actors/bulk',
+                               {'filter': {'gender': 'Female', 'age_min': 35}, 'set': {'gender': 'Retired'}})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], [3, 5])
+        self.assertEqual(data['total_updated'], 2)
+        self.assertEqual(len(self._writes(statements, 'UPDATE')), 1)
+        _, listing = self._get('/api/actors?gender=Retired')
+        self.assertEqual([a['name'] for a in listing['actors']], ['Carol', 'Eve'])
+
+    def test_002_update_by_ids(self):
+        """Test an id list selects rows; unknown ids are simply not returned"""
+        res, data = self._send('PATCH', '/api/movies/bulk',
+                               {'ids': [1, 3, 99], 'set': {'release_date': '1999-12-31T00:00:00'}})
+
+        self.assertEqual(data['updated'], [1, 3])
+        _, listing = self._get('/api/movies?release_to=2000-01-01')
+        self.assertEqual([m['title'] for m in listing['movies']], ['Alpha', 'Gamma'])
+
+    def test_003_delete_removes_cast_links(self):
+        """Test bulk delete clears association rows with one statement each"""
+        with self.app.app_context():
+            db.session.add_all([MovieActor(movie_id=1, actor_id=2), MovieActor(movie_id=2, actor_id=4),
+                                MovieActor(movie_id=2, actor_id=1)])
+            db.session.commit()
+        statements = self._capture_sql()
+
+        res, data = self._send('DELETE', '/api/actors/bulk', {'filter': {'gender': 'Male'}})
+
+        self.assertEqual(data['deleted'], [2, 4])
+        self.assertEqual(len(self._writes(statements, 'DELETE')), 2)
+        with self.app.app_context():
+            self.assertEqual([link.actor_id for link in MovieActor.query.all()], [1])
+        _, listing = self._get('/api/actors')
+        self.assertEqual(listing['total_actors'], 3)
+
+    def test_004_selection_is_validated(self):
+        """Test missing, ambiguous or unknown selections never touch the table"""
+        for body in ({'set': {'age': 40}},
+                     {'ids': [1], 'filter': {'gender': 'Male'}, 'set': {'age': 40}},
+                     {'filter': {'genre': 'Male'}, 'set': {'age': 40}},
+                     {'filter': {}, 'set': {'age': 40}},
+                     {'ids': ['1'], 'set': {'age': 40}},
+                     {'filter': {'age_min': True}, 'set': {'age': 40}},
+                     {'ids': [1], 'set': {}}):
+            res, _ = self._send('PATCH', '/api/actors/bulk', body)
+            self.assertEqual(res.status_code, 400, body)
+
+        for body in ({'ids': [1], 'set': {'age': -3}}, {'ids': [1], 'set': {'name': None}}):
+            res, _ = self._send('PATCH', '/api/actors/bulk', body)
+            self.assertEqual(res.status_code, 422, body)
+        res, _ = self._send('PATCH', '/api/movies/1', {'title': None})
+        self.assertEqual(res.status_code, 422)
+        _, listing = self._get('/api/actors?age_min=40&age_max=40')
+        self.assertEqual(listing['actors'], [])
+
+    def test_005_permissions(self):
+        """Test bulk writes require the same permissions as single writes"""
+        res, _ = self._send('PATCH', '/api/actors/bulk', {'ids': [1], 'set': {'age': 40}}, ASSISTANT)
+        self.assertEqual(res.status_code, 403)
+        res, _ = self._send('DELETE', '/api/movies/bulk', {'ids': [1]}, DIRECTOR)
+        self.assertEqual(res.status_code, 403)
+
+
+class CastTestCase(OfflineAPITestCase):
+    """Bulk link/unlink of movie casts and actor filmographies"""
+
+    def _send(self, method, url, body, permissions=PRODUCER):
+        res = self.client().open(url, method=method, json=body, headers=self._headers(permissions))
+        return res, json.loads(res.data)
+
+    def _cast(self, movie_id):
+        _, data = self._get(f'/api/movies/{movie_id}?include=actors')
+        return [a['id'] for a in data['movie']['actors']]
+
+    def test_001_link_ensemble_in_one_insert(self):
+        """Test linking many actors is one INSERT, skipping unknown ids"""
+        statements = self._capture_sql()
+
+        res, data = self._send('POST', '/api/movies/1/actors', {'actor_ids': [3, 1, 2, 99]})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['linked'], [1, 2, 3])
+        self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith('INSERT')]), 1)
+        self.assertEqual(self._cast(1), [1, 2, 3])
+
+    def test_002_relinking_is_idempotent(self):
+        """Test existing links are skipped by the unique constraint"""
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [1, 2]})
+
+        res, data = self._send('POST', '/api/movies/1/actors', {'actor_ids': [2, 3]})
+
+        self.assertEqual(data['linked'], [3])
+        with self.app.app_context():
+            self.assertEqual(MovieActor.query.count(), 3)
+
+    def test_003_unlink_from_actor_side(self):
+        """Test unlinking from an actor's filmography in one DELETE"""
+        self._send('POST', '/api/actors/2/movies', {'movie_ids': [1, 2, 3]})
+
+        res, data = self._send('DELETE', '/api/actors/2/movies', {'movie_ids': [1, 3]})
+
+        self.assertEqual(data['unlinked'], [1, 3])
+        self.assertEqual(self._cast(2), [2])
+        self.assertEqual(self._cast(1), [])
+
+    def test_004_cast_change_updates_etags(self):
+        """Test linking changes the ETag of both sides"""
+        movie, _ = self._get('/api/movies/1?include=actors')
+        actor, _ = self._get('/api/actors/3')
+
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [3]})
+
+        self.assertNotEqual(self._get('/api/movies/1?include=actors')[0].headers['ETag'], movie.headers['ETag'])
+        self.assertNotEqual(self._get('/api/actors/3')[0].headers['ETag'], actor.headers['ETag'])
+
+    def test_005_errors(self):
+        """Test unknown owners, bad bodies and missing permissions"""
+        self.assertEqual(self._send('POST', '/api/movies/99/actors', {'actor_ids': [1]})[0].status_code, 404)
+        self.assertEqual(self._send('POST', '/api/movies/1/actors', {'actor_ids': []})[0].status_code, 400)
+        self.assertEqual(self._send('POST', '/api/movies/1/actors', {'ids': [1]})[0].status_code, 400)
+        self.assertEqual(
+            self._send('POST', '/api/movies/1/actors', {'actor_ids': [1]}, ASSISTANT)[0].status_code, 403
+        )
+
+    def test_006_no_op_leaves_etags(self):
+        """Test relinking or unlinking nothing leaves both sides' ETags alone"""
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [3]})
+        movie, _ = self._get('/api/movies/1?include=actors')
+        actor, _ = self._get('/api/actors/3')
+
+        self.assertEqual(self._send('POST', '/api/movies/1/actors', {'actor_ids': [3, 99]})[1]['linked'], [])
+        self.assertEqual(self._send('DELETE', '/api/movies/1/actors', {'actor_ids': [2]})[1]['unlinked'], [])
+
+        self.assertEqual(self._get('/api/movies/1?include=actors')[0].headers['ETag'], movie.headers['ETag'])
+        self.assertEqual(self._get('/api/actors/3')[0].headers['ETag'], actor.headers['ETag'])
+
+    def test_007_link_without_on_conflict(self):
+        """Test dialects without ON CONFLICT skip existing links with NOT EXISTS"""
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [1, 2]})
+        statements = self._capture_sql()
+
+        with mock.patch.dict(bulk._UPSERT_INSERTS, clear=True):
+            res, data = self._send('POST', '/api/movies/1/actors', {'actor_ids': [2, 3, 99]})
+
+        self.assertEqual(data['linked'], [3])
+        self.assertEqual(self._cast(1), [1, 2, 3])
+        self.assertTrue(any('NOT (EXISTS' in s for s in statements if s.lstrip().upper().startswith('INSERT')))
+
+    def test_008_round_trips(self):
+        """Test a link is an INSERT plus one UPDATE per side, a repeat an INSERT and a SELECT"""
+        statements = self._capture_sql()
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [1, 2]})
+        self.assertEqual([s.split()[0] for s in statements], ['INSERT', 'UPDATE', 'UPDATE'])
+
+        del statements[:]
+        self._send('POST', '/api/movies/1/actors', {'actor_ids': [1, 2]})
+        self.assertEqual([s.split()[0] for s in statements], ['INSERT', 'SELECT'])
+
+
+class ReplicaRoutingTestCase(OfflineAPITestCase):
+    """GET requests read from a replica; writes and fresh writers use the primary"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_config = {'DATABASE_REPLICA_URLS': [f"sqlite:///{os.path.join(cls.tmpdir, 'replica.db')}"]}
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            self.replica = self.app.extensions['replicas']._engine('replica_0')
+            db.metadata.create_all(self.replica)
+            with self.replica.begin() as conn:
+                conn.execute(Actor.__table__.insert(), [{
+                    'name': 'Replica Only', 'age': 40, 'gender': 'Male',
+                    'created_at': datetime(2024, 1, 1), 'updated_at': datetime(2024, 1, 1)
+                }])
+
+    def tearDown(self):
+        db.metadata.drop_all(self.replica)
+        self.replica.dispose()
+        super().tearDown()
+
+    def _names(self, client=None, **headers):
+        res = (client or self.client()).get('/api/actors', headers=self._headers(**headers))
+        return [a['name'] for a in json.loads(res.data)['actors']]
+
+    def test_001_reads_go_to_replica(self):
+        """Test GET requests are served from the replica"""
+        self.assertEqual(self._names(), ['Replica Only'])
+
+    def test_002_writes_go_to_primary_and_stick(self):
+        """Test a writer reads its own write from the primary afterwards"""
+        client = self.client()
+        res = client.post('/api/actors', json={'name': 'Zed', 'age': 33, 'gender': 'Male'},
+                          headers=self._headers(PRODUCER))
+        self.assertEqual(res.status_code, 201)
+
+        self.assertIn('Zed', self._names(client))
+        self.assertEqual(self._names(), ['Replica Only'])
+
+    def test_003_explicit_primary_read(self):
+        """Test the read-your-writes header forces the primary"""
+        self.assertEqual(len(self._names(**{'X-Read-Your-Writes': 'true'})), 5)
+
+    def test_004_unhealthy_replica_falls_back(self):
+        """Test reads use the primary while the replica is down"""
+        self.app.extensions['replicas'].mark_down('replica_0')
+
+        self.assertEqual(len(self._names()), 5)
+        _, data = self._get('/api/admin/stats', permissions=['get:stats'])
+        self.assertFalse(data['replicas']['replicas']['replica_0']['healthy'])
+        self.assertEqual(data['replicas']['primary_reads'], 1)
+
+    def test_005_failed_health_check_falls_back(self):
+        """Test a replica that can't be reached is skipped"""
+        with mock.patch.object(self.replica, 'connect', side_effect=OSError('unreachable')):
+            self.assertEqual(len(self._names()), 5)
+        # Still marked down after the outage clears, until the retry delay passes
+        self.assertEqual(len(self._names()), 5)
+
+    def test_006_failed_read_retried_on_primary(self):
+        """Test the read that finds the replica broken is answered from the primary"""
+        Actor.__table__.drop(self.replica)
+        with mock.patch.object(self.replica.dialect, 'is_disconnect', return_value=True), \
+                self.assertLogs('replicas', 'WARNING'):
+            self.assertEqual(len(self._names()), 5)
+
+        self.assertFalse(self.app.extensions['replicas'].stats()['replicas']['replica_0']['healthy'])
+
+    def test_007_replica_reads_after_write_cached_for_lag_window(self):
+        """Test a replica read right after a write is cached only until replicas catch up"""
+        app = create_app(dict(self.test_config, RESPONSE_CACHE_BACKEND='memory',
+                              RESPONSE_CACHE_TTL=300, REPLICA_LAG_WINDOW=5))
+        setup_db(app, self.database_path)
+        self.addCleanup(lambda: [engine.dispose() for engine in app.extensions['replicas'].engines.values()])
+        entries = app.extensions['response_cache'].backend._entries
+
+        def expiry():
+            app.test_client().get('/api/actors', headers=self._headers())
+            return entries.popitem()[1]['expires_at'] - time.time()
+
+        self.assertGreater(expiry(), 60)
+        res = app.test_client().post('/api/actors', json={'name': 'Zed', 'age': 33, 'gender': 'Male'},
+                                     headers=self._headers(PRODUCER))
+        self.assertEqual(res.status_code, 201)
+        self.assertLessEqual(expiry(), 5)
+
+
+
+class WarmUpTestCase(OfflineAPITestCase):
+    """Worker warm-up before traffic: pooled connections and signing keys"""
+
+    def test_001_opens_pool_connections(self):
+        """Test warm-up leaves connections idle in the pool"""
+        with self.app.app_context():
+            db.engine.dispose()
+            warm_up(self.app, connections=3)
+
+            self.assertEqual(db.engine.pool.checkedin(), 3)
+            self.assertEqual(db.engine.pool.checkedout(), 0)
+
+    def test_002_fetches_jwks(self):
+        """Test warm-up primes the JWKS so the first request doesn't fetch"""
+        fetches = auth.get_jwks_cache().fetches
+        warm_up(self.app, connections=0)
+        self.assertEqual(auth.get_jwks_cache().fetches, fetches + 1)
+
+        res, _ = self._get('/api/actors')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(auth.get_jwks_cache().fetches, fetches + 1)
+
+    def test_003_unreachable_jwks_is_not_fatal(self):
+        """Test a failed key fetch is logged and warm-up carries on"""
+        with mock.patch.object(auth, 'JWKS_URL', 'file:///nonexistent/jwks.json'), \
+                self.assertLogs(self.app.logger, 'WARNING'):
+            warm_up(self.app, connections=1)
+
+
+class ServerTimingTestCase(OfflineAPITestCase):
+    """Per-request stage timings: Server-Timing header and log line"""
+
+    def _stages(self, res):
+        stages = {}
+        for metric in res.headers['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            stages[name] = dict(param.split('=', 1) for param in params)
+        return stages
+
+    def test_001_read_reports_auth_db_and_serialize(self):
+        """Test a GET reports each stage and the query count it ran"""
+        statements = self._capture_sql()
+        res, _ = self._get('/api/actors/1')
+        stages = self._stages(res)
+
+        self.assertEqual(list(stages), ['auth', 'db', 'serialize', 'total'])
+        self.assertEqual(stages['db']['desc'], f'"{len(statements)} queries"')
+        self.assertGreaterEqual(float(stages['total']['dur']), float(stages['db']['dur']))
+
+    def test_002_write_reports_validation(self):
+        """Test Pydantic validation is timed, including when it fails"""
+        res = self.client().post('/api/actors', json={'name': 'Zed', 'age': 'old', 'gender': 'Male'},
+                                 headers=self._headers(DIRECTOR))
+
+        self.assertEqual(res.status_code, 422)
+        self.assertIn('validate', self._stages(res))
+
+    def test_003_auth_failure_is_timed(self):
+        """Test a rejected token still reports where the time went"""
+        res, _ = self._get('/api/movies', permissions=['get:actors'])
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(list(self._stages(res)), ['auth', 'serialize', 'total'])
+
+    def test_004_structured_log_line(self):
+        """Test each request logs its route, status and stages as JSON"""
+        with self.assertLogs(timing.logger, 'INFO') as logs:
+            self._get('/api/actors/2')
+        line = json.loads(logs.records[-1].getMessage())
+
+        self.assertEqual(line['method'], 'GET')
+        self.assertEqual(line['route'], '/api/actors/<int:actor_id>')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+        self.assertEqual(set(line['stages_ms']), {'auth', 'db', 'serialize'})
+
+    def test_005_disabled(self):
+        """Test SERVER_TIMING off drops the header; queries outside requests are ignored"""
+        app = create_app({'SERVER_TIMING': False, 'SERVER_TIMING_LOG': False})
+        setup_db(app, self.database_path)
+        self.client = app.test_client
+
+        res, data = self._get('/api/actors')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Server-Timing', res.headers)
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 5)
+
+
+class MetricsTestCase(OfflineAPITestCase):
+    """Prometheus /metrics: request, database, pool and auth cache figures"""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        self.test_config = {'METRICS': True, 'METRICS_DIR': self.metrics_dir}
+        super().setUp()
+
+    def _scrape(self):
+        res = self.client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in res.get_data(as_text=True).splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_001_request_histogram_by_route_and_status(self):
+        """Test latencies are bucketed per route, method and status"""
+        self._get('/api/actors/1')
+        self._get('/api/actors/2')
+        self._get('/api/actors/99')
+        samples = self._scrape()
+
+        labels = 'method="GET",route="/api/actors/<int:actor_id>"'
+        self.assertEqual(samples[f'http_request_duration_seconds_count{{{labels},status="200"}}'], 2)
+        self.assertEqual(samples[f'http_request_duration_seconds_count{{{labels},status="404"}}'], 1)
+        self.assertEqual(
+            samples[f'http_request_duration_seconds_bucket{{{labels},status="200",le="+Inf"}}'], 2)
+        self.assertGreater(samples[f'http_request_duration_seconds_sum{{{labels},status="200"}}'], 0)
+
+    def test_002_database_pool_and_auth_figures(self):
+        """Test query counts, pool utilisation and cache hit counters are exported"""
+        statements = self._capture_sql()
+        self._get('/api/movies')
+        self._get('/api/movies')
+        samples = self._scrape()
+
+        self.assertEqual(samples['db_queries_total{route="/api/movies"}'], len(statements))
+        self.assertGreater(samples['db_query_duration_seconds_total{route="/api/movies"}'], 0)
+        self.assertGreater(samples['db_pool_checkouts_total{engine="primary"}'], 0)
+        self.assertEqual(samples['db_pool_connections{engine="primary",state="in_use"}'], 0)
+        self.assertGreaterEqual(samples['token_cache_hits_total{cache="verified"}'], 1)
+        self.assertGreaterEqual(samples['jwks_lookups_total'], 1)
+        # The scrape itself is the one request in flight
+        self.assertEqual(samples['http_requests_in_flight'], 1)
+
+    def test_003_aggregates_worker_files(self):
+        """Test every worker's files add up, this worker's written by the scrape itself"""
+        other = Metrics(self.metrics_dir)
+        labels = (('method', 'GET'), ('route', '/api/movies'), ('status', '200'))
+        other.observe('http_request_duration_seconds', labels, 0.02)
+        other.inc('db_queries_total', (('route', '/api/movies'),), 3)
+        other.add_gauge('http_requests_in_flight', value=2)
+        with mock.patch('os.getpid', return_value=999999):
+            other.flush()
+
+        self._get('/api/movies')
+        samples = self._scrape()
+        name = 'http_request_duration_seconds_count{method="GET",route="/api/movies",status="200"}'
+        self.assertEqual(samples[name], 2)
+        self.assertEqual(samples['http_requests_in_flight'], 3)
+        self.assertGreater(samples['db_queries_total{route="/api/movies"}'], 3)
+        self.assertIn(f'counters_{os.getpid()}.json', os.listdir(self.metrics_dir))
+
+    def test_004_exited_worker_counters_retained(self):
+        """Test an exited worker's counters are kept and its gauges and files dropped"""
+        other = Metrics(self.metrics_dir)
+        other.inc('db_queries_total', (('route', '/api/movies'),), 3)
+        other.add_gauge('http_requests_in_flight', value=2)
+        with mock.patch('os.getpid', return_value=999999):
+            other.flush()
+        before = self._scrape()
+
+        mark_process_dead(999999, self.metrics_dir)
+        after = self._scrape()
+
+        self.assertEqual(before['http_requests_in_flight'], 3)
+        self.assertEqual(after['http_requests_in_flight'], 1)
+        self.assertEqual(after['db_queries_total{route="/api/movies"}'], 3)
+        names = set(os.listdir(self.metrics_dir))
+        self.assertIn('retained.json', names)
+        self.assertFalse(names & {'counters_999999.json', 'gauges_999999.json'})
+
+        mark_process_dead(999999, self.metrics_dir)
+        self.assertEqual(self._scrape()['db_queries_total{route="/api/movies"}'], 3)
+
+    def test_005_disabled_by_default(self):
+        """Test /metrics, which takes no token, exists only when METRICS is on"""
+        app = create_app()
+        setup_db(app, self.database_path)
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+
+class QueryWatchTestCase(OfflineAPITestCase):
+    """Slow-query log and N+1 detection"""
+
+    test_config = {'N_PLUS_ONE_THRESHOLD': 2}
+
+    def setUp(self):
+        super().setUp()
+        self._add_lazy_casts(self.app)
+
+    @staticmethod
+    def _add_lazy_casts(app):
+        @app.route('/lazy-casts')
+        def lazy_casts():
+            # One lazy load of Movie.actors per movie: the classic N+1
+            return {'casts': [len(movie.actors) for movie in Movie.query.all()]}
+
+    def test_001_repeated_statement_fails_under_tests(self):
+        """Test the test suite fails a request that runs one statement too often"""
+        with self.assertRaises(NPlusOneError) as ctx:
+            self.client().get('/lazy-casts')
+
+        self.assertIn('3 executions of: SELECT movie_actors', str(ctx.exception))
+        self.assertIn('GET /lazy-casts', str(ctx.exception))
+
+    def test_002_repeated_statement_warns_in_production(self):
+        """Test without N_PLUS_ONE_RAISE the request succeeds and a warning is logged"""
+        self.app.extensions['query_watch'].raise_on_repeat = False
+
+        with self.assertLogs('querywatch', 'WARNING') as logs:
+            res = self.client().get('/lazy-casts')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Possible N+1 in GET /lazy-casts', logs.output[0])
+
+    def test_003_within_threshold(self):
+        """Test a request under the threshold is neither logged nor failed"""
+        res, _ = self._get('/api/movies?include=actors')
+        self.assertEqual(res.status_code, 200)
+
+    def test_004_slow_query_logged_with_parameter_shapes(self):
+        """Test slow statements are logged with route and parameter types, not values"""
+        self.app.extensions['query_watch'].slow_ms = 1e-9
+
+        with self.assertLogs('querywatch', 'WARNING') as logs:
+            self._get('/api/actors?name_prefix=Car')
+
+        message = next(m for m in logs.output if 'LIKE' in m)
+        self.assertIn('Slow query', message)
+        self.assertIn('in GET /api/actors:', message)
+        self.assertIn('str[3]', message.split('params=')[1])
+        self.assertNotIn("'Car'", message)
+
+    def test_005_param_shape(self):
+        """Test parameter shapes keep types and lengths only"""
+        self.assertEqual(param_shape({'id_1': 5, 'name': 'Carol', 'x': None}),
+                         '{id_1: int, name: str[5], x: None}')
+        self.assertEqual(param_shape((1, 'ab', [1, 2])), '(int, str[2], list[2])')
+        self.assertEqual(param_shape([{'a': 1}, {'a': 2}], executemany=True), '2 x {a: int}')
+
+    def test_006_watches_with_server_timing_off(self):
+        """Test the watch still sees statements when no timing is reported"""
+        app = create_app({'N_PLUS_ONE_THRESHOLD': 2, 'SERVER_TIMING': False,
+                          'SERVER_TIMING_LOG': False, 'METRICS': False})
+        setup_db(app, self.database_path)
+        self._add_lazy_casts(app)
+
+        with self.assertRaises(NPlusOneError):
+            app.test_client().get('/lazy-casts')
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+The API suites (test_app.py and test_api.py) run against the ASGI entry point
+
+test_app.py's CastingAgencyTestCase and every OfflineAPITestCase subclass
+are re-run here with the app served by asgi.py on aiosqlite. Each test runs inside a greenlet on its own event
+loop, which is where async database connections (seeding, teardown, the
+requests themselves) have to be used from.
+"""
+import asyncio
+import json
+import unittest
+from http import HTTPStatus
+from unittest import mock
+
+from sqlalchemy.util import await_only, greenlet_spawn
+from werkzeug.test import Client
+
+import asgi
+import test_api
+import test_app
+from models import db
+
+try:
+    import aiosqlite
+except ImportError:  # pragma: no cover - optional dependency
+    aiosqlite = None
+
+
+async def call_asgi(app, method, path, query_string=b'', headers=(), body=b''):
+    """Sends one HTTP request to an ASGI app; returns (status, headers, chunks)"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'root_path': '',
+        'query_string': query_string, 'headers': list(headers),
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return pending.pop() if pending else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start, *body_messages = sent
+    return start['status'], start['headers'], [m['body'] for m in body_messages]
+
+
+def asgi_as_wsgi(app):
+    """
+    WSGI callable driving the ASGI ``app``, for werkzeug's test client.
+
+    Must be called from inside a greenlet on the running loop.
+    """
+    def wsgi(environ, start_response):
+        headers = [
+            (key[5:].replace('_', '-').lower().encode('latin-1'), value.encode('latin-1'))
+            for key, value in environ.items() if key.startswith('HTTP_')
+        ]
+        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(key):
+                headers.append((key.replace('_', '-').lower().encode('latin-1'),
+                                environ[key].encode('latin-1')))
+        status, response_headers, chunks = await_only(call_asgi(
+            app, environ['REQUEST_METHOD'],
+            environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            environ.get('QUERY_STRING', '').encode('latin-1'),
+            headers, environ['wsgi.input'].read(),
+        ))
+        start_response(f'{status} {HTTPStatus(status).phrase}', [
+            (name.decode('latin-1'), value.decode('latin-1')) for name, value in response_headers
+        ])
+        # Several body messages mean the app streamed the response
+        return iter(chunks) if len(chunks) > 1 else chunks
+    return wsgi
+
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed')
+class ASGIVariant:
+    """Serves a test case's requests through asgi.py on the asyncio driver"""
+
+    def _create_app(self):
+        self.asgi = asgi.create_app(getattr(self, 'test_config', None))
+        return self.asgi.app
+
+    def setUp(self):
+        super().setUp()
+        self.client = lambda: Client(asgi_as_wsgi(self.asgi))
+
+    def tearDown(self):
+        super().tearDown()
+        self.asgi.shutdown()
+
+    def run(self, result=None):
+        self._loop = asyncio.new_event_loop()
+        try:
+            return super().run(result)
+        finally:
+            self._loop.close()
+
+    def _in_loop(self, function, *args, **kwargs):
+        return self._loop.run_until_complete(greenlet_spawn(function, *args, **kwargs))
+
+    def _callSetUp(self):
+        self._in_loop(self.setUp)
+
+    def _callTestMethod(self, method):
+        self._in_loop(method)
+
+    def _callTearDown(self):
+        self._in_loop(self.tearDown)
+
+    def _callCleanup(self, function, *args, **kwargs):
+        self._in_loop(function, *args, **kwargs)
+
+
+for _name, _case in vars(test_api).items():
+    if isinstance(_case, type) and issubclass(_case, test_api.OfflineAPITestCase) \
+            and _case is not test_api.OfflineAPITestCase:
+        globals()[_name] = type(_name, (ASGIVariant, _case), {'__module__': __name__})
+del _name, _case
+
+
+class CastingAgencyTestCase(ASGIVariant, test_app.CastingAgencyTestCase):
+    """test_app.py's suite; its setUp builds the app with create_app()"""
+
+    def setUp(self):
+        with mock.patch.object(test_app, 'create_app', self._create_app):
+            super().setUp()
+
+
+class ASGIServerTestCase(ASGIVariant, test_api.OfflineAPITestCase):
+    """Behaviour specific to the ASGI entry point"""
+
+    def test_001_uses_the_asyncio_driver(self):
+        """Test the engine runs on aiosqlite"""
+        with self.app.app_context():
+            self.assertEqual(db.engine.dialect.driver, 'aiosqlite')
+            self.assertTrue(db.engine.dialect.is_async)
+
+    def test_002_concurrent_requests(self):
+        """Test requests in flight together on one loop each get their own answer"""
+        headers = [(b'authorization', self._headers()['Authorization'].encode())]
+
+        async def fetch_all():
+            return await asyncio.gather(*[
+                call_asgi(self.asgi, 'GET', f'/api/actors/{actor_id}', headers=headers)
+                for actor_id in [1, 2, 3, 4, 5] * 4
+            ])
+        responses = await_only(fetch_all())
+
+        self.assertEqual({status for status, _, _ in responses}, {200})
+        ids = [json.loads(b''.join(chunks))['actor']['id'] for _, _, chunks in responses]
+        self.assertEqual(ids, [1, 2, 3, 4, 5] * 4)
+
+    def test_003_lifespan(self):
+        """Test the lifespan protocol warms and disposes the pools"""
+        pending = [{'type': 'lifespan.shutdown'}, {'type': 'lifespan.startup'}]
+        sent = []
+
+        async def receive():
+            return pending.pop()
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await_only(self.asgi({'type': 'lifespan'}, receive, send))
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        with self.app.app_context():
+            self.assertEqual(db.engine.pool.checkedin(), 0)
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+"""
+Unit tests for the Auth0 JWT verification path (run offline against a local JWKS)
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import auth
+from auth import AuthError, JWKSCache, TokenCache, verify_decode_jwt
+from auth_stub import make_key_pair, mint_token, write_jwks
+
+DOMAIN = "casting-agency.test"
+AUDIENCE = "casting-agency"
+# Small keys keep key generation fast; the verification path is identical.
+KEY_BITS = 1024
+
+
+class AuthTestCase(unittest.TestCase):
+    """Test case for token verification and the JWKS cache"""
+
+    def setUp(self):
+        """Point auth at a JWKS file holding a freshly generated key"""
+        self.key = make_key_pair("key-1", KEY_BITS)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.jwks_path = os.path.join(self.tmpdir.name, "jwks.json")
+        self.jwks_url = write_jwks(self.jwks_path, self.key)
+
+        patches = [
+            mock.patch.object(auth, "AUTH0_DOMAIN", DOMAIN),
+            mock.patch.object(auth, "API_AUDIENCE", AUDIENCE),
+            mock.patch.object(auth, "JWKS_URL", self.jwks_url),
+            mock.patch.object(auth, "_jwks_cache", None),
+            mock.patch.object(auth, "_token_cache", TokenCache()),
+            mock.patch.object(auth, "_rejected_token_cache", TokenCache(max_age=60)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _token(self, key=None, **kwargs):
+        return mint_token(key or self.key, DOMAIN, AUDIENCE, ["get:movies"], **kwargs)
+
+    # =========================================================================
+    # JWKS cache
+    # =========================================================================
+
+    def test_001_valid_token_verifies_offline(self):
+        """Test a locally minted token verifies against a file:// JWKS"""
+        payload = verify_decode_jwt(self._token())
+
+        self.assertEqual(payload["permissions"], ["get:movies"])
+
+    def test_002_jwks_fetched_once(self):
+        """Test repeated verifications reuse the cached key set"""
+        for _ in range(5):
+            verify_decode_jwt(self._token())
+
+        self.assertEqual(auth.get_jwks_cache().fetches, 1)
+
+    def test_003_unknown_kid_forces_single_refresh(self):
+        """Test a rotated key is picked up by one forced refresh"""
+        verify_decode_jwt(self._token())
+        rotated = make_key_pair("key-2", KEY_BITS)
+        write_jwks(self.jwks_path, self.key, rotated)
+
+        payload = verify_decode_jwt(self._token(rotated))
+
+        self.assertIn("permissions", payload)
+        self.assertEqual(auth.get_jwks_cache().fetches, 2)
+
+    def test_004_unknown_kid_refresh_is_rate_limited(self):
+        """Test unknown kids do not trigger a fetch per request"""
+        verify_decode_jwt(self._token())
+        cache = auth.get_jwks_cache()
+        bogus = make_key_pair("key-unknown", KEY_BITS)
+
+        for _ in range(3):
+            with self.assertRaises(AuthError) as ctx:
+                verify_decode_jwt(self._token(bogus))
+            self.assertEqual(ctx.exception.status_code, 401)
+
+        self.assertEqual(cache.fetches, 2)
+
+    def test_005_stale_keys_refreshed_in_background(self):
+        """Test an expired-but-stale key set is served while refreshing"""
+        cache = JWKSCache(self.jwks_url, ttl=0, stale_ttl=60, min_refresh_interval=0)
+        cache.refresh()
+
+        self.assertIsNotNone(cache.get_key("key-1"))
+        cache._background.join(timeout=5)
+        self.assertEqual(cache.fetches, 2)
+
+    def test_006_failed_refresh_serves_cached_keys(self):
+        """Test an unreachable IdP does not drop keys already cached"""
+        cache = JWKSCache(self.jwks_url, ttl=0, stale_ttl=0, min_refresh_interval=0)
+        cache.refresh()
+        os.remove(self.jwks_path)
+
+        self.assertIsNotNone(cache.get_key("key-1"))
+
+    def test_007_fetch_uses_timeout(self):
+        """Test the JWKS fetch is bounded by the configured timeout"""
+        cache = JWKSCache(self.jwks_url, timeout=1.5)
+        with mock.patch.object(auth, "urlopen", wraps=auth.urlopen) as urlopen:
+            cache.refresh()
+
+        urlopen.assert_called_once_with(self.jwks_url, timeout=1.5)
+
+    # =========================================================================
+    # Verified-token cache
+    # =========================================================================
+
+    def test_008_signature_verified_once_per_token(self):
+        """Test a reused token is verified once and then served from cache"""
+        token = self._token()
+        with mock.patch.object(auth.jwt, "decode", wraps=auth.jwt.decode) as decode:
+            first = verify_decode_jwt(token)
+            second = verify_decode_jwt(token)
+
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(auth.get_token_cache().stats()["hits"], 1)
+
+    def test_009_cache_entry_expires_with_token(self):
+        """Test a cached payload is not served past the token's exp"""
+        cache = TokenCache(max_age=300)
+        cache.put("token", {"exp": 1}, generation=0, exp=1)
+
+        self.assertIsNone(cache.get("token", generation=0))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_010_cache_is_bounded_lru(self):
+        """Test the least recently used entry is evicted first"""
+        cache = TokenCache(maxsize=2)
+        cache.put("a", {}, 0)
+        cache.put("b", {}, 0)
+        cache.get("a", 0)
+        cache.put("c", {}, 0)
+
+        self.assertIsNotNone(cache.get("a", 0))
+        self.assertIsNone(cache.get("b", 0))
+
+    def test_011_key_rotation_invalidates_cache(self):
+        """Test a changed key set drops previously verified payloads"""
+        token = self._token()
+        verify_decode_jwt(token)
+        write_jwks(self.jwks_path, make_key_pair("key-2", KEY_BITS))
+        auth.get_jwks_cache().refresh()
+
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(token)
+        self.assertEqual(ctx.exception.status_code, 401)
+
+    # =========================================================================
+    # Token verification errors
+    # =========================================================================
+
+    def test_012_expired_token(self):
+        """Test an expired token is rejected with token_expired"""
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(self._token(expires_in=-60))
+
+        self.assertEqual(ctx.exception.error["code"], "token_expired")
+        self.assertEqual(ctx.exception.status_code, 401)
+
+    def test_013_wrong_audience(self):
+        """Test a token for another audience is rejected with invalid_claims"""
+        token = mint_token(self.key, DOMAIN, "someone-else", [])
+
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt(token)
+
+        self.assertEqual(ctx.exception.error["code"], "invalid_claims")
+
+    def test_014_malformed_token(self):
+        """Test a malformed token is rejected with invalid_header"""
+        with self.assertRaises(AuthError) as ctx:
+            verify_decode_jwt("invalid_token_string")
+
+        self.assertEqual(ctx.exception.error["code"], "invalid_header")
+        self.assertEqual(ctx.exception.status_code, 400)
+
+    # =========================================================================
+    # Rejected-token pre-checks
+    # =========================================================================
+
+    def test_015_expired_token_rejected_before_key_lookup(self):
+        """Test an expired token never reaches the JWKS or RS256"""
+        token = self._token(expires_in=-60)
+        with mock.patch.object(JWKSCache, "get_key") as get_key:
+            with self.assertRaises(AuthError) as ctx:
+                verify_decode_jwt(token)
+
+        get_key.assert_not_called()
+        self.assertEqual(ctx.exception.error["code"], "token_expired")
+
+    def test_016_bad_signature_replay_served_from_negative_cache(self):
+        """Test a rejected token is not re-verified when replayed"""
+        forged = make_key_pair("forged", KEY_BITS)
+        token = mint_token(forged._replace(kid="key-1"), DOMAIN, AUDIENCE, [])
+        with mock.patch.object(auth.jwt, "decode", wraps=auth.jwt.decode) as decode:
+            for _ in range(3):
+                with self.assertRaises(AuthError) as ctx:
+                    verify_decode_jwt(token)
+                self.assertEqual(ctx.exception.status_code, 400)
+                self.assertEqual(ctx.exception.error["code"], "invalid_header")
+
+        self.assertEqual(decode.call_count, 1)
+
+    def test_017_malformed_and_unknown_kid_keep_error_codes(self):
+        """Test cached rejections return the same codes as the first attempt"""
+        unknown = self._token(make_key_pair("key-unknown", KEY_BITS))
+        for token, status in (("invalid_token_string", 400), (unknown, 401)):
+            for _ in range(2):
+                with self.assertRaises(AuthError) as ctx:
+                    verify_decode_jwt(token)
+                self.assertEqual(ctx.exception.status_code, status)
+                self.assertEqual(ctx.exception.error["code"], "invalid_header")
+
+        self.assertEqual(auth.get_rejected_token_cache().stats()["hits"], 2)
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
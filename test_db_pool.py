@@ -0,0 +1,111 @@
+"""
+Unit tests for the connection pool configuration and checkout metrics
+"""
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, exc, text
+
+from db_pool import (
+    InstrumentedAsyncQueuePool, InstrumentedQueuePool, async_url, engine_options, pool_stats
+)
+
+CONFIG = {
+    'DB_POOL_SIZE': 1,
+    'DB_MAX_OVERFLOW': 0,
+    'DB_POOL_TIMEOUT': 0.05,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'DB_STATEMENT_TIMEOUT_MS': 5000,
+}
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """Test case for engine_options"""
+
+    def test_001_postgres_options(self):
+        """Test pool settings and statement timeout are applied on PostgreSQL"""
+        options = engine_options(CONFIG, 'postgresql://localhost:5432/capstone')
+
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(options['pool_size'], 1)
+        self.assertEqual(options['pool_recycle'], 1800)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    def test_002_statement_timeout_disabled(self):
+        """Test a zero timeout adds no connect args"""
+        options = engine_options({**CONFIG, 'DB_STATEMENT_TIMEOUT_MS': 0}, 'postgresql://localhost/capstone')
+
+        self.assertNotIn('connect_args', options)
+
+    def test_003_in_memory_sqlite(self):
+        """Test the single-connection in-memory database only gets pre-ping"""
+        self.assertEqual(engine_options(CONFIG, 'sqlite://'), {'pool_pre_ping': True})
+
+    def test_004_asyncpg_options(self):
+        """Test asyncio URLs get the asyncio pool and asyncpg's timeout setting"""
+        options = engine_options(CONFIG, 'postgresql+asyncpg://localhost:5432/capstone')
+
+        self.assertIs(options['poolclass'], InstrumentedAsyncQueuePool)
+        self.assertEqual(options['connect_args'], {'server_settings': {'statement_timeout': '5000'}})
+
+    def test_005_async_url(self):
+        """Test URLs are mapped onto the asyncio driver for their backend"""
+        self.assertEqual(async_url('postgresql://u:secret@db:5432/capstone'),
+                         'postgresql+asyncpg://u:secret@db:5432/capstone')
+        self.assertEqual(async_url('sqlite:////tmp/capstone.db'), 'sqlite+aiosqlite:////tmp/capstone.db')
+        self.assertEqual(async_url('sqlite+aiosqlite:///x.db'), 'sqlite+aiosqlite:///x.db')
+
+
+class InstrumentedQueuePoolTestCase(unittest.TestCase):
+    """Test case for checkout wait accounting"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        uri = 'sqlite:///' + os.path.join(self.tmpdir.name, 'pool.db')
+        options = engine_options(CONFIG, uri)
+        self.engine = create_engine(uri, **options)
+        self.addCleanup(self.engine.dispose)
+
+    def test_001_checkouts_counted(self):
+        """Test every checkout is recorded and in-use tracks open connections"""
+        with self.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            self.assertEqual(pool_stats(self.engine)['in_use'], 1)
+
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats['in_use'], 0)
+        # pre-ping's checkout and ours share one connection
+        self.assertGreaterEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['timeouts'], 0)
+
+    def test_002_exhaustion_records_wait_and_timeout(self):
+        """Test a checkout that times out is counted with its wait"""
+        with self.engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+
+        stats = pool_stats(self.engine)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waited'], 1)
+        self.assertGreaterEqual(stats['wait_ms_max'], 40)
+
+    def test_003_stats_survive_dispose(self):
+        """Test counters carry over when the pool is recreated"""
+        with self.engine.connect():
+            pass
+        before = pool_stats(self.engine)['checkouts']
+
+        self.engine.dispose()
+        with self.engine.connect():
+            pass
+
+        self.assertEqual(pool_stats(self.engine)['checkouts'], before + 1)
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
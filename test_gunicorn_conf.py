@@ -0,0 +1,128 @@
+"""
+Unit tests for the gunicorn configuration: worker sizing and fork hooks
+"""
+import os
+import runpy
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app import create_app
+from metrics import Metrics
+from models import setup_db, db
+
+CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+def load_conf(cores=4, **env):
+    """The config module's settings under ``env`` on a ``cores``-core machine"""
+    with mock.patch.dict(os.environ, env), \
+            mock.patch('os.sched_getaffinity', return_value=set(range(cores)), create=True):
+        return runpy.run_path(CONF)
+
+
+class WorkerSizingTestCase(unittest.TestCase):
+    """Test case for the worker/thread defaults"""
+
+    def setUp(self):
+        patch = mock.patch.dict(os.environ)
+        patch.start()
+        self.addCleanup(patch.stop)
+        for name in list(os.environ):
+            if name.startswith('GUNICORN_') or name in ('WEB_CONCURRENCY', 'PORT'):
+                del os.environ[name]
+
+    def test_001_thread_workers_from_cores(self):
+        """Test gthread defaults to one worker per core with preload and jitter"""
+        conf = load_conf(cores=4)
+
+        self.assertEqual(conf['worker_class'], 'gthread')
+        self.assertEqual(conf['workers'], 4)
+        self.assertEqual(conf['threads'], 4)
+        self.assertTrue(conf['preload_app'])
+        self.assertGreater(conf['max_requests_jitter'], 0)
+        self.assertEqual(conf['bind'], '0.0.0.0:8080')
+
+    def test_002_asyncio_workers_one_per_core(self):
+        """Test the uvicorn worker class gets one single-threaded worker per core"""
+        conf = load_conf(cores=4, GUNICORN_WORKER_CLASS='uvicorn.workers.UvicornWorker')
+
+        self.assertEqual(conf['workers'], 4)
+        self.assertEqual(conf['threads'], 1)
+
+    def test_003_single_threaded_workers(self):
+        """Test single-threaded workers default to 2 x cores + 1"""
+        self.assertEqual(load_conf(cores=4, GUNICORN_THREADS='1')['workers'], 9)
+        self.assertEqual(load_conf(cores=4, GUNICORN_WORKER_CLASS='sync')['workers'], 9)
+
+    def test_004_environment_overrides(self):
+        """Test WEB_CONCURRENCY, thread count, preload and PORT come from the environment"""
+        conf = load_conf(WEB_CONCURRENCY='3', GUNICORN_THREADS='8', GUNICORN_PRELOAD='0', PORT='5000')
+
+        self.assertEqual(conf['workers'], 3)
+        self.assertEqual(conf['threads'], 8)
+        self.assertFalse(conf['preload_app'])
+        self.assertEqual(conf['bind'], '0.0.0.0:5000')
+
+    def test_005_metrics_dir_shared_with_workers(self):
+        """Test workers inherit one metrics directory, overridable by env"""
+        self.assertIn('casting-agency-metrics', load_conf()['metrics_dir'])
+        self.assertEqual(load_conf(METRICS_DIR='/srv/metrics')['raw_env'], ['METRICS_DIR=/srv/metrics'])
+
+
+class ForkHooksTestCase(unittest.TestCase):
+    """Test case for post_fork and post_worker_init"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.app = create_app()
+        setup_db(self.app, 'sqlite:///' + os.path.join(self.tmpdir.name, 'hooks.db'))
+        with self.app.app_context():
+            self.engine = db.engine
+        self.addCleanup(self.engine.dispose)
+        self.conf = load_conf()
+
+    def test_001_post_fork_drops_inherited_connections(self):
+        """Test a preloaded app's pooled connections are not reused after fork"""
+        self.engine.connect().close()
+        pool = self.engine.pool
+        server = SimpleNamespace(cfg=SimpleNamespace(preload_app=True),
+                                 app=SimpleNamespace(wsgi=lambda: self.app))
+
+        self.conf['post_fork'](server, None)
+
+        self.assertIsNot(self.engine.pool, pool)
+        self.assertEqual(self.engine.pool.checkedin(), 0)
+
+    def test_002_post_worker_init_warms_pool(self):
+        """Test the worker opens a connection per thread before serving"""
+        worker = SimpleNamespace(wsgi=self.app, cfg=SimpleNamespace(threads=2))
+
+        with mock.patch('auth.JWKSCache.refresh'):
+            self.conf['post_worker_init'](worker)
+
+        self.assertEqual(self.engine.pool.checkedin(), 2)
+
+    def test_003_metrics_files_across_worker_lifetimes(self):
+        """Test an exited worker's counters are retained, its files dropped, and a restart starts from zero"""
+        conf = load_conf(METRICS_DIR=self.tmpdir.name)
+        metrics = Metrics(self.tmpdir.name)
+        metrics.inc('db_queries_total', value=2)
+        with mock.patch('os.getpid', return_value=101):
+            conf['worker_exit'](None, SimpleNamespace(wsgi=SimpleNamespace(extensions={'metrics': metrics})))
+        open(os.path.join(self.tmpdir.name, 'gauges_102.json'), 'w').close()
+
+        conf['child_exit'](None, SimpleNamespace(pid=101))
+        self.assertEqual(sorted(n for n in os.listdir(self.tmpdir.name) if n.endswith('.json')),
+                         ['gauges_102.json', 'retained.json'])
+        self.assertEqual(Metrics(self.tmpdir.name).collect()[0], {('db_queries_total', ()): 2})
+
+        conf['on_starting'](None)
+        self.assertEqual([n for n in os.listdir(self.tmpdir.name) if n.endswith('.json')], [])
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for the orjson-backed JSON provider (byte-identical to the stdlib one)
+"""
+import json
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_provider
+from json_provider import FastJSONProvider
+
+
+def _stdlib_bytes(app, obj):
+    """What the stock provider returns once datetimes are pre-formatted"""
+    with app.app_context():
+        return DefaultJSONProvider(app).response(obj).get_data()
+
+
+class FastJSONProviderTestCase(unittest.TestCase):
+    """Test case for FastJSONProvider"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.json = FastJSONProvider(self.app)
+
+    def _bytes(self, obj):
+        with self.app.app_context():
+            return self.app.json.response(obj).get_data()
+
+    def test_001_matches_stdlib_bytes(self):
+        """Test a typical list body encodes to exactly the stdlib bytes"""
+        created = datetime(2025, 10, 31, 1, 59, 14, 890404)
+        rows = [{'name': f'Actor {i}', 'id': i, 'age': 30 + i, 'score': 0.25 * i,
+                 'created_at': created, 'tags': [None, True]} for i in range(3)]
+        formatted = [{**row, 'created_at': created.isoformat()} for row in rows]
+
+        self.assertEqual(
+            self._bytes({'success': True, 'actors': rows}),
+            _stdlib_bytes(self.app, {'success': True, 'actors': formatted})
+        )
+
+    def test_002_fallbacks_keep_stdlib_format(self):
+        """Test non-ASCII text, DEL, exponent floats and big ints match the stdlib bytes"""
+        for obj in ({'name': 'Zoë Saldaña'}, {'score': 1e-06}, {'big': 2 ** 70}, {1: 'int key'},
+                    {'name': 'del \x7f'}, {'name': 'emoji \U0001f600, slashes \\x41 \\U0001'}):
+            self.assertEqual(self._bytes(obj), _stdlib_bytes(self.app, obj), obj)
+
+    def test_003_orjson_used_when_available(self):
+        """Test the fast path is taken for plain payloads"""
+        if json_provider.orjson is None:
+            self.skipTest('orjson is not installed')
+        with mock.patch.object(json_provider.orjson, 'dumps', wraps=json_provider.orjson.dumps) as dumps:
+            self._bytes({'ok': True})
+
+        dumps.assert_called_once()
+
+    def test_004_stdlib_fallback_formats_datetimes(self):
+        """Test datetimes are ISO 8601 without orjson too"""
+        self.app.json.use_orjson = False
+        created = datetime(2025, 1, 2, 3, 4, 5)
+
+        self.assertEqual(self._bytes({'created_at': created}), b'{"created_at":"2025-01-02T03:04:05"}\n')
+
+    def test_005_fallbacks_format_dates_once(self):
+        """Test non-ASCII and exponent payloads never call default per date"""
+        if json_provider.orjson is None:
+            self.skipTest('orjson is not installed')
+        created = datetime(2025, 1, 2, 3, 4, 5)
+        for obj in ({'name': 'Zoë', 'created_at': created}, {'score': 1e-06, 'created_at': created}):
+            with mock.patch.object(self.app.json, 'default', side_effect=AssertionError):
+                data = self._bytes(obj)
+            self.assertIn(b'"created_at":"2025-01-02T03:04:05"', data)
+
+    def test_006_nan_and_infinity_are_null(self):
+        """Test NaN and infinities encode as null with orjson, without it, and when pretty"""
+        obj = {'a': float('nan'), 'b': [float('inf'), -float('inf')], 'c': 'Zoë'}
+        for use_orjson, debug in ((True, False), (False, False), (True, True)):
+            self.app.json.use_orjson = use_orjson and json_provider.orjson is not None
+            self.app.debug = debug
+            self.assertEqual(json.loads(self._bytes(obj)), {'a': None, 'b': [None, None], 'c': 'Zoë'})
+
+    def test_007_debug_output_is_pretty(self):
+        """Test debug mode keeps the stdlib's indented output"""
+        self.app.debug = True
+
+        self.assertEqual(self._bytes({'a': 1}), b'{\n  "a": 1\n}\n')
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Startup tests: creating the app touches no database and fits a time budget
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from app import create_app
+from models import setup_db
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Nothing listens here: any connection attempt during startup fails loudly
+UNREACHABLE_DB = 'postgresql://nobody@127.0.0.1:9/capstone'
+
+# Cold `import app` in a fresh interpreter (about 0.8s measured, mostly
+# Flask/SQLAlchemy/pydantic imports) and a warm create_app + setup_db.
+COLD_IMPORT_BUDGET = 2.0
+CREATE_APP_BUDGET = 0.1
+
+COLD_IMPORT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'app': app.APP is not None,
+    'alembic': 'alembic' in sys.modules,
+}))
+'''
+
+
+class StartupTestCase(unittest.TestCase):
+    """Test case for side-effect-free app creation"""
+
+    def test_001_cold_import_within_budget(self):
+        """Test `import app` builds APP without a database and within budget"""
+        env = {k: v for k, v in os.environ.items()
+               if k not in ('FLASK_TESTING', 'FLASK_SKIP_APP_INIT_FOR_TESTS')}
+        env['DATABASE_URL'] = UNREACHABLE_DB
+        proc = subprocess.run([sys.executable, '-c', COLD_IMPORT], cwd=ROOT, env=env,
+                              capture_output=True, text=True, timeout=60)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        result = json.loads(proc.stdout.splitlines()[-1])
+
+        self.assertTrue(result['app'])
+        # Migrations are loaded by `flask db` only
+        self.assertFalse(result['alembic'])
+        self.assertLess(result['seconds'], COLD_IMPORT_BUDGET)
+
+    def test_002_create_app_opens_no_connections(self):
+        """Test create_app + setup_db makes no database round trip"""
+        connects = []
+
+        def record(dbapi_connection, connection_record):
+            connects.append(dbapi_connection)
+        event.listen(Pool, 'connect', record)
+        self.addCleanup(event.remove, Pool, 'connect', record)
+
+        # Garbage left by earlier tests would otherwise be collected on our clock
+        gc.collect()
+        started = time.perf_counter()
+        app = create_app()
+        setup_db(app, UNREACHABLE_DB)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(connects, [])
+        self.assertLess(elapsed, CREATE_APP_BUDGET)
+
+
+# Run the tests
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Per-request stage timing.
+
+Each request records how long it spent in authentication, SQL, Pydantic
+validation and JSON serialization. The totals go back to the client as a
+``Server-Timing`` header (visible in browser dev tools) and to the
+``timing`` logger as one JSON line per request:
+
+    Server-Timing: auth;dur=0.42, db;dur=3.10;desc="4 queries",
+                   serialize;dur=0.21, total;dur=4.87
+
+SQL time comes from engine cursor events, so it covers the primary and the
+read replicas alike; callables in ``RequestTimings.on_statement`` see each
+statement as well. The other stages are marked with ``timed(stage)``.
+Outside a timed request ``timed`` only checks for an app context, and a
+timed request costs two ``perf_counter`` calls per stage or query.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from flask.logging import wsgi_errors_stream
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('timing')
+
+# Header order; any other stage follows in the order it was first recorded
+STAGES = ('auth', 'db', 'validate', 'serialize')
+
+
+class RequestTimings:
+    """Stage durations (seconds) and the query count for one request."""
+
+    __slots__ = ('started', 'stages', 'queries', 'on_statement')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        # Called as (statement, parameters, executemany, seconds) after each statement
+        self.on_statement = []
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def header(self, total):
+        """The ``Server-Timing`` value, durations in milliseconds."""
+        names = [s for s in STAGES if s in self.stages]
+        names.extend(s for s in self.stages if s not in STAGES)
+        metrics = []
+        for name in names:
+            metric = f'{name};dur={self.stages[name] * 1000:.2f}'
+            if name == 'db':
+                metric += f';desc="{self.queries} quer{"y" if self.queries == 1 else "ies"}"'
+            metrics.append(metric)
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def current_timings():
+    """This request's timings, or None outside a timed request."""
+    return g.get('timings') if has_app_context() else None
+
+
+@contextmanager
+def timed(stage):
+    """Adds the time spent in the block to ``stage`` of the current request."""
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_timings() is not None:
+        context._timing_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_timing_started', None)
+    timings = current_timings() if started is not None else None
+    if timings is not None:
+        seconds = time.perf_counter() - started
+        timings.add('db', seconds)
+        timings.queries += 1
+        for listener in timings.on_statement:
+            listener(statement, parameters, executemany, seconds)
+
+
+class ServerTiming:
+    """Starts timings per request and reports them once the response is built."""
+
+    def __init__(self, header=True, log=True, collect=False):
+        self.header = header
+        self.log = log
+        # Time requests even when nothing here reports them (/metrics and
+        # the query watch read them)
+        self.collect = collect
+
+    @classmethod
+    def from_config(cls, config):
+        watch_queries = bool(config['SLOW_QUERY_MS'] or config['N_PLUS_ONE_THRESHOLD'])
+        return cls(header=config['SERVER_TIMING'], log=config['SERVER_TIMING_LOG'],
+                   collect=config['METRICS'] or watch_queries)
+
+    def init_app(self, app):
+        app.extensions['server_timing'] = self
+        if not (self.header or self.log or self.collect):
+            return
+        # Engine-wide: every engine any app creates, replicas included
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        if self.log and not logger.handlers:
+            handler = logging.StreamHandler(wsgi_errors_stream)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.timings = RequestTimings()
+
+    def _finish(self, response):
+        timings = g.get('timings')
+        if timings is None or not (self.header or self.log):
+            return response
+        total = timings.elapsed()
+        if self.header:
+            response.headers['Server-Timing'] = timings.header(total)
+        if self.log and logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method,
+                'route': request.url_rule.rule if request.url_rule else None,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 3),
+                'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.stages.items()},
+                'queries': timings.queries,
+            }, separators=(',', ':')))
+        return response